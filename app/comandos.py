@@ -0,0 +1,89 @@
+"""
+Comandos de línea de órdenes (flask <comando>).
+"""
+import os
+
+import click
+
+from app.servicios import archivo_historico, carga_masiva, importar_usuarios as importacion, ingesta_actividades
+
+
+@click.command('particionar-actividades')
+@click.option('--meses-futuros', default=3, show_default=True, help='Particiones a crear por adelantado')
+def particionar_actividades(meses_futuros):
+    """Particiona por mes la tabla de actividades (MySQL) o crea las particiones faltantes."""
+    creadas = archivo_historico.particionar_mysql(meses_futuros)
+    click.echo(f"Particiones creadas: {creadas}")
+
+
+@click.command('archivar-actividades')
+@click.option('--dias', type=int, default=None, help='Horizonte en días (por defecto ARCHIVO_HORIZONTE_DIAS)')
+def archivar_actividades(dias):
+    """Mueve a Parquet las actividades más antiguas que el horizonte."""
+    total, corte = archivo_historico.archivar_actividades(dias)
+    click.echo(f"Actividades archivadas: {total} (anteriores a {corte.isoformat()})")
+
+
+@click.command('agregar-huellas')
+def agregar_huellas():
+    """Calcula las huellas de las actividades existentes, elimina duplicados y crea el índice único."""
+    calculadas, eliminadas = ingesta_actividades.agregar_huellas()
+    click.echo(f"Huellas calculadas: {calculadas}. Duplicados eliminados: {eliminadas}")
+
+
+@click.command('agregar-columnas-imagen')
+def agregar_columnas_imagen():
+    """Agrega a la tabla de actividades las columnas de enlace a la hoja archivada."""
+    agregadas = ingesta_actividades.agregar_columnas_imagen()
+    click.echo(f"Columnas agregadas: {', '.join(agregadas) or 'ninguna'}")
+
+
+@click.command('cargar-hojas')
+@click.argument('directorio', type=click.Path(exists=True, file_okay=False))
+@click.option('--usuario-id', type=int, required=True, help='Operario al que se asignan las actividades')
+@click.option('--turno', default='Mañana', show_default=True)
+@click.option('--fecha', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Fecha de todas las hojas (por defecto, la del nombre o del archivo)')
+@click.option('--procesos', type=int, default=os.cpu_count(), show_default=True)
+@click.option('--prioridad', type=int, default=10, show_default=True, help='Valor nice de los procesos OCR')
+@click.option('--hilos', type=int, default=1, show_default=True, help='Hilos de CPU por motor OCR')
+@click.option('--lote', type=int, default=200, show_default=True, help='Filas por transacción')
+@click.option('--reintentar', is_flag=True, help='Volver a procesar las hojas que fallaron')
+@click.option('--manifiesto', type=click.Path(dir_okay=False), default=None,
+              help='Archivo de avance (por defecto, dentro del directorio)')
+def cargar_hojas(directorio, usuario_id, turno, fecha, procesos, prioridad, hilos, lote, reintentar, manifiesto):
+    """Carga con OCR las imágenes de hojas de turno de DIRECTORIO, reanudando si se interrumpió."""
+    def progreso(hechas, total, velocidad):
+        click.echo(f"\r{hechas}/{total} hojas · {velocidad:.2f} hojas/s", nl=False)
+
+    resumen = carga_masiva.cargar_hojas(directorio, usuario_id, turno, fecha.date() if fecha else None,
+                                        procesos, prioridad, hilos, lote, reintentar, manifiesto, progreso)
+    click.echo()
+    for clave, valor in resumen.items():
+        if clave != 'errores':
+            click.echo(f"{clave}: {valor}")
+    for relativa, error in resumen.get('errores', {}).items():
+        click.echo(f"  {relativa}: {error}", err=True)
+
+
+@click.command('importar-usuarios')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--procesos', type=int, default=os.cpu_count(), show_default=True, help='Procesos para cifrar contraseñas')
+@click.option('--estricto', is_flag=True, help='No importar nada si alguna fila tiene errores')
+def importar_usuarios(archivo, procesos, estricto):
+    """Crea los usuarios de un CSV (nombre_completo, documento, contraseña, rol)."""
+    with open(archivo, 'rb') as entrada:
+        filas = importacion.leer_csv(entrada.read())
+    resultado = importacion.importar_usuarios(filas, estricto=estricto, procesos=procesos)
+    click.echo(f"Usuarios creados: {resultado['creados']} de {resultado['total']}")
+    for fallo in resultado['errores']:
+        click.echo(f"  fila {fallo['fila']} ({fallo['documento'] or 'sin documento'}): {fallo['error']}", err=True)
+
+
+def registrar_comandos(app):
+    app.cli.add_command(particionar_actividades)
+    app.cli.add_command(archivar_actividades)
+    app.cli.add_command(agregar_huellas)
+    app.cli.add_command(agregar_columnas_imagen)
+    app.cli.add_command(cargar_hojas)
+    app.cli.add_command(importar_usuarios)
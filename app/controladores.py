@@ -3,7 +3,8 @@ import cv2
 import os
 import logging
 import numpy as np
-from flask import Blueprint, jsonify, render_template, request, redirect, session, url_for, flash, abort
+import pandas as pd
+from flask import Blueprint, jsonify, render_template, request, redirect, session, url_for, flash, abort, make_response, Response, current_app, send_file
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from sqlalchemy import func
@@ -13,6 +14,22 @@ from paddleocr import PaddleOCR
 from extensions import db, login_manager, bcrypt
 from app.models import Usuario, Actividad
 from app.servicios.ocr_servicio import extraer_filas_columnas, procesar_imagen_tabular
+from app.servicios.datos_referencia import referencias
+from app.servicios.cache_plantillas import memorizar, cache_fragmentos
+from app.servicios.cache_consultas import actividades_filtradas, normalizar_filtros, cache_consultas
+from app.servicios.feed_cambios import feed_actividades
+from app.servicios.ingesta_pdf import encolar_pdf, estado_trabajo, flujo_trabajo
+from app.servicios.registros_ocr import registro_a_fila
+from app.servicios.ingesta_actividades import guardar_actividades
+from app.servicios.archivo_historico import consultar_actividades, conteo_por_fecha
+from app.servicios import perfilador
+from app.servicios import importar_usuarios as importacion
+from app.servicios.analitica import productividad
+from app.servicios.memoria import informe_memoria
+from app.servicios import archivo_imagenes
+from app.servicios.archivo_imagenes import bbox_a_texto, texto_a_bbox
+from app.servicios.auditoria import consultar_auditoria, escritor as escritor_auditoria
+from app.servicios.perfilador import etiquetar
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -144,27 +161,19 @@ def dashboard_admin():
     # Asegurarse de que fecha_fin incluya todo el día
     fecha_fin_dt = fecha_fin_dt.replace(hour=23, minute=59, second=59)
     
-    # Obtener actividades dentro del rango de fechas para la gráfica
-    actividades_filtradas = Actividad.query.filter(
-        Actividad.fecha >= fecha_inicio_dt,
-        Actividad.fecha <= fecha_fin_dt
-    ).order_by(Actividad.fecha.asc()).all()
-    
-    # Preparar datos para la gráfica de actividades por fecha
-    actividades_por_fecha = {}
-    for actividad in actividades_filtradas:
-        fecha_str = actividad.fecha.strftime('%Y-%m-%d')
-        actividades_por_fecha[fecha_str] = actividades_por_fecha.get(fecha_str, 0) + 1
-    
-    # Ordenar fechas y obtener datos para la gráfica
-    fechas_ordenadas = sorted(actividades_por_fecha.keys())
-    conteo_actividades = [actividades_por_fecha[fecha] for fecha in fechas_ordenadas]
-    
-    # Obtener conteo de usuarios por rol
-    admin_count = Usuario.query.filter_by(rol='Admin').count()
-    analista_count = Usuario.query.filter_by(rol='Analista').count()
-    operario_count = Usuario.query.filter_by(rol='Operario').count()
-    roles_conteo = [admin_count, analista_count, operario_count]
+    # Datos de las gráficas: agregados en SQL y cacheados por versión de datos
+    @etiquetar('dashboard.graficas_admin')
+    def calcular_graficas():
+        conteos = conteo_por_fecha(fecha_inicio_dt.date(), fecha_fin_dt.date())
+        roles = dict(db.session.query(Usuario.rol, func.count(Usuario.id)).group_by(Usuario.rol).all())
+        return (
+            [fecha.strftime('%Y-%m-%d') for fecha, _ in conteos],
+            [conteo for _, conteo in conteos],
+            [roles.get('Admin', 0), roles.get('Analista', 0), roles.get('Operario', 0)]
+        )
+
+    fechas_ordenadas, conteo_actividades, roles_conteo = memorizar(
+        'admin_datos_graficas', fecha_inicio, fecha_fin, funcion=calcular_graficas)
     
     # Obtener la fecha de la última actividad
     ultima_actividad = Actividad.query.order_by(Actividad.fecha.desc()).first()
@@ -190,6 +199,12 @@ def dashboard_admin():
 
 from datetime import datetime
 
+def url_pagina_siguiente(pagina):
+    """URL de la página siguiente con los mismos filtros (None en la última)"""
+    if not pagina.cursor_siguiente:
+        return None
+    return url_for(request.endpoint, **{**request.args.to_dict(), 'cursor': pagina.cursor_siguiente})
+
 @admin_bp.route('/actividades')
 @login_required
 def actividades():
@@ -203,31 +218,11 @@ def actividades():
     fecha_inicio = request.args.get('fecha_inicio', '')
     fecha_fin = request.args.get('fecha_fin', '')
     
-    # Construir consulta base
-    query = Actividad.query
-    
-    # Aplicar filtros
-    if texto:
-        query = query.filter(
-            (Actividad.codigo_actividad.ilike(f'%{texto}%')) |
-            (Actividad.descripcion_actividad.ilike(f'%{texto}%')) |
-            (Actividad.referencia_producto.ilike(f'%{texto}%'))
-        )
-    
-    if turno:
-        query = query.filter(Actividad.turno == turno)
-    
-    if usuario_id:
-        query = query.filter(Actividad.usuario_id == usuario_id)
-    
-    if fecha_inicio:
-        query = query.filter(Actividad.fecha >= fecha_inicio)
-    
-    if fecha_fin:
-        query = query.filter(Actividad.fecha <= fecha_fin)
-    
-    # Obtener actividades y usuarios
-    actividades = query.order_by(Actividad.fecha.desc(), Actividad.hora_inicio.desc()).all()
+    # Consulta filtrada servida desde la caché de resultados (tuplas, no objetos ORM)
+    pagina = actividades_filtradas(normalizar_filtros(
+        texto=texto, turno=turno, usuario_id=usuario_id, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin,
+        cursor=request.args.get('cursor', ''), limite=current_app.config.get('ACTIVIDADES_POR_PAGINA', 0)))
+    actividades = pagina.filas
     usuarios = Usuario.query.all()
     
     # Obtener fecha de hoy para el filtro
@@ -235,6 +230,7 @@ def actividades():
     
     return render_template('admin/trabajos/index.html',
                          actividades=actividades,
+                         pagina_siguiente=url_pagina_siguiente(pagina),
                          usuarios=usuarios,
                          hoy=hoy,
                          ultima_actualizacion=datetime.now().strftime('%H:%M'),
@@ -245,6 +241,177 @@ def actividades():
                              'fecha_inicio': fecha_inicio,
                              'fecha_fin': fecha_fin
                          })
+# 🔹 Flujo en vivo de cambios (Server-Sent Events)
+@admin_bp.route('/actividades/stream')
+@login_required
+def stream_actividades():
+    if current_user.rol != 'Admin':
+        abort(403)
+
+    feed_actividades.iniciar_total(lambda: Actividad.query.count())
+
+    # Reanudar desde el último evento recibido si el navegador reconecta
+    return Response(feed_actividades.flujo(request.headers.get('Last-Event-ID')),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# 🔹 Cargar PDF escaneado (se procesa en segundo plano)
+@admin_bp.route('/cargar_pdf', methods=['POST'])
+@login_required
+def cargar_pdf():
+    if current_user.rol != 'Admin':
+        abort(403)
+
+    archivo = request.files.get('pdf_file')
+    es_ajax = request.accept_mimetypes.best == 'application/json'
+
+    if not archivo or not archivo.filename.lower().endswith('.pdf'):
+        if es_ajax:
+            return jsonify({'error': 'Debe seleccionar un archivo PDF'}), 400
+        flash('Debe seleccionar un archivo PDF', 'danger')
+        return redirect(url_for('admin.actividades'))
+
+    try:
+        fecha = datetime.strptime(request.form.get('fecha', ''), '%Y-%m-%d').date()
+    except ValueError:
+        fecha = date.today()
+    usuario_id = request.form.get('usuario_id', type=int)
+    if usuario_id is None:
+        usuario_id = current_user.id
+    elif Usuario.query.filter_by(id=usuario_id, rol='Operario').first() is None:
+        if es_ajax:
+            return jsonify({'error': 'El operario seleccionado no existe'}), 400
+        flash('El operario seleccionado no existe', 'danger')
+        return redirect(url_for('admin.actividades'))
+
+    nombre_archivo = secure_filename(archivo.filename)
+    ruta = os.path.join(UPLOAD_FOLDER, f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{nombre_archivo}")
+    archivo.save(ruta)
+
+    trabajo = encolar_pdf(current_app._get_current_object(), ruta, nombre_archivo, usuario_id, fecha,
+                          request.form.get('turno', 'Mañana'))
+
+    if es_ajax:
+        return jsonify({
+            'id': trabajo.id,
+            'estado': url_for('admin.estado_pdf', trabajo_id=trabajo.id),
+            'stream': url_for('admin.stream_pdf', trabajo_id=trabajo.id),
+        }), 202
+    flash(f'El PDF {nombre_archivo} se está procesando en segundo plano', 'success')
+    return redirect(url_for('admin.actividades'))
+
+@admin_bp.route('/pdf/<trabajo_id>')
+@login_required
+def estado_pdf(trabajo_id):
+    if current_user.rol != 'Admin':
+        abort(403)
+
+    estado = estado_trabajo(trabajo_id)
+    if estado is None:
+        abort(404)
+    return jsonify(estado)
+
+@admin_bp.route('/pdf/<trabajo_id>/stream')
+@login_required
+def stream_pdf(trabajo_id):
+    if current_user.rol != 'Admin':
+        abort(403)
+
+    flujo = flujo_trabajo(trabajo_id)
+    if flujo is None:
+        abort(404)
+    return Response(flujo,
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# 🔹 Perfilado bajo demanda
+@admin_bp.route('/perfil')
+@login_required
+def estado_perfil():
+    if current_user.rol != 'Admin':
+        abort(403)
+    return jsonify(perfilador.estado())
+
+@admin_bp.route('/perfil/peticiones', methods=['POST'])
+@login_required
+def perfilar_peticiones():
+    if current_user.rol != 'Admin':
+        abort(403)
+    endpoint = request.values.get('endpoint', '')
+    if endpoint not in current_app.view_functions:
+        return jsonify({'error': f'Endpoint desconocido: {endpoint}'}), 400
+    cantidad = max(1, min(request.values.get('cantidad', 10, type=int), current_app.config['PERFIL_MAX_PETICIONES']))
+    perfilador.perfilar_peticiones(endpoint, cantidad)
+    return jsonify(perfilador.estado()), 202
+
+@admin_bp.route('/perfil/cancelar', methods=['POST'])
+@login_required
+def cancelar_perfil():
+    if current_user.rol != 'Admin':
+        abort(403)
+    perfilador.cancelar()
+    return jsonify(perfilador.estado())
+
+@admin_bp.route('/perfil/muestreo')
+@login_required
+def muestrear_proceso():
+    if current_user.rol != 'Admin':
+        abort(403)
+    segundos = max(0.1, min(request.args.get('segundos', 10, type=float), current_app.config['PERFIL_MAX_SEGUNDOS']))
+    intervalo = max(1, request.args.get('intervalo_ms', 5, type=int)) / 1000
+    try:
+        plegado = perfilador.muestrear(segundos, intervalo)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(plegado, mimetype='text/plain')
+
+@admin_bp.route('/perfil/resultado')
+@login_required
+def resultado_perfil():
+    if current_user.rol != 'Admin':
+        abort(403)
+    captura = perfilador.ultima_captura()
+    if captura is None:
+        abort(404)
+    if request.args.get('formato') == 'prof' and captura['tipo'] == 'peticiones':
+        return Response(perfilador.como_prof(captura), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f"attachment; filename={captura['endpoint']}.prof"})
+    return Response(perfilador.como_texto(captura, request.args.get('orden', 'cumulative')),
+                    mimetype='text/plain')
+
+# 🔹 Memoria única y compartida de los workers
+@admin_bp.route('/memoria')
+@login_required
+def memoria_workers():
+    if current_user.rol != 'Admin':
+        abort(403)
+    return jsonify(informe_memoria(current_app.config.get('PID_MAESTRO', os.getpid())))
+
+# 🔹 Registro de auditoría (quién cambió qué y cuándo)
+@admin_bp.route('/auditoria')
+@login_required
+def auditoria():
+    if current_user.rol != 'Admin':
+        abort(403)
+    registros = consultar_auditoria(
+        tabla=request.args.get('tabla') or None,
+        registro_id=request.args.get('registro_id', type=int),
+        usuario_id=request.args.get('usuario_id', type=int),
+        limite=min(request.args.get('limite', 100, type=int), 1000))
+    return jsonify({'registros': registros, 'escritor': escritor_auditoria.estadisticas()})
+
+# 🔹 Métricas de las cachés (por worker)
+@admin_bp.route('/metricas/cache')
+@login_required
+def metricas_cache():
+    if current_user.rol != 'Admin':
+        abort(403)
+    return jsonify({
+        'pid': os.getpid(),
+        'consultas_actividades': cache_consultas.estadisticas(),
+        'fragmentos': cache_fragmentos.estadisticas(),
+    })
+
 # 🔹 Crear actividad
 @admin_bp.route("/crear_actividad", methods=["POST"])
 def crear_actividad():
@@ -357,6 +524,41 @@ def nuevo_usuario():
         flash('Error al crear el usuario.', 'danger')
 
     return redirect(url_for('admin.gestion_usuarios'))
+
+# Importar usuarios desde CSV
+@admin_bp.route('/usuarios/importar', methods=['POST'])
+@login_required
+def importar_usuarios():
+    if current_user.rol != 'Admin':
+        abort(403)
+
+    quiere_json = request.accept_mimetypes.best == 'application/json'
+    archivo = request.files.get('archivo_csv')
+    error = None
+    if not archivo or not archivo.filename.lower().endswith('.csv'):
+        error = 'Debe seleccionar un archivo CSV'
+    else:
+        try:
+            filas = importacion.leer_csv(archivo.read())
+        except UnicodeDecodeError:
+            error = 'El archivo debe estar codificado en UTF-8'
+    if error:
+        if quiere_json:
+            return jsonify({'error': error}), 400
+        flash(f'{error}.', 'danger')
+        return redirect(url_for('admin.gestion_usuarios'))
+
+    resultado = importacion.importar_usuarios(filas, estricto=request.form.get('estricto') == '1')
+    if quiere_json:
+        return jsonify(resultado)
+
+    flash(f"Usuarios creados: {resultado['creados']} de {resultado['total']}.",
+          'success' if not resultado['errores'] else 'warning')
+    for fallo in resultado['errores'][:20]:
+        flash(f"Fila {fallo['fila']} ({fallo['documento'] or 'sin documento'}): {fallo['error']}", 'danger')
+    if len(resultado['errores']) > 20:
+        flash(f"... y {len(resultado['errores']) - 20} errores más.", 'danger')
+    return redirect(url_for('admin.gestion_usuarios'))
 # Editar usuario
 @admin_bp.route('/usuario/<int:id>/editar', methods=['POST'])
 @login_required
@@ -400,47 +602,37 @@ def dashboard_analista():
     fecha_fin_grafica = request.args.get('fecha_fin_grafica', datetime.now().strftime('%Y-%m-%d'))
     agrupacion = request.args.get('agrupacion', 'dia')
 
-    # Construir consulta base para actividades
-    query = Actividad.query
-
-    # Aplicar filtros de búsqueda
-    if busqueda:
-        query = query.join(Usuario).filter(
-            (Usuario.nombre_completo.ilike(f'%{busqueda}%')) | 
-            (Usuario.documento.ilike(f'%{busqueda}%'))
-        )
-
-    # Aplicar filtros de fecha
-    if fecha_inicio:
-        try:
-            fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d')
-            query = query.filter(Actividad.fecha >= fecha_inicio_dt)
-        except ValueError:
-            pass
-
-    if fecha_fin:
-        try:
-            fecha_fin_dt = datetime.strptime(fecha_fin, '%Y-%m-%d')
-            query = query.filter(Actividad.fecha <= fecha_fin_dt)
-        except ValueError:
-            pass
-
-    # Obtener actividades filtradas
-    actividades = query.order_by(Actividad.fecha.desc()).all()
+    # Actividades filtradas servidas desde la caché de resultados
+    pagina = actividades_filtradas(normalizar_filtros(
+        busqueda=busqueda, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin, cursor=request.args.get('cursor', ''),
+        limite=current_app.config.get('ACTIVIDADES_POR_PAGINA', 0)))
+    actividades = pagina.filas
 
     # Calcular estadísticas básicas
     hoy = datetime.now().date()
     total_cantidad = sum(act.cantidad_trabajada for act in actividades if act.cantidad_trabajada)
     
     # Operarios únicos (solo rol Operario)
-    operarios_unicos = list(set(act.usuario for act in actividades if act.usuario.rol == 'Operario'))
+    operarios_unicos = list(set(act.usuario for act in actividades if act.usuario and act.usuario.rol == 'Operario'))
     
-    # Preparar datos para las gráficas
-    datos_graficas = obtener_datos_graficas(fecha_inicio_grafica, fecha_fin_grafica, agrupacion)
+    # Preparar datos para las gráficas (cacheados por versión de datos)
+    datos_graficas = memorizar(
+        'analista_datos_graficas', fecha_inicio_grafica, fecha_fin_grafica, agrupacion,
+        funcion=lambda: obtener_datos_graficas(fecha_inicio_grafica, fecha_fin_grafica, agrupacion))
+
+    # Indicadores de productividad del mismo rango de las gráficas
+    try:
+        indicadores = productividad(datetime.strptime(fecha_inicio_grafica, '%Y-%m-%d').date(),
+                                    datetime.strptime(fecha_fin_grafica, '%Y-%m-%d').date(), agrupacion)
+    except Exception as e:
+        logger.error(f"Error calculando indicadores de productividad: {str(e)}")
+        indicadores = None
 
     return render_template('analista/dashboard_analista.html',
                          actividades=actividades,
+                         pagina_siguiente=url_pagina_siguiente(pagina),
                          datos_graficas=datos_graficas,
+                         indicadores=indicadores,
                          fecha_inicio_default=(datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d'),
                          fecha_fin_default=datetime.now().strftime('%Y-%m-%d'),
                          hoy=hoy,
@@ -449,75 +641,52 @@ def dashboard_analista():
                          now=datetime.now())
 
 
+@etiquetar('dashboard.graficas_analista')
 def obtener_datos_graficas(fecha_inicio, fecha_fin, agrupacion):
     """Obtiene datos para las gráficas basado en los filtros"""
     try:
-        # Convertir fechas a objetos datetime
-        fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d')
-        fecha_fin_dt = datetime.strptime(fecha_fin, '%Y-%m-%d')
-        
-        # Consulta base para el período seleccionado
-        query = Actividad.query.filter(
-            Actividad.fecha.between(fecha_inicio_dt, fecha_fin_dt)
-        )
+        # Convertir fechas a objetos date
+        fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
+        fecha_fin_dt = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
         
-        actividades_periodo = query.all()
+        # Columnas del período seleccionado (tabla + archivo histórico)
+        datos = consultar_actividades(fecha_inicio_dt, fecha_fin_dt,
+                                      ['fecha', 'turno', 'cantidad_trabajada', 'usuario_id'])
+        if datos.empty:
+            raise ValueError("Sin actividades en el período")
         
-        # Datos para gráfica de actividades por fecha
+        # Etiqueta de grupo por fila (ya vienen ordenadas por fecha)
+        fechas_dt = pd.to_datetime(datos['fecha'])
         if agrupacion == 'dia':
-            fechas = [act.fecha.strftime('%Y-%m-%d') for act in actividades_periodo]
+            grupos = fechas_dt.dt.strftime('%Y-%m-%d')
         elif agrupacion == 'semana':
-            fechas = [f"Semana {act.fecha.isocalendar()[1]}-{act.fecha.year}" for act in actividades_periodo]
+            grupos = 'Semana ' + fechas_dt.dt.isocalendar().week.astype(str) + '-' + fechas_dt.dt.year.astype(str)
         else:  # mes
-            fechas = [act.fecha.strftime('%Y-%m') for act in actividades_periodo]
+            grupos = fechas_dt.dt.strftime('%Y-%m')
         
         # Contar actividades por grupo
-        from collections import defaultdict
-        actividades_por_grupo = defaultdict(int)
-        for i, fecha in enumerate(fechas):
-            actividades_por_grupo[fecha] += 1
+        actividades_por_grupo = grupos.value_counts(sort=False)
         
         # Datos para gráfica de turnos
-        turnos_count = {'Mañana': 0, 'Tarde': 0, 'Noche': 0}
-        for act in actividades_periodo:
-            if act.turno in turnos_count:
-                turnos_count[act.turno] += 1
+        turnos_count = datos['turno'].value_counts()
         
         # Top 5 operarios
-        from collections import Counter
-        operarios_count = Counter()
-        for act in actividades_periodo:
-            if act.usuario.rol == 'Operario':
-                operarios_count[act.usuario.nombre_completo] += 1
-        
-        top_operarios = operarios_count.most_common(5)
+        operarios = dict(db.session.query(Usuario.id, Usuario.nombre_completo)
+                         .filter(Usuario.rol == 'Operario').all())
+        top_operarios = datos.loc[datos['usuario_id'].isin(operarios), 'usuario_id']\
+            .map(operarios).value_counts().head(5)
         
         # Producción acumulada
-        produccion_acumulada = []
-        acumulado = 0
-        fechas_unicas = sorted(set(fechas))
-        
-        for fecha in fechas_unicas:
-            if agrupacion == 'dia':
-                actividades_fecha = [act for act in actividades_periodo if act.fecha.strftime('%Y-%m-%d') == fecha]
-            elif agrupacion == 'semana':
-                semana, year = fecha.split('-')
-                actividades_fecha = [act for act in actividades_periodo 
-                                   if f"Semana {act.fecha.isocalendar()[1]}-{act.fecha.year}" == fecha]
-            else:
-                actividades_fecha = [act for act in actividades_periodo 
-                                   if act.fecha.strftime('%Y-%m') == fecha]
-            
-            acumulado += sum(act.cantidad_trabajada for act in actividades_fecha if act.cantidad_trabajada)
-            produccion_acumulada.append(acumulado)
+        produccion_acumulada = datos['cantidad_trabajada'].fillna(0)\
+            .groupby(grupos, sort=False).sum().cumsum()
         
         return {
-            'fechas': list(actividades_por_grupo.keys()),
-            'cantidades': list(actividades_por_grupo.values()),
-            'turnos': [turnos_count['Mañana'], turnos_count['Tarde'], turnos_count['Noche']],
-            'top_operarios_nombres': [op[0] for op in top_operarios],
-            'top_operarios_cantidades': [op[1] for op in top_operarios],
-            'produccion_acumulada': produccion_acumulada
+            'fechas': actividades_por_grupo.index.tolist(),
+            'cantidades': [int(c) for c in actividades_por_grupo.tolist()],
+            'turnos': [int(turnos_count.get(turno, 0)) for turno in ('Mañana', 'Tarde', 'Noche')],
+            'top_operarios_nombres': top_operarios.index.tolist(),
+            'top_operarios_cantidades': [int(c) for c in top_operarios.tolist()],
+            'produccion_acumulada': [int(c) for c in produccion_acumulada.tolist()]
         }
         
     except Exception as e:
@@ -540,9 +709,8 @@ def crear_actividad():
         try:
             # Validar que el usuario seleccionado sea un operario
             usuario_id = request.form.get('usuario_id')
-            usuario = Usuario.query.get(usuario_id)
             
-            if not usuario or usuario.rol != 'Operario':
+            if not referencias.es_valido('operario', usuario_id):
                 flash("Debe seleccionar un operario válido", "danger")
                 return redirect(url_for('analista.crear_actividad'))
             
@@ -569,8 +737,8 @@ def crear_actividad():
             logger.error(f"Error al crear actividad: {str(e)}")
             flash("Error al registrar la actividad", "danger")
 
-    # Solo mostrar usuarios con rol Operario
-    usuarios = Usuario.query.filter_by(rol='Operario').all()
+    # Solo mostrar usuarios con rol Operario (desde la caché de referencia)
+    usuarios = referencias.operarios()
     return render_template('analista/nuevo_trabajo.html',
                          usuarios=usuarios,
                          now=datetime.now())
@@ -585,9 +753,8 @@ def editar_actividad(id):
         try:
             # Validar que el usuario seleccionado sea un operario
             usuario_id = request.form.get('usuario_id')
-            usuario = Usuario.query.get(usuario_id)
             
-            if not usuario or usuario.rol != 'Operario':
+            if not referencias.es_valido('operario', usuario_id):
                 flash("Debe seleccionar un operario válido", "danger")
                 return redirect(url_for('analista.editar_actividad', id=id))
             
@@ -612,8 +779,8 @@ def editar_actividad(id):
             logger.error(f"Error al editar actividad: {str(e)}")
             flash("Error al actualizar la actividad", "danger")
 
-    # Solo mostrar usuarios con rol Operario
-    usuarios = Usuario.query.filter_by(rol='Operario').all()
+    # Solo mostrar usuarios con rol Operario (desde la caché de referencia)
+    usuarios = referencias.operarios()
     return render_template('analista/nuevo_trabajo.html',
                          actividad=actividad,
                          usuarios=usuarios,
@@ -667,38 +834,32 @@ def procesar_imagen():
             flash('El archivo no es una imagen válida', 'danger')
             return redirect(url_for('operario.dashboard_operario'))
 
-        # Procesar imagen
-        registros = procesar_imagen_tabular(ruta_temporal)
+        # Procesar imagen (ya cargada, no se vuelve a leer del disco)
+        registros = procesar_imagen_tabular(img)
         
         if not registros:
             flash('No se detectaron datos en la imagen. Asegúrese que la tabla es clara y está bien alineada.', 'warning')
             return redirect(url_for('operario.dashboard_operario'))
+
+        # Conservar la hoja (comprimida, en segundo plano) para revisar cada fila contra el original
+        with open(ruta_temporal, 'rb') as subida:
+            imagen_hash = archivo_imagenes.archivar(img, [r.get('bbox') for r in registros],
+                                                    hash_imagen=archivo_imagenes.calcular_hash(subida.read()))
         
-        # Guardar en base de datos
-        registros_guardados = 0
+        # Guardar en base de datos (una hoja ya cargada no se duplica)
+        filas = []
         for registro in registros:
             try:
-                actividad = Actividad(
-                    fecha=date.today(),
-                    turno='Mañana',
-                    hora_inicio=registro.get('hora_inicio', '00:00'),
-                    hora_final=registro.get('hora_final', '00:00'),
-                    codigo_actividad=registro.get('actividad_parada', ''),
-                    descripcion_actividad=registro.get('unidad_produccion', ''),
-                    codigo_equipo=registro.get('codigo_equipo', ''),
-                    orden_produccion=registro.get('referencia_producto', ''),
-                    cantidad_trabajada=int(registro.get('cantidad_trabajada', 0)),
-                    observaciones=registro.get('observaciones', ''),
-                    usuario_id=current_user.id
-                )
-                db.session.add(actividad)
-                registros_guardados += 1
+                referencias.corregir_registro(registro)
+                filas.append(registro_a_fila(registro, current_user.id, date.today(), imagen_hash=imagen_hash))
             except Exception as e:
                 logger.error(f"Error procesando registro: {str(e)}")
                 continue
         
+        resultado = guardar_actividades(filas)
         db.session.commit()
-        flash(f'Se registraron {registros_guardados} actividades correctamente', 'success')
+        flash(f'Se registraron {resultado.insertadas} actividades nuevas, se actualizaron '
+              f'{resultado.actualizadas} y se omitieron {resultado.omitidas} ya existentes', 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -718,6 +879,10 @@ def verificar_ocr():
     registros = []
     errores = []
     num_filas = len(request.form.getlist('hora_inicio'))
+    # Opcionales: hoja archivada de la que salieron las filas y caja de cada una
+    imagen_hash = request.form.get('imagen_hash', '')
+    imagen_hash = imagen_hash if archivo_imagenes.PATRON_HASH.match(imagen_hash) else None
+    cajas = request.form.getlist('imagen_bbox')
 
     for i in range(num_filas):
         try:
@@ -745,25 +910,30 @@ def verificar_ocr():
         return redirect(url_for('operario.dashboard_operario'))
 
     try:
-        for reg in registros:
-            actividad = Actividad(
-                usuario_id=current_user.id,
-                fecha=date.today(),
-                turno='Mañana',
-                hora_inicio=reg['hora_inicio'],
-                hora_final=reg['hora_final'],
-                codigo_actividad=reg['codigo_actividad'],
-                descripcion_actividad=reg['descripcion'],
-                codigo_equipo=reg['codigo_equipo'],
-                orden_produccion=reg['orden_produccion'],
-                referencia_producto=reg['referencia_producto'],
-                cantidad_trabajada=reg['cantidad'],
-                observaciones=reg['observaciones'],
-            )
-            db.session.add(actividad)
-
+        filas = [{
+            'usuario_id': current_user.id,
+            'fecha': date.today(),
+            'turno': 'Mañana',
+            'hora_inicio': reg['hora_inicio'],
+            'hora_final': reg['hora_final'],
+            'codigo_actividad': reg['codigo_actividad'],
+            'descripcion_actividad': reg['descripcion'],
+            'codigo_equipo': reg['codigo_equipo'],
+            'orden_produccion': reg['orden_produccion'],
+            'referencia_producto': reg['referencia_producto'],
+            'cantidad_trabajada': reg['cantidad'],
+            'observaciones': reg['observaciones'],
+            'imagen_hash': imagen_hash,
+            'imagen_bbox': bbox_a_texto(texto_a_bbox(cajas[i])) if imagen_hash and i < len(cajas) else None,
+        } for i, reg in enumerate(registros)]
+
+        # Reenviar el mismo formulario no duplica actividades
+        resultado = guardar_actividades(filas)
+        # Filas revisadas por el operario: sus códigos pasan al catálogo
+        referencias.confirmar_codigos(db.session, filas)
         db.session.commit()
-        flash("Actividades registradas exitosamente", "success")
+        flash(f"Actividades registradas: {resultado.insertadas} nuevas, {resultado.actualizadas} "
+              f"actualizadas, {resultado.omitidas} omitidas", "success")
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error al guardar actividades: {str(e)}")
@@ -779,23 +949,103 @@ def filtrar_actividades():
     inicio = request.args.get('inicio')
     fin = request.args.get('fin')
 
-    query = db.session.query(Actividad.fecha, func.count().label('conteo'))\
-                     .group_by(Actividad.fecha)
-
+    inicio_date = fin_date = None
     if inicio and fin:
         try:
             inicio_date = datetime.strptime(inicio, '%Y-%m-%d').date()
             fin_date = datetime.strptime(fin, '%Y-%m-%d').date()
-            query = query.filter(Actividad.fecha.between(inicio_date, fin_date))
         except ValueError:
             return jsonify({'error': 'Formato de fecha inválido'}), 400
 
-    resultados = query.order_by(Actividad.fecha).all()
-    fechas = [r.fecha.strftime('%Y-%m-%d') for r in resultados]
-    conteos = [r.conteo for r in resultados]
+    # Incluye las actividades archivadas si el rango es anterior al corte
+    resultados = conteo_por_fecha(inicio_date, fin_date)
+    fechas = [fecha.strftime('%Y-%m-%d') for fecha, _ in resultados]
+    conteos = [conteo for _, conteo in resultados]
 
     return jsonify({'fechas': fechas, 'conteos': conteos})
 
+@api_bp.route('/analitica/productividad')
+@login_required
+def productividad_api():
+    if current_user.rol not in ('Admin', 'Analista'):
+        abort(403)
+    try:
+        inicio = datetime.strptime(request.args.get('inicio', ''), '%Y-%m-%d').date()
+        fin = datetime.strptime(request.args.get('fin', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido'}), 400
+    agrupacion = request.args.get('agrupacion', 'dia')
+    if agrupacion not in ('dia', 'semana', 'mes'):
+        return jsonify({'error': 'Agrupación inválida'}), 400
+    return jsonify(productividad(inicio, fin, agrupacion))
+
+# Imágenes de hojas archivadas: el contenido de una URL nunca cambia (hash)
+CACHE_INMUTABLE = 'private, max-age=31536000, immutable'
+
+@api_bp.route('/imagenes/<hash_imagen>/<variante>')
+@login_required
+def imagen_hoja(hash_imagen, variante):
+    if current_user.rol not in ('Admin', 'Analista'):
+        abort(403)
+    ruta = archivo_imagenes.ruta_archivo(hash_imagen, variante)
+    if ruta is None:
+        abort(404)
+    respuesta = send_file(ruta, mimetype='image/jpeg', conditional=True, etag=f'{hash_imagen}-{variante}')
+    respuesta.headers['Cache-Control'] = CACHE_INMUTABLE
+    return respuesta
+
+@api_bp.route('/imagenes/<hash_imagen>/recorte')
+@login_required
+def recorte_hoja(hash_imagen):
+    if current_user.rol not in ('Admin', 'Analista'):
+        abort(403)
+    bbox = texto_a_bbox(request.args.get('bbox'))
+    ancho = archivo_imagenes.ancho_recorte(request.args.get('ancho', type=int))
+    etag = f"{hash_imagen}-{bbox_a_texto(bbox)}-{ancho or 0}"
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': CACHE_INMUTABLE})
+    contenido = archivo_imagenes.recorte(hash_imagen, bbox, ancho)
+    if contenido is None:
+        abort(404)
+    return Response(contenido, mimetype='image/jpeg', headers={'ETag': f'"{etag}"', 'Cache-Control': CACHE_INMUTABLE})
+
+@api_bp.route('/actividades/<int:id>/recorte')
+@login_required
+def recorte_actividad(id):
+    """Redirige al recorte de la fila de la actividad en su hoja de origen"""
+    if current_user.rol not in ('Admin', 'Analista'):
+        abort(403)
+    actividad = Actividad.query.get_or_404(id)
+    if not actividad.imagen_hash or not texto_a_bbox(actividad.imagen_bbox):
+        abort(404)
+    return redirect(url_for('api.recorte_hoja', hash_imagen=actividad.imagen_hash, bbox=actividad.imagen_bbox,
+                            ancho=request.args.get('ancho', type=int)))
+
+@api_bp.route('/referencias')
+@login_required
+def datos_referencia():
+    cuerpo, etag = referencias.como_json()
+    respuesta = make_response(cuerpo)
+    respuesta.mimetype = 'application/json'
+    respuesta.set_etag(etag)
+    respuesta.cache_control.private = True
+    respuesta.cache_control.max_age = 60
+    return respuesta.make_conditional(request)
+
+@api_bp.route('/referencias/sugerir')
+@login_required
+def sugerir_referencia():
+    tipo = request.args.get('tipo', '')
+    valor = request.args.get('valor', '')
+
+    if tipo not in ('equipo', 'actividad', 'operario'):
+        return jsonify({'error': 'Tipo de referencia inválido'}), 400
+
+    return jsonify({
+        'valido': referencias.es_valido(tipo, valor),
+        'sugerencias': [{'valor': v, 'similitud': s} for v, s in referencias.sugerir(tipo, valor)]
+    })
+
 # ---------------------
 # CONTROLADOR GENERAL
 # ---------------------
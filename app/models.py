@@ -15,6 +15,8 @@ class Usuario(db.Model, UserMixin):
 
 class Actividad(db.Model):
     __tablename__ = 'actividades'
+    # La huella incluye la fecha para que el índice sea compatible con el particionado por fecha
+    __table_args__ = (db.UniqueConstraint('huella', 'fecha', name='uq_actividades_huella'),)
     id = db.Column(db.Integer, primary_key=True)
     fecha = db.Column(db.Date, nullable=False, default=datetime.utcnow)
     turno = db.Column(db.String(20), nullable=False)
@@ -28,6 +30,11 @@ class Actividad(db.Model):
     cantidad_trabajada = db.Column(db.Integer)
     observaciones = db.Column(db.Text)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    # Clave natural (operario, fecha, turno, horas, actividad, equipo) para deduplicar
+    huella = db.Column(db.String(40))
+    # Hoja de origen en el archivo de imágenes y caja 'x0,y0,x1,y1' de la fila
+    imagen_hash = db.Column(db.String(64), index=True)
+    imagen_bbox = db.Column(db.String(40))
 
     usuario = db.relationship('Usuario', backref='actividades')
 
@@ -35,3 +42,31 @@ class Actividad(db.Model):
         return f'<Actividad {self.codigo_actividad} - {self.fecha}>'
     
     
+
+class CodigoReferencia(db.Model):
+    """Códigos de equipo y de actividad confirmados por una persona (ver app.servicios.datos_referencia)"""
+    __tablename__ = 'codigos_referencia'
+    __table_args__ = (db.UniqueConstraint('tipo', 'valor', name='uq_codigos_referencia'),)
+    id = db.Column(db.Integer, primary_key=True)
+    # 'equipo' o 'actividad'
+    tipo = db.Column(db.String(20), nullable=False)
+    valor = db.Column(db.String(50), nullable=False)
+
+
+class RegistroAuditoria(db.Model):
+    """Cambios de usuarios y actividades (solo se insertan, ver app.servicios.auditoria)"""
+    __tablename__ = 'auditoria'
+    __table_args__ = (db.Index('ix_auditoria_registro', 'tabla', 'registro_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.DateTime, nullable=False, index=True)
+    # Quién hizo el cambio (sin clave foránea: el registro sobrevive al usuario)
+    usuario_id = db.Column(db.Integer, index=True)
+    origen = db.Column(db.String(100))
+    tabla = db.Column(db.String(50), nullable=False)
+    registro_id = db.Column(db.Integer)
+    operacion = db.Column(db.String(20), nullable=False)
+    # JSON {columna: [antes, después]}
+    cambios = db.Column(db.Text)
+
+    def __repr__(self):
+        return f'<RegistroAuditoria {self.tabla}:{self.registro_id} {self.operacion}>'
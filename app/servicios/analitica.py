@@ -0,0 +1,202 @@
+"""
+Indicadores de productividad calculados con pandas sobre proyecciones de
+columnas de Actividad (una sola consulta, más el archivo histórico):
+
+- unidades por hora por operario (y su evolución por día, semana o mes)
+- utilización de cada equipo por turno (tiempo ocupado / duración del turno)
+- tiempos muertos entre el fin de una actividad y el inicio de la siguiente
+- solapamientos: actividades de un operario que empiezan antes de que
+  termine la anterior
+
+Todo se resuelve con group-by, diff y cummax vectorizados; no hay bucles por
+fila. Los resultados se cachean por (rango, agrupación) y versión de datos.
+"""
+import numpy as np
+import pandas as pd
+
+from extensions import db
+from app.models import Usuario
+from app.servicios.archivo_historico import consultar_actividades
+from app.servicios.cache_plantillas import memorizar
+from app.servicios.perfilador import etiquetar
+
+COLUMNAS = ['usuario_id', 'fecha', 'turno', 'hora_inicio', 'hora_final', 'codigo_equipo', 'cantidad_trabajada']
+MINUTOS_TURNO = 8 * 60
+MINUTOS_DIA = 24 * 60
+# Huecos más largos que esto se consideran fin de jornada, no tiempo muerto
+MAX_HUECO_MINUTOS = 4 * 60
+PATRON_HORA = r'^\s*(\d{1,2}):(\d{2})'
+
+
+# ---------------------
+# PREPARACIÓN
+# ---------------------
+def _minutos(horas):
+    """'HH:MM' (o time) -> minutos desde medianoche; NaN si no se puede leer"""
+    partes = horas.astype(str).str.extract(PATRON_HORA)
+    return pd.to_numeric(partes[0], errors='coerce') * 60 + pd.to_numeric(partes[1], errors='coerce')
+
+
+def preparar(datos):
+    """
+    Agrega inicio/fin absolutos (minutos desde la época, para ordenar entre
+    días) y la duración; las actividades que cruzan la medianoche terminan al
+    día siguiente. Descarta las filas sin horas legibles.
+    """
+    datos = datos.copy()
+    inicio = _minutos(datos['hora_inicio'])
+    fin = _minutos(datos['hora_final'])
+    fin = fin.where(fin >= inicio, fin + MINUTOS_DIA)
+    dias = pd.to_datetime(datos['fecha']).values.astype('datetime64[D]').astype(np.int64)
+    datos['inicio'] = dias * MINUTOS_DIA + inicio
+    datos['fin'] = dias * MINUTOS_DIA + fin
+    datos['duracion'] = fin - inicio
+    datos['cantidad_trabajada'] = pd.to_numeric(datos['cantidad_trabajada'], errors='coerce').fillna(0)
+    return datos.dropna(subset=['inicio', 'fin'])
+
+
+def _con_anterior(datos, claves):
+    """
+    Ordena por claves e inicio y agrega `fin_previo`: el mayor fin de las
+    actividades anteriores del mismo grupo (NaN en la primera de cada grupo)
+    """
+    datos = datos.sort_values(claves + ['inicio'], kind='mergesort')
+    grupos = datos.groupby(claves, sort=False)['fin']
+    datos['fin_previo'] = grupos.cummax().groupby([datos[c] for c in claves], sort=False).shift()
+    return datos
+
+
+# ---------------------
+# INDICADORES
+# ---------------------
+def unidades_por_hora(datos):
+    """Unidades, horas y unidades por hora por operario"""
+    resumen = datos.groupby('usuario_id').agg(unidades=('cantidad_trabajada', 'sum'),
+                                              minutos=('duracion', 'sum'),
+                                              actividades=('duracion', 'size'))
+    resumen['horas'] = resumen['minutos'] / 60
+    resumen['unidades_por_hora'] = resumen['unidades'] / resumen['horas'].replace(0, np.nan)
+    return resumen.drop(columns='minutos')
+
+
+def serie_unidades_por_hora(datos, agrupacion='dia'):
+    """Unidades por hora de todos los operarios por día, semana o mes"""
+    fechas = pd.to_datetime(datos['fecha'])
+    if agrupacion == 'semana':
+        periodo = fechas.dt.to_period('W').dt.start_time.dt.strftime('%Y-%m-%d')
+    elif agrupacion == 'mes':
+        periodo = fechas.dt.strftime('%Y-%m')
+    else:
+        periodo = fechas.dt.strftime('%Y-%m-%d')
+    serie = datos.groupby(periodo).agg(unidades=('cantidad_trabajada', 'sum'), minutos=('duracion', 'sum'))
+    return serie['unidades'] / (serie['minutos'] / 60).replace(0, np.nan)
+
+
+def utilizacion_equipos(datos):
+    """
+    Utilización de cada equipo por turno: minutos ocupados (unión de los
+    intervalos, sin contar dos veces los solapados) sobre los minutos de los
+    turnos en que el equipo trabajó
+    """
+    datos = datos[datos['codigo_equipo'].fillna('').astype(str).str.strip() != '']
+    if datos.empty:
+        return pd.DataFrame(columns=['minutos_ocupados', 'turnos', 'utilizacion'])
+    claves = ['codigo_equipo', 'turno', 'fecha']
+    datos = _con_anterior(datos, claves)
+    # Un bloque nuevo empieza cuando la actividad no toca las anteriores
+    nuevo_bloque = ~(datos['inicio'] < datos['fin_previo'])
+    bloque = nuevo_bloque.cumsum()
+    bloques = datos.groupby(claves + [bloque.rename('bloque')], sort=False).agg(
+        inicio=('inicio', 'min'), fin=('fin', 'max'))
+    bloques['ocupado'] = bloques['fin'] - bloques['inicio']
+    por_dia = bloques.groupby(level=claves, sort=False)['ocupado'].sum()
+    resumen = por_dia.groupby(level=['codigo_equipo', 'turno']).agg(minutos_ocupados='sum', turnos='size')
+    resumen['utilizacion'] = (resumen['minutos_ocupados'] / (resumen['turnos'] * MINUTOS_TURNO)).clip(upper=1.0)
+    return resumen
+
+
+def tiempos_muertos(datos):
+    """
+    Huecos entre actividades consecutivas de cada operario en una misma
+    fecha y turno: minutos totales, cantidad y hueco máximo
+    """
+    claves = ['usuario_id', 'fecha', 'turno']
+    datos = _con_anterior(datos, claves)
+    hueco = datos['inicio'] - datos['fin_previo']
+    hueco = hueco[(hueco > 0) & (hueco <= MAX_HUECO_MINUTOS)]
+    usuarios = datos.loc[hueco.index, 'usuario_id']
+    return hueco.groupby(usuarios).agg(minutos_muertos='sum', huecos='size', hueco_maximo='max')
+
+
+def solapamientos(datos, limite=50):
+    """
+    Actividades de un operario que empiezan antes de que termine otra de la
+    misma fecha y turno. Devuelve (conteo por operario, primeras filas)
+    """
+    claves = ['usuario_id', 'fecha', 'turno']
+    datos = _con_anterior(datos, claves)
+    solapadas = datos[datos['inicio'] < datos['fin_previo']]
+    conteo = solapadas.groupby('usuario_id').size().rename('solapamientos')
+    detalle = solapadas.assign(minutos_solapados=solapadas['fin_previo'] - solapadas['inicio'])
+    return conteo, detalle.head(limite)
+
+
+# ---------------------
+# API
+# ---------------------
+def _registros(tabla, nombres=None, orden=None, limite=None):
+    if orden is not None:
+        tabla = tabla.sort_values(orden, ascending=False)
+    if limite is not None:
+        tabla = tabla.head(limite)
+    tabla = tabla.reset_index()
+    if nombres is not None and 'usuario_id' in tabla:
+        tabla.insert(1, 'operario', tabla['usuario_id'].map(nombres).fillna(''))
+    return tabla.round(3).replace({np.nan: None}).to_dict(orient='records')
+
+
+@etiquetar('analitica.productividad')
+def calcular_productividad(inicio, fin, agrupacion='dia', limite=20):
+    """Indicadores de productividad del rango [inicio, fin] (fechas) en un diccionario"""
+    datos = consultar_actividades(inicio, fin, COLUMNAS)
+    vacio = {'operarios': [], 'equipos': [], 'serie': {'periodos': [], 'unidades_por_hora': []},
+             'solapamientos': [], 'totales': {'actividades': 0, 'horas': 0.0, 'unidades_por_hora': None}}
+    if datos.empty:
+        return vacio
+    datos = preparar(datos)
+    if datos.empty:
+        return vacio
+
+    nombres = dict(db.session.query(Usuario.id, Usuario.nombre_completo).all())
+    operarios = unidades_por_hora(datos).join(tiempos_muertos(datos), how='left')
+    conteo_solapes, detalle_solapes = solapamientos(datos)
+    operarios = operarios.join(conteo_solapes, how='left')
+    operarios[['minutos_muertos', 'huecos', 'solapamientos']] = \
+        operarios[['minutos_muertos', 'huecos', 'solapamientos']].fillna(0)
+
+    serie = serie_unidades_por_hora(datos, agrupacion)
+    horas = datos['duracion'].sum() / 60
+    detalle_solapes = detalle_solapes[['usuario_id', 'fecha', 'turno', 'hora_inicio', 'hora_final', 'minutos_solapados']]
+    detalle_solapes = detalle_solapes.assign(fecha=detalle_solapes['fecha'].astype(str),
+                                             hora_inicio=detalle_solapes['hora_inicio'].astype(str),
+                                             hora_final=detalle_solapes['hora_final'].astype(str))
+    return {
+        'operarios': _registros(operarios, nombres, 'unidades_por_hora', limite),
+        'equipos': _registros(utilizacion_equipos(datos), orden='utilizacion', limite=limite),
+        'serie': {
+            'periodos': serie.index.tolist(),
+            'unidades_por_hora': [None if pd.isna(v) else round(float(v), 3) for v in serie.tolist()],
+        },
+        'solapamientos': _registros(detalle_solapes.set_index('usuario_id'), nombres),
+        'totales': {
+            'actividades': int(len(datos)),
+            'horas': round(float(horas), 2),
+            'unidades_por_hora': round(float(datos['cantidad_trabajada'].sum() / horas), 3) if horas else None,
+        },
+    }
+
+
+def productividad(inicio, fin, agrupacion='dia'):
+    """calcular_productividad cacheado por rango, agrupación y versión de datos"""
+    return memorizar('analitica_productividad', inicio, fin, agrupacion,
+                     funcion=lambda: calcular_productividad(inicio, fin, agrupacion))
@@ -0,0 +1,124 @@
+"""
+Benchmark de los indicadores de productividad (app.servicios.analitica) sobre
+actividades sintéticas, sin base de datos.
+
+Uso:
+    python -m app.servicios.analitica_benchmark --filas 1000000
+    python -m app.servicios.analitica_benchmark --filas 1000000 --bucle 50000 --salida analitica.json
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from app.servicios.analitica import (
+    MAX_HUECO_MINUTOS, preparar, unidades_por_hora, serie_unidades_por_hora,
+    utilizacion_equipos, tiempos_muertos, solapamientos
+)
+
+TURNOS = np.array(['Mañana', 'Tarde', 'Noche'])
+INICIO_TURNO = np.array([6 * 60, 14 * 60, 22 * 60])
+
+
+def generar_actividades(filas, operarios=500, equipos=300, dias=365, semilla=0):
+    """DataFrame con las columnas que proyecta analitica, con horas en texto 'HH:MM'"""
+    rng = np.random.default_rng(semilla)
+    turno = rng.integers(0, 3, filas)
+    inicio = INICIO_TURNO[turno] + rng.integers(0, 7 * 60, filas)
+    fin = inicio + rng.choice([15, 30, 45, 60, 90, 120], filas)
+    inicio, fin = inicio % (24 * 60), fin % (24 * 60)
+    return pd.DataFrame({
+        'usuario_id': rng.integers(1, operarios + 1, filas),
+        'fecha': pd.Timestamp(date.today()) - pd.to_timedelta(rng.integers(0, dias, filas), unit='D'),
+        'turno': TURNOS[turno],
+        'hora_inicio': pd.Series(inicio // 60).map('{:02d}'.format) + ':' + pd.Series(inicio % 60).map('{:02d}'.format),
+        'hora_final': pd.Series(fin // 60).map('{:02d}'.format) + ':' + pd.Series(fin % 60).map('{:02d}'.format),
+        'codigo_equipo': 'EQ-' + pd.Series(rng.integers(100, 100 + equipos, filas)).astype(str),
+        'cantidad_trabajada': rng.integers(1, 500, filas),
+    })
+
+
+def tiempos_muertos_bucle(datos):
+    """Versión por filas de tiempos_muertos, como referencia de velocidad"""
+    totales = {}
+    ordenadas = sorted(datos.itertuples(index=False), key=lambda f: (f.usuario_id, f.fecha, f.turno, f.inicio))
+    anterior = None
+    fin_previo = None
+    for fila in ordenadas:
+        clave = (fila.usuario_id, fila.fecha, fila.turno)
+        if clave != anterior:
+            anterior, fin_previo = clave, fila.fin
+            continue
+        hueco = fila.inicio - fin_previo
+        if 0 < hueco <= MAX_HUECO_MINUTOS:
+            totales[fila.usuario_id] = totales.get(fila.usuario_id, 0) + hueco
+        fin_previo = max(fin_previo, fila.fin)
+    return totales
+
+
+def _medir(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return resultado, (time.perf_counter() - inicio) * 1000
+
+
+def ejecutar_benchmark(filas=1000000, operarios=500, equipos=300, dias=365, filas_bucle=0, semilla=0):
+    crudas = generar_actividades(filas, operarios, equipos, dias, semilla)
+    datos, ms_preparar = _medir(preparar, crudas)
+
+    tiempos = {'preparar': ms_preparar}
+    for nombre, funcion, args in [
+        ('unidades_por_hora', unidades_por_hora, (datos,)),
+        ('serie_semana', serie_unidades_por_hora, (datos, 'semana')),
+        ('utilizacion_equipos', utilizacion_equipos, (datos,)),
+        ('tiempos_muertos', tiempos_muertos, (datos,)),
+        ('solapamientos', solapamientos, (datos,)),
+    ]:
+        _, tiempos[nombre] = _medir(funcion, *args)
+
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'configuracion': {'filas': filas, 'operarios': operarios, 'equipos': equipos, 'dias': dias, 'semilla': semilla},
+        'etapas_ms': {nombre: round(ms, 1) for nombre, ms in tiempos.items()},
+        'total_ms': round(sum(tiempos.values()), 1),
+        'filas_por_segundo': round(filas / (sum(tiempos.values()) / 1000), 1),
+    }
+
+    if filas_bucle:
+        muestra = datos.head(filas_bucle)
+        _, ms_bucle = _medir(tiempos_muertos_bucle, muestra)
+        _, ms_vector = _medir(tiempos_muertos, muestra)
+        informe['tiempos_muertos_bucle'] = {
+            'filas': len(muestra),
+            'bucle_ms': round(ms_bucle, 1),
+            'vectorizado_ms': round(ms_vector, 1),
+            'aceleracion': round(ms_bucle / ms_vector, 1) if ms_vector else None,
+        }
+    return informe
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de los indicadores de productividad')
+    parser.add_argument('--filas', type=int, default=1000000)
+    parser.add_argument('--operarios', type=int, default=500)
+    parser.add_argument('--equipos', type=int, default=300)
+    parser.add_argument('--dias', type=int, default=365)
+    parser.add_argument('--bucle', type=int, default=0, metavar='FILAS',
+                        help='Comparar tiempos_muertos con la versión por filas sobre FILAS filas')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', help='Archivo JSON donde guardar el informe')
+    args = parser.parse_args()
+
+    informe = ejecutar_benchmark(args.filas, args.operarios, args.equipos, args.dias, args.bucle, args.semilla)
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto)
+    print(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""
+Almacenamiento por tiempo de las actividades.
+
+- En MySQL la tabla `actividades` se particiona por mes (RANGE sobre
+  TO_DAYS(fecha)), así las consultas filtradas por fecha solo leen las
+  particiones recientes.
+- Las actividades más antiguas que el horizonte (ARCHIVO_HORIZONTE_DIAS) se
+  exportan a archivos Parquet comprimidos, uno o más por mes, y se eliminan de
+  la tabla (en MySQL se elimina la partición completa; en otros motores con
+  DELETE). Los archivos existentes nunca se reescriben: cada ejecución agrega
+  una parte por mes con las filas que aún no estaban archivadas.
+- consultar_actividades une de forma transparente la tabla y el archivo
+  cuando el rango pedido cruza el corte; las filas de la tabla se leen en todo
+  el rango, aunque sean anteriores al corte.
+"""
+import json
+import logging
+import os
+import uuid
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import select, text
+
+from config import Config
+from extensions import db
+from app.models import Actividad
+from app.servicios import auditoria, version_datos
+from app.servicios.perfilador import etiquetar
+
+logger = logging.getLogger(__name__)
+
+TABLA = Actividad.__tablename__
+COLUMNAS = [columna.name for columna in Actividad.__table__.columns]
+
+
+# ---------------------
+# UTILIDADES
+# ---------------------
+def _primer_dia_mes(fecha, meses=0):
+    mes = fecha.month - 1 + meses
+    return date(fecha.year + mes // 12, mes % 12 + 1, 1)
+
+
+def _es_mysql():
+    return db.engine.dialect.name == 'mysql'
+
+
+def _ruta_manifiesto():
+    return os.path.join(Config.ARCHIVO_DIR, 'manifiesto.json')
+
+
+def fecha_corte():
+    """Fecha a partir de la cual los datos están en la tabla (None si no hay archivo)"""
+    try:
+        with open(_ruta_manifiesto(), encoding='utf-8') as archivo:
+            return date.fromisoformat(json.load(archivo)['corte'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _guardar_corte(corte):
+    os.makedirs(Config.ARCHIVO_DIR, exist_ok=True)
+    temporal = _ruta_manifiesto() + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump({'corte': corte.isoformat(), 'actualizado': datetime.now().isoformat(timespec='seconds')}, archivo)
+    os.replace(temporal, _ruta_manifiesto())
+
+
+def _directorio_mes(anio, mes):
+    return os.path.join(Config.ARCHIVO_DIR, TABLA, f"anio={anio}", f"mes={mes:02d}")
+
+
+# ---------------------
+# PARTICIONES (MySQL)
+# ---------------------
+def particiones_mysql():
+    """Lista de (nombre, limite_superior) de las particiones actuales"""
+    filas = db.session.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tabla AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {'tabla': TABLA}).all()
+    return [(fila[0], fila[1]) for fila in filas]
+
+
+def _definicion_particion(mes):
+    siguiente = _primer_dia_mes(mes, 1)
+    return f"PARTITION p{mes:%Y%m} VALUES LESS THAN (TO_DAYS('{siguiente.isoformat()}'))"
+
+
+def particionar_mysql(meses_futuros=3):
+    """
+    Convierte `actividades` en una tabla particionada por mes. La clave primaria
+    pasa a ser (id, fecha) porque MySQL exige que incluya la columna de partición.
+    """
+    if not _es_mysql():
+        raise RuntimeError("El particionado solo está disponible en MySQL; en otros motores use el archivo")
+    if particiones_mysql():
+        return asegurar_particiones(meses_futuros)
+
+    primera = db.session.execute(select(db.func.min(Actividad.fecha))).scalar() or date.today()
+    mes = _primer_dia_mes(primera)
+    ultimo = _primer_dia_mes(date.today(), meses_futuros)
+    definiciones = []
+    while mes <= ultimo:
+        definiciones.append(_definicion_particion(mes))
+        mes = _primer_dia_mes(mes, 1)
+    definiciones.append("PARTITION pfuturo VALUES LESS THAN MAXVALUE")
+
+    # InnoDB no admite claves foráneas en tablas particionadas: la relación con
+    # usuarios queda a cargo de la aplicación
+    claves_foraneas = db.session.execute(text(
+        "SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+        "WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = :tabla"
+    ), {'tabla': TABLA}).scalars().all()
+    for clave in claves_foraneas:
+        db.session.execute(text(f"ALTER TABLE {TABLA} DROP FOREIGN KEY `{clave}`"))
+
+    db.session.execute(text(f"ALTER TABLE {TABLA} DROP PRIMARY KEY, ADD PRIMARY KEY (id, fecha)"))
+    db.session.execute(text(
+        f"ALTER TABLE {TABLA} PARTITION BY RANGE (TO_DAYS(fecha)) ({', '.join(definiciones)})"
+    ))
+    db.session.commit()
+    return len(definiciones)
+
+
+def asegurar_particiones(meses_futuros=3):
+    """Crea las particiones de los próximos meses separándolas de `pfuturo`"""
+    existentes = {nombre for nombre, _ in particiones_mysql()}
+    mes = _primer_dia_mes(date.today())
+    nuevas = []
+    for _ in range(meses_futuros + 1):
+        if f"p{mes:%Y%m}" not in existentes:
+            nuevas.append(_definicion_particion(mes))
+        mes = _primer_dia_mes(mes, 1)
+    if nuevas:
+        db.session.execute(text(
+            f"ALTER TABLE {TABLA} REORGANIZE PARTITION pfuturo INTO "
+            f"({', '.join(nuevas)}, PARTITION pfuturo VALUES LESS THAN MAXVALUE)"
+        ))
+        db.session.commit()
+    return len(nuevas)
+
+
+# ---------------------
+# ARCHIVO (Parquet)
+# ---------------------
+def archivar_actividades(horizonte_dias=None, tamano_lote=50000):
+    """
+    Exporta a Parquet las actividades anteriores al horizonte (meses completos)
+    y las elimina de la tabla. Devuelve (filas archivadas, fecha de corte).
+    """
+    horizonte_dias = horizonte_dias or Config.ARCHIVO_HORIZONTE_DIAS
+    corte = _primer_dia_mes(date.today() - timedelta(days=horizonte_dias))
+
+    consulta = select(Actividad.__table__).where(Actividad.fecha < corte).order_by(Actividad.fecha, Actividad.id)
+    total = 0
+    ids_archivados = {}
+    with db.engine.connect() as conexion:
+        for lote in pd.read_sql(consulta, conexion, chunksize=tamano_lote):
+            lote['fecha'] = pd.to_datetime(lote['fecha'])
+            for (anio, mes), grupo in lote.groupby([lote['fecha'].dt.year, lote['fecha'].dt.month]):
+                # Lo archivado nunca se reescribe: cada ejecución agrega una parte con
+                # las filas nuevas del mes. Las que ya están (un archivado anterior
+                # no llegó a borrarlas de la tabla) se omiten para no duplicarlas
+                if (anio, mes) not in ids_archivados:
+                    ids_archivados[(anio, mes)] = _ids_archivados(anio, mes)
+                grupo = grupo[~grupo['id'].isin(ids_archivados[(anio, mes)])]
+                if grupo.empty:
+                    continue
+                directorio = _directorio_mes(anio, mes)
+                os.makedirs(directorio, exist_ok=True)
+                grupo.to_parquet(os.path.join(directorio, f"parte-{uuid.uuid4().hex}.parquet"),
+                                 compression='zstd', index=False)
+                ids_archivados[(anio, mes)].update(grupo['id'])
+                total += len(grupo)
+
+    # Registrar el corte antes de borrar: si el borrado falla, los datos siguen en la tabla
+    corte_anterior = fecha_corte()
+    if corte_anterior is None or corte > corte_anterior:
+        _guardar_corte(corte)
+
+    exportados = {int(i) for ids in ids_archivados.values() for i in ids}
+    if exportados:
+        _eliminar_anteriores(corte, exportados)
+        version_datos.notificar_cambio(TABLA)
+    return total, corte
+
+
+def _ids_archivados(anio, mes):
+    directorio = _directorio_mes(anio, mes)
+    if not os.path.isdir(directorio) or not os.listdir(directorio):
+        return set()
+    return set(pd.read_parquet(directorio, columns=['id'])['id'])
+
+
+def _eliminar_anteriores(corte, exportados, tamano_lote=1000):
+    """
+    Elimina de la tabla solo las filas que están en el archivo (`exportados`):
+    una fila anterior al corte insertada o con la fecha cambiada durante la
+    exportación se queda en la tabla hasta el próximo archivado
+    """
+    restantes = set(exportados)
+    completas = []
+    eliminadas = 0
+    if _es_mysql() and particiones_mysql():
+        limite = db.session.execute(text("SELECT TO_DAYS(:corte)"), {'corte': corte}).scalar()
+        antiguas = [nombre for nombre, descripcion in particiones_mysql()
+                    if descripcion != 'MAXVALUE' and int(descripcion) <= limite]
+        for nombre in antiguas:
+            # La partición se elimina entera solo si todas sus filas están archivadas
+            ids = set(db.session.execute(text(f"SELECT id FROM {TABLA} PARTITION ({nombre})")).scalars())
+            if ids <= restantes:
+                completas.append(nombre)
+                restantes -= ids
+                eliminadas += len(ids)
+        if completas:
+            db.session.execute(text(f"ALTER TABLE {TABLA} DROP PARTITION {', '.join(completas)}"))
+    restantes = sorted(restantes)
+    for inicio in range(0, len(restantes), tamano_lote):
+        eliminadas += db.session.execute(Actividad.__table__.delete().where(
+            Actividad.id.in_(restantes[inicio:inicio + tamano_lote]), Actividad.fecha < corte
+        )).rowcount
+    # Un solo registro por archivado: las filas siguen en el archivo Parquet
+    auditoria.auditar_sentencias(db.session, TABLA, 'archivar', [
+        (None, {'corte': [None, corte], 'filas': [None, eliminadas], 'particiones': [None, completas or None]})
+    ])
+    db.session.commit()
+
+
+def _meses_archivados():
+    """Meses presentes en el archivo como lista de date (primer día del mes)"""
+    raiz = os.path.join(Config.ARCHIVO_DIR, TABLA)
+    meses = []
+    if not os.path.isdir(raiz):
+        return meses
+    for dir_anio in os.listdir(raiz):
+        if not dir_anio.startswith('anio='):
+            continue
+        for dir_mes in os.listdir(os.path.join(raiz, dir_anio)):
+            if dir_mes.startswith('mes='):
+                meses.append(date(int(dir_anio[5:]), int(dir_mes[4:]), 1))
+    return sorted(meses)
+
+
+def firma_archivo():
+    """Cambia cada vez que se agrega una parte al archivo (o se mueve el corte)"""
+    raiz = os.path.join(Config.ARCHIVO_DIR, TABLA)
+    partes = 0
+    ultima = 0.0
+    for directorio, _, archivos in os.walk(raiz):
+        for nombre in archivos:
+            if nombre.endswith('.parquet'):
+                partes += 1
+                ultima = max(ultima, os.path.getmtime(os.path.join(directorio, nombre)))
+    return fecha_corte(), partes, ultima
+
+
+def valores_archivados(columnas):
+    """{columna: conjunto de valores distintos} de todo el archivo"""
+    valores = {columna: set() for columna in columnas}
+    for mes in _meses_archivados():
+        datos = pd.read_parquet(_directorio_mes(mes.year, mes.month), columns=list(columnas))
+        for columna in columnas:
+            valores[columna].update(datos[columna].dropna().unique())
+    return valores
+
+
+def leer_archivo(inicio=None, fin=None, columnas=None):
+    """Lee del archivo Parquet las actividades entre inicio y fin (fechas inclusive)"""
+    columnas = list(columnas or COLUMNAS)
+    partes = []
+    for mes in _meses_archivados():
+        if (inicio and _primer_dia_mes(mes, 1) <= inicio) or (fin and mes > fin):
+            continue
+        partes.append(pd.read_parquet(_directorio_mes(mes.year, mes.month), columns=columnas))
+    if not partes:
+        return pd.DataFrame(columns=columnas)
+    datos = pd.concat(partes, ignore_index=True)
+    datos['fecha'] = pd.to_datetime(datos['fecha']).dt.date
+    if inicio:
+        datos = datos[datos['fecha'] >= inicio]
+    if fin:
+        datos = datos[datos['fecha'] <= fin]
+    return datos
+
+
+def _ids_anteriores_en_tabla(corte, inicio=None, fin=None):
+    """
+    Ids de las filas de la tabla anteriores al corte: registradas después del
+    último archivado, o archivadas sin llegar a borrarse (esas se leen de la
+    tabla y no del archivo). Normalmente son pocas o ninguna
+    """
+    consulta = select(Actividad.id).where(Actividad.fecha < corte)
+    if inicio:
+        consulta = consulta.where(Actividad.fecha >= inicio)
+    if fin:
+        consulta = consulta.where(Actividad.fecha <= fin)
+    return set(db.session.execute(consulta).scalars())
+
+
+def _leer_historicas(inicio, fin, corte, columnas):
+    """Filas del archivo anteriores al corte que no siguen en la tabla"""
+    fin_archivo = min(fin, corte - timedelta(days=1)) if fin else corte - timedelta(days=1)
+    historicas = leer_archivo(inicio, fin_archivo, list(dict.fromkeys(['id', *columnas])))
+    en_tabla = _ids_anteriores_en_tabla(corte, inicio, fin_archivo)
+    if en_tabla and not historicas.empty:
+        historicas = historicas[~historicas['id'].isin(en_tabla)]
+    return historicas[columnas]
+
+
+@etiquetar('archivo.conteo_por_fecha')
+def conteo_por_fecha(inicio=None, fin=None):
+    """Lista ordenada de (fecha, cantidad de actividades), incluyendo el archivo"""
+    corte = fecha_corte()
+    # La tabla se consulta en todo el rango: también puede tener filas anteriores al corte
+    consulta = db.session.query(Actividad.fecha, db.func.count(Actividad.id)).group_by(Actividad.fecha)
+    if inicio:
+        consulta = consulta.filter(Actividad.fecha >= inicio)
+    if fin:
+        consulta = consulta.filter(Actividad.fecha <= fin)
+    conteos = dict(consulta.all())
+
+    if corte and (inicio is None or inicio < corte):
+        historicas = _leer_historicas(inicio, fin, corte, ['fecha'])
+        for fecha, cantidad in historicas.groupby('fecha').size().items():
+            conteos[fecha] = conteos.get(fecha, 0) + int(cantidad)
+    return sorted(conteos.items())
+
+
+@etiquetar('archivo.consultar_actividades')
+def consultar_actividades(inicio, fin, columnas):
+    """
+    Devuelve un DataFrame con las columnas pedidas de las actividades entre
+    inicio y fin, leyendo de la tabla y, si el rango es anterior al corte,
+    también del archivo
+    """
+    columnas = list(columnas)
+    corte = fecha_corte()
+    consulta = select(*[Actividad.__table__.c[c] for c in columnas])\
+        .where(Actividad.fecha.between(inicio, fin))\
+        .order_by(Actividad.fecha)
+    with db.engine.connect() as conexion:
+        recientes = pd.read_sql(consulta, conexion)
+
+    if corte is None or inicio >= corte:
+        return recientes
+
+    historicas = _leer_historicas(inicio, fin, corte, columnas)
+    if historicas.empty:
+        return recientes
+    if recientes.empty:
+        return historicas.sort_values('fecha', kind='stable').reset_index(drop=True)
+    return pd.concat([historicas, recientes], ignore_index=True).sort_values('fecha', kind='stable').reset_index(drop=True)
@@ -0,0 +1,218 @@
+"""
+Archivo de las imágenes de hojas cargadas, direccionado por contenido.
+
+Cada imagen se identifica por el SHA-256 de su contenido: la misma hoja
+subida dos veces se guarda una sola vez. Un hilo en segundo plano escribe el
+original recomprimido (JPEG) y una miniatura fuera de app/static, y recorta de
+antemano las filas detectadas por el OCR; cada Actividad guarda el hash y la
+caja de su fila (imagen_hash, imagen_bbox). Los recortes se sirven desde esos
+archivos (o, si no existen, desde el original) reducidos en memoria a uno de
+los anchos fijos de ANCHOS_RECORTE; el resultado solo se guarda en una caché
+LRU acotada, nunca en disco, así que las peticiones no pueden llenarlo.
+
+    IMAGENES_DIR/ab/<hash>/original.jpg
+                          /miniatura.jpg
+                          /recortes/<x0>-<y0>-<x1>-<y1>.jpg
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import Config
+from app.servicios.cache_plantillas import CacheFragmentos
+from app.servicios.perfilador import etiquetar
+
+logger = logging.getLogger(__name__)
+
+PATRON_HASH = re.compile(r'^[0-9a-f]{64}$')
+MARGEN_RECORTE = 6
+# Anchos servidos: cualquier otro se redondea al siguiente (sin ancho, tamaño original)
+ANCHOS_RECORTE = (160, 320, 640, 1280)
+
+# Un solo escritor: la compresión no compite con el OCR por los núcleos
+_ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archivo-imagenes')
+# Imágenes esperando a escribirse (retienen memoria): por encima se espera
+_en_vuelo = threading.BoundedSemaphore(Config.IMAGENES_PENDIENTES_MAX)
+_pendientes = {}
+_lock = threading.Lock()
+cache_recortes = CacheFragmentos(max_entradas=Config.IMAGENES_CACHE_RECORTES)
+
+
+def calcular_hash(imagen):
+    """SHA-256 de los bytes del archivo o de un arreglo (forma + píxeles)"""
+    if isinstance(imagen, np.ndarray):
+        sha = hashlib.sha256(repr(imagen.shape).encode('ascii'))
+        sha.update(np.ascontiguousarray(imagen).data)
+        return sha.hexdigest()
+    return hashlib.sha256(imagen).hexdigest()
+
+
+def bbox_a_texto(bbox):
+    return ','.join(str(int(v)) for v in bbox) if bbox else None
+
+
+def texto_a_bbox(texto):
+    """'x0,y0,x1,y1' -> tupla de enteros, o None si no es válido"""
+    partes = (texto or '').split(',')
+    if len(partes) != 4 or not all(p.strip().isdigit() for p in partes):
+        return None
+    x0, y0, x1, y1 = (int(p) for p in partes)
+    return (x0, y0, x1, y1) if x1 > x0 and y1 > y0 else None
+
+
+def _directorio(hash_imagen):
+    return os.path.join(Config.IMAGENES_DIR, hash_imagen[:2], hash_imagen)
+
+
+def _ruta_recorte(hash_imagen, bbox):
+    return os.path.join(_directorio(hash_imagen), 'recortes', f"{'-'.join(map(str, bbox))}.jpg")
+
+
+def ancho_recorte(ancho):
+    """Ancho pedido -> el menor de ANCHOS_RECORTE que lo cubre (None: tamaño original)"""
+    if not ancho or ancho <= 0:
+        return None
+    return next((permitido for permitido in ANCHOS_RECORTE if ancho <= permitido), ANCHOS_RECORTE[-1])
+
+
+def _codificar(imagen, calidad):
+    ok, codificada = cv2.imencode('.jpg', imagen, [cv2.IMWRITE_JPEG_QUALITY, calidad])
+    if not ok:
+        raise ValueError("No se pudo codificar la imagen")
+    return codificada.tobytes()
+
+
+def _escribir_atomico(ruta, imagen, calidad):
+    codificada = _codificar(imagen, calidad)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    # Escribir en un temporal y renombrar: un lector nunca ve un archivo a medias
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as archivo:
+        archivo.write(codificada)
+    os.replace(temporal, ruta)
+    return codificada
+
+
+def _reducir(imagen, ancho):
+    if ancho and imagen.shape[1] > ancho:
+        imagen = cv2.resize(imagen, (ancho, max(int(imagen.shape[0] * ancho / imagen.shape[1]), 1)),
+                            interpolation=cv2.INTER_AREA)
+    return imagen
+
+
+def _recortar(imagen, bbox, ancho=None):
+    alto_img, ancho_img = imagen.shape[:2]
+    x0, y0, x1, y1 = bbox
+    recorte = imagen[max(y0 - MARGEN_RECORTE, 0):min(y1 + MARGEN_RECORTE, alto_img),
+                     max(x0 - MARGEN_RECORTE, 0):min(x1 + MARGEN_RECORTE, ancho_img)]
+    if recorte.size == 0:
+        raise ValueError("La caja está fuera de la imagen")
+    return _reducir(recorte, ancho)
+
+
+@etiquetar('imagenes.escribir')
+def _escribir(hash_imagen, imagen, regiones, marca):
+    try:
+        directorio = _directorio(hash_imagen)
+        original = os.path.join(directorio, 'original.jpg')
+        if isinstance(imagen, (bytes, bytearray)):
+            imagen = cv2.imdecode(np.frombuffer(imagen, np.uint8), cv2.IMREAD_COLOR)
+            if imagen is None:
+                raise ValueError("El archivo no es una imagen válida")
+        if not os.path.exists(original):
+            _escribir_atomico(original, imagen, Config.IMAGENES_CALIDAD)
+            escala = Config.IMAGENES_LADO_MINIATURA / max(imagen.shape[:2])
+            miniatura = cv2.resize(imagen, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA) \
+                if escala < 1 else imagen
+            _escribir_atomico(os.path.join(directorio, 'miniatura.jpg'), miniatura, Config.IMAGENES_CALIDAD)
+        # Las filas se recortan ahora, con la imagen ya en memoria: revisarlas no recarga el original
+        for bbox in regiones:
+            ruta = _ruta_recorte(hash_imagen, bbox)
+            if not os.path.exists(ruta):
+                _escribir_atomico(ruta, _recortar(imagen, bbox), Config.IMAGENES_CALIDAD)
+    except Exception as e:
+        logger.error(f"Error archivando la imagen {hash_imagen}: {str(e)}")
+    finally:
+        with _lock:
+            # Si la misma imagen se volvió a encolar, la entrada es de esa escritura
+            if _pendientes.get(hash_imagen, (None,))[0] is marca:
+                del _pendientes[hash_imagen]
+        _en_vuelo.release()
+
+
+def archivar(imagen, regiones=(), hash_imagen=None):
+    """
+    Encola la escritura de `imagen` (bytes del archivo o arreglo BGR) y de los
+    recortes de `regiones` (cajas x0, y0, x1, y1). Devuelve el hash en seguida
+    """
+    hash_imagen = hash_imagen or calcular_hash(imagen)
+    regiones = [tuple(int(v) for v in bbox) for bbox in regiones if bbox]
+    marca = object()
+    _en_vuelo.acquire()
+    try:
+        with _lock:
+            # Registrar y encolar bajo el mismo lock: _escribir no puede terminar
+            # y limpiar la entrada antes de que exista
+            _pendientes[hash_imagen] = (marca, _ejecutor.submit(_escribir, hash_imagen, imagen, regiones, marca))
+    except BaseException:
+        # Sin escritura encolada nadie más liberará el lugar
+        _en_vuelo.release()
+        raise
+    return hash_imagen
+
+
+def _esperar_escritura(hash_imagen):
+    # Un solo escritor: esperar la última escritura de la imagen espera también las anteriores
+    with _lock:
+        pendiente = _pendientes.get(hash_imagen)
+    if pendiente is not None:
+        pendiente[1].result()
+
+
+def ruta_archivo(hash_imagen, variante):
+    """Ruta del original o de la miniatura, o None si no existe"""
+    if not PATRON_HASH.match(hash_imagen or '') or variante not in ('original', 'miniatura'):
+        return None
+    _esperar_escritura(hash_imagen)
+    ruta = os.path.join(_directorio(hash_imagen), f'{variante}.jpg')
+    return ruta if os.path.exists(ruta) else None
+
+
+@etiquetar('imagenes.recorte')
+def recorte(hash_imagen, bbox, ancho=None):
+    """
+    JPEG del recorte de `bbox` (tupla), reducido al ancho fijo que cubre
+    `ancho` (ver ancho_recorte), o None si no hay imagen
+    """
+    if not PATRON_HASH.match(hash_imagen or '') or not bbox:
+        return None
+    ancho = ancho_recorte(ancho)
+
+    def generar():
+        _esperar_escritura(hash_imagen)
+        # El recorte de la fila se hizo al archivar; si no existe, se corta del original
+        base = _ruta_recorte(hash_imagen, bbox)
+        if os.path.exists(base):
+            imagen, caja = cv2.imread(base), None
+        else:
+            original = os.path.join(_directorio(hash_imagen), 'original.jpg')
+            if not os.path.exists(original):
+                # Sin guardar en la caché: puede aparecer si otro proceso aún la está escribiendo
+                raise FileNotFoundError(original)
+            imagen, caja = cv2.imread(original), bbox
+        if imagen is None:
+            raise FileNotFoundError(hash_imagen)
+        recortada = _reducir(imagen, ancho) if caja is None else _recortar(imagen, caja, ancho)
+        return _codificar(recortada, Config.IMAGENES_CALIDAD)
+
+    try:
+        return cache_recortes.obtener_o_calcular((hash_imagen, bbox, ancho), generar)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,298 @@
+"""
+Registro de auditoría de usuarios y actividades con escritura diferida.
+
+Los eventos de sesión capturan, en cada flush, el antes y el después de las
+columnas modificadas de los objetos auditados; con el commit los registros
+pasan a una cola en memoria acotada y un hilo en segundo plano los escribe por
+lotes en la tabla `auditoria` (o en un archivo JSON rotado), fuera de la
+transacción de la petición. Con el rollback se descartan. Al terminar el
+proceso (atexit o worker_exit de gunicorn) se vacía la cola.
+
+Los cambios hechos con sentencias core (ingesta de actividades, importación
+de usuarios, archivado) no pasan por estos eventos: esos servicios llaman a
+auditar_sentencias con los ids y valores que escribieron, y los registros
+siguen el mismo camino (cola con el commit, descarte con el rollback).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from config import Config
+from extensions import db
+from app.models import RegistroAuditoria
+
+logger = logging.getLogger(__name__)
+
+TABLAS_AUDITADAS = ('usuarios', 'actividades')
+# Se registra que cambiaron, nunca su valor
+COLUMNAS_OCULTAS = {'contraseña'}
+OCULTO = '***'
+
+_instalado = False
+
+
+def _serializar(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return str(valor)
+
+
+def _valor(columna, valor):
+    return OCULTO if columna in COLUMNAS_OCULTAS and valor is not None else valor
+
+
+def _autor():
+    """(usuario_id, origen) de la petición actual; en comandos, (None, 'cli')"""
+    if not has_request_context():
+        return None, 'cli'
+    # El usuario ya cargado por login_required: no se consulta dentro del flush
+    usuario = g.get('_login_user')
+    usuario_id = usuario.id if usuario is not None and getattr(usuario, 'is_authenticated', False) else None
+    return usuario_id, (request.endpoint or request.path)[:100]
+
+
+def _diferencias(objeto, operacion):
+    estado = inspect(objeto)
+    cambios = {}
+    for atributo in estado.mapper.column_attrs:
+        clave = atributo.key
+        # Solo valores ya cargados: nada de consultas dentro del flush
+        if operacion == 'insertar':
+            valor = estado.dict.get(clave)
+            if valor is not None:
+                cambios[clave] = [None, _valor(clave, valor)]
+        elif operacion == 'eliminar':
+            cambios[clave] = [_valor(clave, estado.dict.get(clave)), None]
+        else:
+            historia = estado.attrs[clave].history
+            if historia.added or historia.deleted:
+                antes = historia.deleted[0] if historia.deleted else None
+                despues = historia.added[0] if historia.added else None
+                if antes != despues:
+                    cambios[clave] = [_valor(clave, antes), _valor(clave, despues)]
+    return cambios
+
+
+def _despues_de_flush(session, contexto):
+    # En after_flush el historial de atributos aún no se ha reiniciado y los
+    # objetos nuevos ya tienen id
+    usuario_id, origen = _autor()
+    ahora = datetime.utcnow()
+    pendientes = session.info.setdefault('auditoria_pendiente', [])
+    for operacion, objetos in (('insertar', session.new), ('actualizar', session.dirty), ('eliminar', session.deleted)):
+        for objeto in objetos:
+            tabla = getattr(objeto, '__tablename__', None)
+            if tabla not in TABLAS_AUDITADAS:
+                continue
+            if operacion == 'actualizar' and not session.is_modified(objeto, include_collections=False):
+                continue
+            cambios = _diferencias(objeto, operacion)
+            if operacion == 'actualizar' and not cambios:
+                continue
+            pendientes.append({
+                'fecha': ahora,
+                'usuario_id': usuario_id,
+                'origen': origen,
+                'tabla': tabla,
+                # La clave de identidad de los objetos nuevos se asigna después de
+                # after_flush; el id ya está en el diccionario del objeto
+                'registro_id': inspect(objeto).dict.get('id'),
+                'operacion': operacion,
+                'cambios': json.dumps(cambios, default=_serializar, ensure_ascii=False),
+            })
+
+
+def auditar_sentencias(session, tabla, operacion, registros, autor=None):
+    """
+    Audita cambios hechos con sentencias core dentro de la transacción de
+    `session`. `registros` son pares (registro_id, {columna: [antes, después]});
+    `autor` es (usuario_id, origen), por defecto el de la petición actual
+    """
+    usuario_id, origen = autor or _autor()
+    ahora = datetime.utcnow()
+    pendientes = session.info.setdefault('auditoria_pendiente', [])
+    for registro_id, cambios in registros:
+        pendientes.append({
+            'fecha': ahora,
+            'usuario_id': usuario_id,
+            'origen': origen,
+            'tabla': tabla,
+            'registro_id': registro_id,
+            'operacion': operacion,
+            'cambios': json.dumps({columna: [_valor(columna, antes), _valor(columna, despues)]
+                                   for columna, (antes, despues) in cambios.items()},
+                                  default=_serializar, ensure_ascii=False),
+        })
+
+
+def autor_actual():
+    """(usuario_id, origen) de la petición actual, para auditar trabajos en segundo plano"""
+    return _autor()
+
+
+def _despues_de_commit(session):
+    for registro in session.info.pop('auditoria_pendiente', ()):
+        escritor.encolar(registro)
+
+
+def _despues_de_rollback(session):
+    session.info.pop('auditoria_pendiente', None)
+
+
+class EscritorAuditoria:
+    """Cola acotada y hilo que la vacía por lotes en la base de datos o en un archivo"""
+
+    def __init__(self, max_cola=10000, lote=200, intervalo=1.0, destino='tabla', archivo=None):
+        self._cola = queue.Queue(maxsize=max_cola)
+        self.lote = lote
+        self.intervalo = intervalo
+        self.destino = destino
+        self.archivo = archivo
+        self.app = None
+        self._hilo = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._log_archivo = None
+        self.escritos = 0
+        self.descartados = 0
+        self.errores = 0
+
+    def _asegurar_hilo(self):
+        # Los hilos no sobreviven al fork: cada worker arranca el suyo al primer registro
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+                self._detener.clear()
+                self._pid = os.getpid()
+                self._hilo = threading.Thread(target=self._bucle, name='auditoria', daemon=True)
+                self._hilo.start()
+
+    def encolar(self, registro):
+        self._asegurar_hilo()
+        try:
+            # Si la cola está llena, frena un poco al escritor antes de perder registros
+            self._cola.put(registro, timeout=1)
+        except queue.Full:
+            self.descartados += 1
+            logger.error(f"Cola de auditoría llena: descartado {registro['tabla']}:{registro['registro_id']}")
+
+    def _tomar_lote(self, espera):
+        lote = []
+        try:
+            lote.append(self._cola.get(timeout=espera))
+            while len(lote) < self.lote:
+                lote.append(self._cola.get_nowait())
+        except queue.Empty:
+            pass
+        return lote
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            lote = self._tomar_lote(self.intervalo)
+            if lote:
+                self._escribir(lote)
+
+    def _escribir(self, lote):
+        try:
+            if self.destino == 'archivo':
+                self._escribir_archivo(lote)
+            else:
+                with self.app.app_context():
+                    with db.engine.begin() as conexion:
+                        conexion.execute(RegistroAuditoria.__table__.insert(), lote)
+            self.escritos += len(lote)
+        except Exception as e:
+            self.errores += 1
+            logger.error(f"Error escribiendo {len(lote)} registros de auditoría: {str(e)}")
+            if self.destino != 'archivo':
+                # Que no se pierdan: quedan en el archivo de respaldo
+                try:
+                    self._escribir_archivo(lote)
+                    self.escritos += len(lote)
+                except Exception as e:
+                    logger.error(f"Error escribiendo la auditoría en el archivo: {str(e)}")
+
+    def _escribir_archivo(self, lote):
+        if self._log_archivo is None:
+            os.makedirs(os.path.dirname(self.archivo), exist_ok=True)
+            manejador = RotatingFileHandler(self.archivo, maxBytes=Config.AUDITORIA_ARCHIVO_MB * 1024 * 1024,
+                                            backupCount=Config.AUDITORIA_ARCHIVOS, encoding='utf-8')
+            manejador.setFormatter(logging.Formatter('%(message)s'))
+            self._log_archivo = logging.getLogger('auditoria.archivo')
+            self._log_archivo.propagate = False
+            self._log_archivo.setLevel(logging.INFO)
+            self._log_archivo.addHandler(manejador)
+        for registro in lote:
+            self._log_archivo.info(json.dumps(registro, default=_serializar, ensure_ascii=False))
+
+    def vaciar(self, tiempo_max=10):
+        """Detiene el hilo y escribe lo que quede en la cola"""
+        limite = time.monotonic() + tiempo_max
+        hilo = self._hilo
+        self._detener.set()
+        if hilo is not None and self._pid == os.getpid() and hilo.is_alive():
+            hilo.join(max(limite - time.monotonic(), 0))
+        while time.monotonic() < limite:
+            lote = self._tomar_lote(0)
+            if not lote:
+                break
+            self._escribir(lote)
+
+    def estadisticas(self):
+        return {
+            'destino': self.destino,
+            'en_cola': self._cola.qsize(),
+            'escritos': self.escritos,
+            'descartados': self.descartados,
+            'errores': self.errores,
+        }
+
+
+escritor = EscritorAuditoria(Config.AUDITORIA_MAX_COLA, Config.AUDITORIA_LOTE, Config.AUDITORIA_INTERVALO,
+                             Config.AUDITORIA_DESTINO, Config.AUDITORIA_ARCHIVO)
+
+
+def consultar_auditoria(tabla=None, registro_id=None, usuario_id=None, limite=100):
+    """Últimos registros de auditoría (los que aún están en la cola no aparecen)"""
+    consulta = RegistroAuditoria.query
+    if tabla:
+        consulta = consulta.filter(RegistroAuditoria.tabla == tabla)
+    if registro_id is not None:
+        consulta = consulta.filter(RegistroAuditoria.registro_id == registro_id)
+    if usuario_id is not None:
+        consulta = consulta.filter(RegistroAuditoria.usuario_id == usuario_id)
+    return [{
+        'id': r.id,
+        'fecha': r.fecha.isoformat(),
+        'usuario_id': r.usuario_id,
+        'origen': r.origen,
+        'tabla': r.tabla,
+        'registro_id': r.registro_id,
+        'operacion': r.operacion,
+        'cambios': json.loads(r.cambios) if r.cambios else {},
+    } for r in consulta.order_by(RegistroAuditoria.id.desc()).limit(limite)]
+
+
+def instalar_auditoria(app):
+    """Registra los eventos de sesión y el vaciado de la cola al salir (una vez por proceso)"""
+    global _instalado
+    escritor.app = app
+    if _instalado:
+        return
+    event.listen(Session, 'after_flush', _despues_de_flush)
+    event.listen(Session, 'after_commit', _despues_de_commit)
+    event.listen(Session, 'after_soft_rollback', lambda session, transaccion: _despues_de_rollback(session))
+    atexit.register(escritor.vaciar)
+    _instalado = True
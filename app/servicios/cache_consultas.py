@@ -0,0 +1,216 @@
+"""
+Caché de resultados de las consultas filtradas de actividades
+(admin.actividades y analista.dashboard_analista).
+
+La clave es la tupla de filtros normalizada (texto, búsqueda, turno, operario,
+rango de fechas, cursor de página) más la versión de datos de actividades y
+usuarios: cualquier escritura confirmada (ORM, registrar_cambio o
+notificar_cambio en version_datos) cambia la versión y las entradas antiguas
+dejan de usarse. Se guardan tuplas compactas, no objetos ORM, y el LRU expulsa
+entradas cuando se supera el límite de memoria.
+"""
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+
+from config import Config
+from extensions import db
+from app.models import Actividad, Usuario
+from app.servicios import version_datos
+from app.servicios.perfilador import etiquetar
+
+TABLAS = ('actividades', 'usuarios')
+
+FiltrosActividades = namedtuple('FiltrosActividades', [
+    'texto', 'busqueda', 'turno', 'usuario_id', 'fecha_inicio', 'fecha_fin', 'cursor', 'limite'
+])
+UsuarioFila = namedtuple('UsuarioFila', ['id', 'nombre_completo', 'documento', 'rol'])
+FilaActividad = namedtuple('FilaActividad', [
+    'id', 'fecha', 'turno', 'hora_inicio', 'hora_final', 'codigo_actividad', 'descripcion_actividad',
+    'codigo_equipo', 'orden_produccion', 'referencia_producto', 'cantidad_trabajada', 'observaciones',
+    'imagen_hash', 'imagen_bbox', 'usuario_id', 'usuario'
+])
+# Resultado de una página: filas y cursor de la siguiente (None si no hay más)
+Pagina = namedtuple('Pagina', ['filas', 'cursor_siguiente'])
+
+COLUMNAS_ACTIVIDAD = [getattr(Actividad, campo) for campo in FilaActividad._fields[:-1]]
+COLUMNAS_USUARIO = [Usuario.id, Usuario.nombre_completo, Usuario.documento, Usuario.rol]
+
+
+def _fecha(valor):
+    try:
+        return datetime.strptime(valor.strip(), '%Y-%m-%d').date() if valor else None
+    except ValueError:
+        return None
+
+
+def _cursor(valor):
+    """'AAAA-MM-DD|HH:MM|id' -> (fecha, hora_inicio, id) o None si no es válido"""
+    partes = (valor or '').split('|')
+    if len(partes) != 3 or not partes[2].isdigit() or _fecha(partes[0]) is None:
+        return None
+    return _fecha(partes[0]), partes[1], int(partes[2])
+
+
+def codificar_cursor(fila):
+    return f"{fila.fecha.isoformat()}|{fila.hora_inicio}|{fila.id}"
+
+
+def normalizar_filtros(texto='', busqueda='', turno='', usuario_id='', fecha_inicio='', fecha_fin='',
+                       cursor='', limite=0):
+    """Filtros de la petición como tupla canónica: mismas consultas, misma clave"""
+    usuario_id = str(usuario_id or '').strip()
+    return FiltrosActividades(
+        texto=(texto or '').strip().lower(),
+        busqueda=(busqueda or '').strip().lower(),
+        turno=(turno or '').strip(),
+        usuario_id=int(usuario_id) if usuario_id.isdigit() else None,
+        fecha_inicio=_fecha(fecha_inicio),
+        fecha_fin=_fecha(fecha_fin),
+        cursor=_cursor(cursor),
+        limite=max(int(limite or 0), 0),
+    )
+
+
+class CacheConsultas:
+    """LRU con límite de memoria aproximado (bytes) y métricas de aciertos"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()     # clave -> (pagina, bytes)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._version = None
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    def _quitar(self, clave):
+        _, tamano = self._entradas.pop(clave)
+        self._bytes -= tamano
+
+    def obtener_o_calcular(self, filtros, funcion):
+        version = version_datos.version(*TABLAS)
+        clave = (filtros, version)
+        with self._lock:
+            if version != self._version:
+                # Las entradas de versiones anteriores ya no se pueden acertar: liberar su memoria
+                if self._entradas:
+                    self.invalidaciones += 1
+                self._entradas.clear()
+                self._bytes = 0
+                self._version = version
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave][0]
+            self.fallos += 1
+
+        # Calcular fuera del lock: dos peticiones simultáneas pueden calcular lo mismo
+        pagina = funcion()
+        tamano = _tamano(pagina.filas)
+
+        with self._lock:
+            if version != self._version or tamano > self.max_bytes:
+                return pagina
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (pagina, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                self._quitar(next(iter(self._entradas)))
+                self.expulsiones += 1
+        return pagina
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'memoria_mb': round(self._bytes / 1024 / 1024, 2),
+                'max_memoria_mb': round(self.max_bytes / 1024 / 1024, 2),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'expulsiones': self.expulsiones,
+                'invalidaciones': self.invalidaciones,
+                'tasa_aciertos': round(self.aciertos / total, 4) if total else 0.0,
+            }
+
+
+def _tamano(filas):
+    """Bytes aproximados de las filas; los usuarios se comparten entre filas y se cuentan una vez"""
+    total = sys.getsizeof(filas)
+    usuarios = {}
+    for fila in filas:
+        total += sys.getsizeof(fila) + sum(sys.getsizeof(valor) for valor in fila[:-1])
+        if fila.usuario is not None:
+            usuarios[fila.usuario.id] = fila.usuario
+    for usuario in usuarios.values():
+        total += sys.getsizeof(usuario) + sum(sys.getsizeof(valor) for valor in usuario)
+    return total
+
+
+cache_consultas = CacheConsultas(int(Config.CACHE_CONSULTAS_MB * 1024 * 1024))
+
+
+@etiquetar('consultas.actividades_filtradas')
+def _consultar(filtros):
+    consulta = select(*COLUMNAS_ACTIVIDAD, *COLUMNAS_USUARIO).outerjoin(Usuario, Actividad.usuario_id == Usuario.id)
+
+    if filtros.texto:
+        patron = f'%{filtros.texto}%'
+        consulta = consulta.where(
+            Actividad.codigo_actividad.ilike(patron) |
+            Actividad.descripcion_actividad.ilike(patron) |
+            Actividad.referencia_producto.ilike(patron)
+        )
+    if filtros.busqueda:
+        patron = f'%{filtros.busqueda}%'
+        consulta = consulta.where(Usuario.nombre_completo.ilike(patron) | Usuario.documento.ilike(patron))
+    if filtros.turno:
+        consulta = consulta.where(Actividad.turno == filtros.turno)
+    if filtros.usuario_id is not None:
+        consulta = consulta.where(Actividad.usuario_id == filtros.usuario_id)
+    if filtros.fecha_inicio:
+        consulta = consulta.where(Actividad.fecha >= filtros.fecha_inicio)
+    if filtros.fecha_fin:
+        consulta = consulta.where(Actividad.fecha <= filtros.fecha_fin)
+    if filtros.cursor:
+        # Paginación por clave: continúa después de la última fila de la página anterior
+        consulta = consulta.where(tuple_(Actividad.fecha, Actividad.hora_inicio, Actividad.id) < filtros.cursor)
+
+    consulta = consulta.order_by(Actividad.fecha.desc(), Actividad.hora_inicio.desc(), Actividad.id.desc())
+    if filtros.limite:
+        # Una fila más para saber si hay página siguiente
+        consulta = consulta.limit(filtros.limite + 1)
+
+    n = len(COLUMNAS_ACTIVIDAD)
+    usuarios = {}
+    filas = []
+    for fila in db.session.execute(consulta):
+        usuario = None
+        if fila[n] is not None:
+            usuario = usuarios.get(fila[n])
+            if usuario is None:
+                usuario = usuarios[fila[n]] = UsuarioFila(*fila[n:])
+        filas.append(FilaActividad(*fila[:n], usuario))
+
+    cursor_siguiente = None
+    if filtros.limite and len(filas) > filtros.limite:
+        filas = filas[:filtros.limite]
+        cursor_siguiente = codificar_cursor(filas[-1])
+    return Pagina(tuple(filas), cursor_siguiente)
+
+
+def actividades_filtradas(filtros):
+    """Página de actividades (tuplas FilaActividad) para los filtros normalizados, con caché"""
+    return cache_consultas.obtener_o_calcular(filtros, lambda: _consultar(filtros))
@@ -0,0 +1,82 @@
+"""
+Caché de fragmentos de plantillas y de datos calculados para los dashboards.
+
+Las entradas se indexan por la versión de los datos (version_datos), así que
+un cambio confirmado en usuarios o actividades invalida automáticamente los
+fragmentos que dependen de ellos.
+
+Uso en plantillas:
+    {% call fragmento('admin_graficas', fecha_inicio, fecha_fin) %}
+        ... contenido costoso ...
+    {% endcall %}
+"""
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from app.servicios import version_datos
+
+TABLAS_DASHBOARD = ('usuarios', 'actividades')
+
+
+class CacheFragmentos:
+    """Caché LRU de valores calculados con contadores de aciertos"""
+
+    def __init__(self, max_entradas=256):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener_o_calcular(self, clave, funcion):
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave]
+            self.fallos += 1
+
+        # Calcular fuera del lock: dos peticiones simultáneas pueden calcular lo mismo
+        valor = funcion()
+
+        with self._lock:
+            self._entradas[clave] = valor
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return valor
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / total, 4) if total else 0.0,
+            }
+
+
+cache_fragmentos = CacheFragmentos()
+
+
+def memorizar(nombre, *partes, tablas=TABLAS_DASHBOARD, funcion):
+    """Devuelve el resultado de `funcion` cacheado por nombre, partes y versión de datos"""
+    clave = (nombre, partes, version_datos.version(*tablas))
+    return cache_fragmentos.obtener_o_calcular(clave, funcion)
+
+
+def fragmento(nombre, *partes, tablas=TABLAS_DASHBOARD, caller=None):
+    """Global de Jinja: renderiza el bloque {% call %} una vez por versión de datos"""
+    return Markup(memorizar(nombre, *partes, tablas=tablas, funcion=caller))
+
+
+def instalar_cache_plantillas(app):
+    """Expone `fragmento` a las plantillas"""
+    app.jinja_env.globals['fragmento'] = fragmento
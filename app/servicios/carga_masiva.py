@@ -0,0 +1,196 @@
+"""
+Carga masiva de hojas de turno fotografiadas (flask cargar-hojas).
+
+Las imágenes de un directorio se reparten entre procesos, cada uno con su
+propio motor OCR ya cargado y con prioridad baja (nice) para no quitarle CPU
+a la aplicación web. El proceso principal corrige los registros, los guarda
+por lotes con guardar_actividades (sin duplicar) y, después de cada commit,
+anota en un manifiesto las imágenes terminadas: si la carga se interrumpe,
+al volver a ejecutarla continúa donde quedó.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime
+
+from config import Config
+from extensions import db
+from app.servicios.datos_referencia import referencias
+from app.servicios.ingesta_actividades import guardar_actividades
+from app.servicios import archivo_imagenes
+from app.servicios.registros_ocr import registro_a_fila
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES = {'.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp'}
+NOMBRE_MANIFIESTO = '.carga_hojas.json'
+PATRON_FECHA = re.compile(r'(\d{4})[-_]?(\d{2})[-_]?(\d{2})')
+
+
+# ---------------------
+# MANIFIESTO
+# ---------------------
+def leer_manifiesto(ruta):
+    try:
+        with open(ruta, encoding='utf-8') as archivo:
+            manifiesto = json.load(archivo)
+    except (OSError, ValueError):
+        manifiesto = {}
+    manifiesto.setdefault('completadas', {})
+    manifiesto.setdefault('fallidas', {})
+    return manifiesto
+
+
+def guardar_manifiesto(ruta, manifiesto):
+    manifiesto['actualizado'] = datetime.now().isoformat(timespec='seconds')
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, ensure_ascii=False, indent=1)
+    os.replace(temporal, ruta)
+
+
+# ---------------------
+# TRABAJADORES
+# ---------------------
+def _iniciar_trabajador(prioridad, hilos_cpu):
+    """Inicializador de cada proceso: baja la prioridad y precarga el motor OCR"""
+    if prioridad and hasattr(os, 'nice'):
+        os.nice(prioridad)
+    Config.OCR_MAX_MOTORES = 1
+    Config.OCR_HILOS_CPU = hilos_cpu
+    from app.servicios.ocr_servicio import obtener_motor_ocr
+    obtener_motor_ocr()
+
+
+def _procesar_hoja(ruta):
+    """
+    Se ejecuta en un proceso trabajador: devuelve los registros de la imagen.
+    Un error de lectura u OCR llega a recibir() y la hoja queda como fallida
+    """
+    from app.servicios.ocr_servicio import extraer_registros
+    return extraer_registros(ruta)
+
+
+# ---------------------
+# CARGA
+# ---------------------
+def buscar_imagenes(directorio):
+    """Rutas relativas de las imágenes del directorio (recursivo), ordenadas"""
+    encontradas = []
+    for raiz, _, archivos in os.walk(directorio):
+        for nombre in archivos:
+            if os.path.splitext(nombre)[1].lower() in EXTENSIONES:
+                encontradas.append(os.path.relpath(os.path.join(raiz, nombre), directorio))
+    return sorted(encontradas)
+
+
+def fecha_de_hoja(directorio, relativa):
+    """Fecha de la hoja: AAAA-MM-DD en la ruta o, si no hay, la de modificación del archivo"""
+    coincidencia = PATRON_FECHA.search(relativa)
+    if coincidencia:
+        try:
+            return date(*(int(parte) for parte in coincidencia.groups()))
+        except ValueError:
+            pass
+    return date.fromtimestamp(os.path.getmtime(os.path.join(directorio, relativa)))
+
+
+def cargar_hojas(directorio, usuario_id, turno='Mañana', fecha=None, procesos=None, prioridad=10,
+                 hilos_cpu=1, tamano_lote=200, reintentar=False, manifiesto=None, progreso=None):
+    """
+    Procesa las imágenes pendientes del directorio y guarda sus filas.
+    Debe llamarse dentro de un contexto de aplicación. Devuelve un resumen.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    ruta_manifiesto = manifiesto or os.path.join(directorio, NOMBRE_MANIFIESTO)
+    estado = leer_manifiesto(ruta_manifiesto)
+    if reintentar:
+        estado['fallidas'] = {}
+
+    pendientes = [ruta for ruta in buscar_imagenes(directorio)
+                  if ruta not in estado['completadas'] and ruta not in estado['fallidas']]
+    resumen = {'pendientes': len(pendientes), 'procesadas': 0, 'fallidas': 0,
+               'insertadas': 0, 'actualizadas': 0, 'omitidas': 0}
+    if not pendientes:
+        resumen['paginas_por_segundo'] = 0.0
+        return resumen
+
+    lote_filas, lote_hojas = [], {}
+
+    def confirmar_lote():
+        if not lote_hojas:
+            return
+        try:
+            resultado = guardar_actividades(lote_filas)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error guardando un lote de {len(lote_hojas)} hojas: {str(e)}")
+            for relativa in lote_hojas:
+                estado['fallidas'][relativa] = f"Error al guardar: {str(e)}"
+            resumen['fallidas'] += len(lote_hojas)
+        else:
+            estado['completadas'].update(lote_hojas)
+            resumen['insertadas'] += resultado.insertadas
+            resumen['actualizadas'] += resultado.actualizadas
+            resumen['omitidas'] += resultado.omitidas
+        guardar_manifiesto(ruta_manifiesto, estado)
+        lote_filas.clear()
+        lote_hojas.clear()
+
+    def recibir(relativa, futuro):
+        try:
+            registros = futuro.result()
+            # La hoja se archiva en segundo plano en este proceso, con los recortes de sus filas
+            with open(os.path.join(directorio, relativa), 'rb') as archivo:
+                imagen_hash = archivo_imagenes.archivar(archivo.read(), [r.get('bbox') for r in registros])
+            filas = []
+            for registro in registros:
+                referencias.corregir_registro(registro)
+                filas.append(registro_a_fila(registro, usuario_id, fecha or fecha_de_hoja(directorio, relativa), turno,
+                                             imagen_hash=imagen_hash))
+        except Exception as e:
+            estado['fallidas'][relativa] = str(e)
+            resumen['fallidas'] += 1
+            return
+        lote_filas.extend(filas)
+        lote_hojas[relativa] = len(filas)
+        resumen['procesadas'] += 1
+        if len(lote_filas) >= tamano_lote:
+            confirmar_lote()
+
+    inicio = time.perf_counter()
+    # spawn: los trabajadores no heredan la aplicación, sus conexiones ni sus hilos
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto,
+                             initializer=_iniciar_trabajador, initargs=(prioridad, hilos_cpu)) as ejecutor:
+        restantes = iter(pendientes)
+        en_vuelo = {}
+        while True:
+            # Como máximo dos imágenes por proceso en vuelo
+            while len(en_vuelo) < procesos * 2:
+                relativa = next(restantes, None)
+                if relativa is None:
+                    break
+                en_vuelo[ejecutor.submit(_procesar_hoja, os.path.join(directorio, relativa))] = relativa
+            if not en_vuelo:
+                break
+            terminados, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                recibir(en_vuelo.pop(futuro), futuro)
+            if progreso:
+                duracion = time.perf_counter() - inicio
+                progreso(resumen['procesadas'] + resumen['fallidas'], len(pendientes),
+                         resumen['procesadas'] / duracion if duracion else 0.0)
+        confirmar_lote()
+
+    duracion = time.perf_counter() - inicio
+    guardar_manifiesto(ruta_manifiesto, estado)
+    resumen['duracion_s'] = round(duracion, 2)
+    resumen['paginas_por_segundo'] = round(resumen['procesadas'] / duracion, 3) if duracion else 0.0
+    resumen['errores'] = dict(list(estado['fallidas'].items())[-20:])
+    return resumen
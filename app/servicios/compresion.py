@@ -0,0 +1,108 @@
+"""
+Compresión de respuestas (gzip, o brotli si está instalado) y URLs con huella
+para los recursos de app/static, servidos con caché de larga duración.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional
+    brotli = None
+
+TIPOS_COMPRIMIBLES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv',
+    'application/json', 'application/javascript', 'text/javascript', 'image/svg+xml',
+}
+TAMANO_MINIMO = 500
+NIVEL_GZIP = 6
+NIVEL_BROTLI = 5
+CACHE_ESTATICOS = 'public, max-age=31536000, immutable'
+
+
+def _elegir_codificacion(aceptadas):
+    if brotli is not None and 'br' in aceptadas:
+        return 'br'
+    if 'gzip' in aceptadas:
+        return 'gzip'
+    return None
+
+
+def _comprimir(datos, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=NIVEL_BROTLI)
+    return gzip.compress(datos, compresslevel=NIVEL_GZIP)
+
+
+def instalar_compresion(app):
+    """Comprime las respuestas de texto según Accept-Encoding"""
+    # Los estáticos no cambian sin cambiar su ETag: se guarda su versión comprimida
+    estaticos_comprimidos = {}
+    lock = threading.Lock()
+
+    @app.after_request
+    def comprimir_respuesta(respuesta):
+        if (respuesta.status_code != 200
+                or respuesta.is_streamed
+                or 'Content-Encoding' in respuesta.headers
+                or respuesta.mimetype not in TIPOS_COMPRIMIBLES):
+            return respuesta
+
+        codificacion = _elegir_codificacion(request.accept_encodings)
+        respuesta.vary.add('Accept-Encoding')
+        if codificacion is None:
+            return respuesta
+
+        respuesta.direct_passthrough = False
+        datos = respuesta.get_data()
+        if len(datos) < TAMANO_MINIMO:
+            return respuesta
+
+        if request.endpoint == 'static':
+            clave = (request.path, respuesta.get_etag()[0], codificacion)
+            with lock:
+                comprimido = estaticos_comprimidos.get(clave)
+            if comprimido is None:
+                comprimido = _comprimir(datos, codificacion)
+                with lock:
+                    estaticos_comprimidos[clave] = comprimido
+        else:
+            comprimido = _comprimir(datos, codificacion)
+
+        respuesta.set_data(comprimido)
+        respuesta.headers['Content-Encoding'] = codificacion
+        return respuesta
+
+
+def instalar_recursos_estaticos(app):
+    """
+    Agrega ?v=<hash del contenido> a url_for('static', ...) y sirve esas URLs
+    con caché de un año: un cambio en el archivo cambia la URL.
+    """
+    huellas = {}
+
+    @app.url_defaults
+    def agregar_huella(endpoint, valores):
+        if endpoint != 'static' or 'filename' not in valores or 'v' in valores:
+            return
+        ruta = os.path.join(app.static_folder, valores['filename'])
+        try:
+            modificado = os.path.getmtime(ruta)
+        except OSError:
+            return
+        huella = huellas.get(ruta)
+        if huella is None or huella[0] != modificado:
+            with open(ruta, 'rb') as archivo:
+                huella = (modificado, hashlib.md5(archivo.read()).hexdigest()[:12])
+            huellas[ruta] = huella
+        valores['v'] = huella[1]
+
+    @app.after_request
+    def cache_estaticos(respuesta):
+        if request.endpoint == 'static' and request.args.get('v') and respuesta.status_code == 200:
+            respuesta.headers['Cache-Control'] = CACHE_ESTATICOS
+        return respuesta
@@ -0,0 +1,377 @@
+"""
+Caché en memoria de datos de referencia: operarios, códigos de equipo y
+códigos de actividad.
+
+Se carga al iniciar la aplicación y se mantiene al día con los cambios
+confirmados (version_datos). Permite validar valores en O(1) y sugerir el
+valor conocido más parecido mediante un índice de trigramas precalculado.
+
+Los códigos se comparan sin distinguir mayúsculas ni espacios en los extremos
+y se toman del catálogo `codigos_referencia`, no de las actividades: una fila
+creada por OCR sin revisar no valida su propio código mal leído. El catálogo
+crece con los códigos que una persona escribe o confirma (formularios y
+revisión del OCR); en una base existente se siembra una vez con los códigos ya
+guardados, incluidos los del archivo histórico.
+
+Los códigos que agrega otro worker se leen por incrementos (ids posteriores
+al último visto); una recarga completa, como máximo cada
+REFERENCIAS_RECARGA_MAX segundos, recoge los que quedaron atrás.
+"""
+import json
+import zlib
+import threading
+import logging
+from collections import namedtuple, Counter, defaultdict
+from time import monotonic
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import Config
+from extensions import db
+from app.models import Usuario, Actividad, CodigoReferencia
+from app.servicios import archivo_historico, version_datos
+from app.servicios.perfilador import etiquetar
+from app.servicios.normalizacion import registrar_codigos_actividad
+
+logger = logging.getLogger(__name__)
+
+Operario = namedtuple('Operario', ['id', 'nombre_completo', 'documento', 'rol'])
+
+# Similitud mínima para reemplazar automáticamente un valor leído por OCR
+# (los códigos son cortos, así que la similitud de trigramas es baja)
+UMBRAL_CORRECCION = 0.4
+
+# Columna de Actividad de cada tipo de código
+CAMPOS_CODIGO = (('codigo_equipo', 'equipo'), ('codigo_actividad', 'actividad'))
+
+
+def _clave(valor):
+    """Forma de comparación de un código: sin espacios en los extremos y en mayúsculas"""
+    return str(valor).strip().upper()
+
+
+def _trigramas(texto):
+    texto = f"  {texto.upper()} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTrigramas:
+    """Índice invertido trigrama -> valores para búsqueda aproximada"""
+
+    def __init__(self, valores=()):
+        self.valores = []
+        self.trigramas = []
+        self.indice = defaultdict(list)
+        for valor in valores:
+            self.agregar(valor)
+
+    def agregar(self, valor):
+        posicion = len(self.valores)
+        trigramas = _trigramas(valor)
+        self.valores.append(valor)
+        self.trigramas.append(len(trigramas))
+        for trigrama in trigramas:
+            self.indice[trigrama].append(posicion)
+
+    def sugerir(self, texto, limite=5, umbral=0.3):
+        """Devuelve [(valor, similitud)] ordenado por similitud de Jaccard"""
+        consulta = _trigramas(texto)
+        if not consulta:
+            return []
+        comunes = Counter()
+        for trigrama in consulta:
+            comunes.update(self.indice.get(trigrama, ()))
+        resultados = []
+        for posicion, compartidos in comunes.items():
+            similitud = compartidos / (len(consulta) + self.trigramas[posicion] - compartidos)
+            if similitud >= umbral:
+                resultados.append((self.valores[posicion], round(similitud, 3)))
+        resultados.sort(key=lambda r: (-r[1], r[0]))
+        return resultados[:limite]
+
+
+class CacheReferencia:
+    """Datos de referencia del proceso, protegidos por un lock"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operarios = {}
+        self._valores = {'equipo': set(), 'actividad': set()}
+        # clave normalizada -> valor tal como está guardado
+        self._claves = {'equipo': {}, 'actividad': {}}
+        self._ultimo_codigo = 0
+        self._carga_codigos = None
+        self._indices = {}
+        self._json = None
+        self._recargar_operarios = True
+        self._recargar_codigos = True
+        self._versiones_vistas = None
+
+    # ---------------------
+    # CARGA
+    # ---------------------
+    def cargar(self):
+        """Carga todos los datos desde la base de datos (requiere contexto de aplicación)"""
+        with self._lock:
+            self._cargar_operarios()
+            self._cargar_codigos()
+
+    def _cargar_operarios(self):
+        filas = db.session.execute(
+            select(Usuario.id, Usuario.nombre_completo, Usuario.documento, Usuario.rol)
+            .where(Usuario.rol == 'Operario')
+            .order_by(Usuario.nombre_completo)
+        ).all()
+        self._operarios = {fila.id: Operario(*fila) for fila in filas}
+        self._indices.pop('operario', None)
+        self._json = None
+        self._recargar_operarios = False
+
+    def _cargar_codigos(self):
+        self._valores = {'equipo': set(), 'actividad': set()}
+        self._claves = {'equipo': {}, 'actividad': {}}
+        self._ultimo_codigo = 0
+        self._indices.pop('equipo', None)
+        self._indices.pop('actividad', None)
+        for fila in db.session.execute(
+            select(CodigoReferencia.id, CodigoReferencia.tipo, CodigoReferencia.valor).order_by(CodigoReferencia.id)
+        ):
+            self._agregar_fila(fila)
+        self._json = None
+        self._recargar_codigos = False
+        self._carga_codigos = monotonic()
+        registrar_codigos_actividad(self._valores['actividad'])
+
+    def _cargar_codigos_nuevos(self):
+        """Códigos agregados al catálogo (por otro worker) desde la última lectura"""
+        antes = len(self._valores['actividad'])
+        for fila in db.session.execute(
+            select(CodigoReferencia.id, CodigoReferencia.tipo, CodigoReferencia.valor)
+            .where(CodigoReferencia.id > self._ultimo_codigo)
+            .order_by(CodigoReferencia.id)
+        ):
+            self._agregar_fila(fila)
+        if len(self._valores['actividad']) != antes:
+            registrar_codigos_actividad(self._valores['actividad'])
+
+    def _agregar_fila(self, fila):
+        self._ultimo_codigo = max(self._ultimo_codigo, fila.id)
+        if fila.tipo in self._valores:
+            self._agregar_valor(fila.tipo, fila.valor)
+
+    def _versiones(self):
+        # Solo los commits de otros procesos: los propios llegan por aplicar_cambios
+        return version_datos.version_ajena(Usuario.__tablename__, CodigoReferencia.__tablename__)
+
+    def _asegurar_cargado(self):
+        versiones = self._versiones()
+        if self._versiones_vistas is not None:
+            self._recargar_operarios |= versiones[0] != self._versiones_vistas[0]
+            if versiones[1] != self._versiones_vistas[1] and not self._recargar_codigos:
+                # Un id menor confirmado después se pierde aquí: lo recoge la recarga completa
+                if monotonic() - self._carga_codigos > Config.REFERENCIAS_RECARGA_MAX:
+                    self._recargar_codigos = True
+                else:
+                    self._cargar_codigos_nuevos()
+        self._versiones_vistas = versiones
+        if self._recargar_operarios:
+            self._cargar_operarios()
+        if self._recargar_codigos:
+            self._cargar_codigos()
+
+    def aplicar_cambios(self, cambios):
+        """Suscriptor de version_datos: mantiene la caché al día"""
+        with self._lock:
+            for cambio in cambios:
+                if cambio.tabla == Usuario.__tablename__:
+                    self._recargar_operarios = True
+                elif cambio.tabla == CodigoReferencia.__tablename__:
+                    if cambio.operacion == 'insertar' and cambio.datos.get('tipo') in self._valores:
+                        antes = len(self._valores['actividad'])
+                        self._agregar_valor(cambio.datos['tipo'], cambio.datos.get('valor'))
+                        if len(self._valores['actividad']) != antes:
+                            registrar_codigos_actividad(self._valores['actividad'])
+                    else:
+                        self._recargar_codigos = True
+
+    def confirmar_codigos(self, session, filas):
+        """
+        Agrega al catálogo, en la transacción de `session`, los códigos aún no
+        conocidos de filas que una persona escribió o revisó (diccionarios o
+        Actividad). Se conocen en la caché con el commit
+        """
+        nuevos = {}
+        with self._lock:
+            self._asegurar_cargado()
+            for fila in filas:
+                for campo, tipo in CAMPOS_CODIGO:
+                    valor = fila.get(campo) if isinstance(fila, dict) else getattr(fila, campo)
+                    if valor and _clave(valor) and _clave(valor) not in self._claves[tipo]:
+                        nuevos.setdefault((tipo, _clave(valor)), str(valor).strip())
+        for (tipo, _), valor in sorted(nuevos.items()):
+            session.add(CodigoReferencia(tipo=tipo, valor=valor))
+        return len(nuevos)
+
+    def _agregar_valor(self, tipo, valor):
+        if not valor or not _clave(valor) or valor in self._valores[tipo]:
+            return
+        self._valores[tipo].add(valor)
+        self._claves[tipo].setdefault(_clave(valor), valor)
+        if tipo in self._indices:
+            self._indices[tipo].agregar(valor)
+        self._json = None
+
+    # ---------------------
+    # CONSULTAS
+    # ---------------------
+    def operarios(self):
+        """Lista de operarios ordenada por nombre"""
+        with self._lock:
+            self._asegurar_cargado()
+            return list(self._operarios.values())
+
+    def es_valido(self, tipo, valor):
+        """Valida en O(1) un código de equipo/actividad o un id de operario"""
+        with self._lock:
+            self._asegurar_cargado()
+            if tipo == 'operario':
+                try:
+                    return int(valor) in self._operarios
+                except (TypeError, ValueError):
+                    return False
+            return valor is not None and _clave(valor) in self._claves[tipo]
+
+    def canonico(self, tipo, valor):
+        """Código conocido tal como está guardado (p. ej. 'eq-101' -> 'EQ-101'), o None"""
+        if valor is None:
+            return None
+        with self._lock:
+            self._asegurar_cargado()
+            return self._claves[tipo].get(_clave(valor))
+
+    def _indice(self, tipo):
+        if tipo not in self._indices:
+            if tipo == 'operario':
+                self._indices[tipo] = IndiceTrigramas(o.nombre_completo for o in self._operarios.values())
+            else:
+                self._indices[tipo] = IndiceTrigramas(sorted(self._valores[tipo]))
+        return self._indices[tipo]
+
+    def sugerir(self, tipo, valor, limite=5):
+        """Valores conocidos más parecidos a `valor`: [(valor, similitud)]"""
+        with self._lock:
+            self._asegurar_cargado()
+            return self._indice(tipo).sugerir(valor or '', limite)
+
+    def como_json(self):
+        """Devuelve (cuerpo JSON, etag) para el autocompletado de formularios"""
+        with self._lock:
+            self._asegurar_cargado()
+            if self._json is None:
+                cuerpo = json.dumps({
+                    'operarios': [
+                        {'id': o.id, 'nombre_completo': o.nombre_completo, 'documento': o.documento}
+                        for o in self._operarios.values()
+                    ],
+                    'codigos_equipo': sorted(self._valores['equipo']),
+                    'codigos_actividad': sorted(self._valores['actividad']),
+                }, ensure_ascii=False)
+                etag = f'ref-{zlib.crc32(cuerpo.encode("utf-8")):08x}'
+                self._json = (cuerpo, etag)
+            return self._json
+
+    @etiquetar('referencias.corregir_registro')
+    def corregir_registro(self, registro):
+        """
+        Reemplaza los códigos no reconocidos de un registro OCR por el valor
+        conocido más parecido, si hay un candidato único que supere UMBRAL_CORRECCION
+        """
+        for campo, tipo in (('codigo_equipo', 'equipo'), ('codigo_actividad', 'actividad')):
+            valor = registro.get(campo)
+            if not valor:
+                continue
+            conocido = self.canonico(tipo, valor)
+            if conocido is not None:
+                registro[campo] = conocido
+                continue
+            sugerencias = self.sugerir(tipo, valor, limite=2)
+            # Solo corregir si hay un único candidato claramente mejor
+            empate = len(sugerencias) > 1 and sugerencias[1][1] == sugerencias[0][1]
+            if sugerencias and sugerencias[0][1] >= UMBRAL_CORRECCION and not empate:
+                registro[campo] = sugerencias[0][0]
+                validacion = registro.setdefault('validacion', {}).setdefault(campo, {})
+                validacion['valido'] = True
+                validacion['corregido_desde'] = valor
+        return registro
+
+
+referencias = CacheReferencia()
+
+
+def _codigos_editados(objeto):
+    estado = inspect(objeto)
+    return any(estado.attrs[campo].history.has_changes() for campo, _ in CAMPOS_CODIGO)
+
+
+def _confirmar_formularios(session, contexto, instancias):
+    """
+    Las actividades creadas o editadas con el ORM vienen de formularios: los
+    códigos escritos en ellos quedan confirmados
+    """
+    actividades = [objeto for objeto in session.new if isinstance(objeto, Actividad)]
+    actividades += [objeto for objeto in session.dirty
+                    if isinstance(objeto, Actividad) and _codigos_editados(objeto)]
+    if actividades:
+        with session.no_autoflush:
+            referencias.confirmar_codigos(session, actividades)
+
+
+def sembrar_catalogo():
+    """
+    Primera carga del catálogo en una base existente: los códigos ya guardados
+    (tabla y archivo histórico) se dan por confirmados. Devuelve los agregados
+    """
+    if db.session.execute(select(func.count()).select_from(CodigoReferencia)).scalar():
+        return 0
+    claves = {'equipo': {}, 'actividad': {}}
+    for campo, tipo in CAMPOS_CODIGO:
+        for valor in db.session.execute(select(getattr(Actividad, campo)).distinct()).scalars():
+            if valor and _clave(valor):
+                claves[tipo].setdefault(_clave(valor), str(valor).strip())
+    try:
+        archivados = archivo_historico.valores_archivados([campo for campo, _ in CAMPOS_CODIGO])
+    except Exception as e:
+        logger.error(f"Error leyendo los códigos del archivo histórico: {str(e)}")
+        archivados = {}
+    for campo, tipo in CAMPOS_CODIGO:
+        for valor in archivados.get(campo, ()):
+            if valor and _clave(valor):
+                claves[tipo].setdefault(_clave(valor), str(valor).strip())
+    filas = [{'tipo': tipo, 'valor': valor} for tipo in claves for valor in sorted(claves[tipo].values())]
+    if not filas:
+        return 0
+    try:
+        db.session.execute(CodigoReferencia.__table__.insert(), filas)
+        db.session.commit()
+    except IntegrityError:
+        # Otro proceso lo sembró a la vez
+        db.session.rollback()
+        return 0
+    version_datos.notificar_cambio(CodigoReferencia.__tablename__)
+    return len(filas)
+
+
+def iniciar_referencias(app):
+    """Carga la caché al arrancar y la suscribe a los cambios de datos"""
+    version_datos.instalar()
+    version_datos.suscribir(referencias.aplicar_cambios)
+    if not event.contains(Session, 'before_flush', _confirmar_formularios):
+        event.listen(Session, 'before_flush', _confirmar_formularios)
+    with app.app_context():
+        try:
+            sembrar_catalogo()
+            referencias.cargar()
+        except Exception as e:
+            logger.error(f"Error cargando datos de referencia: {str(e)}")
@@ -0,0 +1,184 @@
+"""
+Flujo en vivo de cambios de actividades (Server-Sent Events).
+
+Un único feed en memoria recibe los cambios confirmados de version_datos,
+serializa cada evento una sola vez y lo guarda en un búfer circular. Cada
+dashboard abierto solo espera sobre la misma condición y lee los eventos
+posteriores a su último id, sin volver a consultar la base de datos. Los
+cambios hechos en otro worker solo se conocen por la versión compartida: al
+detectarlos (cada INTERVALO_PING como máximo) se envía un evento de recarga.
+
+Cada conexión ocupa un hilo del worker (gthread) mientras está abierta, así
+que el flujo se cierra tras SSE_DURACION_MAX segundos: el navegador reconecta
+solo (EventSource) enviando Last-Event-ID y recibe lo que se perdió entretanto.
+Los ids son '<época>-<secuencia>', con una época propia de cada proceso: si
+la reconexión llega a otro worker (o a uno reiniciado), la secuencia no
+significa nada allí y el cliente recibe un evento de recarga.
+"""
+import json
+import os
+import threading
+from collections import deque
+from datetime import date, datetime, time
+from time import monotonic, time as ahora_epoch
+
+from config import Config
+from app.servicios import version_datos
+
+TABLA_ACTIVIDADES = 'actividades'
+INTERVALO_PING = 15  # segundos entre comentarios keep-alive
+
+
+def _serializar(valor):
+    if isinstance(valor, (date, datetime, time)):
+        return valor.isoformat()
+    return str(valor)
+
+
+class FeedCambios:
+    """Búfer circular de eventos con espera bloqueante para los clientes"""
+
+    def __init__(self, capacidad=500):
+        self._condicion = threading.Condition()
+        self._eventos = deque(maxlen=capacidad)
+        self._secuencia = 0
+        self.total_actividades = None
+        self.clientes = 0
+        self._pid = None
+        self._epoca = None
+        self._ajena_vista = None
+
+    def _asegurar_proceso(self):
+        """Época y búfer propios del proceso actual (con la condición tomada)"""
+        if self._pid != os.getpid():
+            # El feed se crea en el maestro (preload_app): cada worker empieza el suyo
+            self._pid = os.getpid()
+            self._epoca = f"{self._pid}.{int(ahora_epoch() * 1000)}"
+            self._eventos.clear()
+            self._secuencia = 0
+            self.total_actividades = None
+            self._ajena_vista = version_datos.version_ajena(TABLA_ACTIVIDADES)
+
+    def iniciar_total(self, contar):
+        """Inicializa el contador de actividades con `contar()` si aún no se conoce"""
+        with self._condicion:
+            self._asegurar_proceso()
+            if self.total_actividades is None:
+                self.total_actividades = contar()
+            return self.total_actividades
+
+    def publicar(self, cambios):
+        """Suscriptor de version_datos"""
+        cambios = [c for c in cambios if c.tabla == TABLA_ACTIVIDADES]
+        if not cambios:
+            return
+        hora = datetime.now().strftime('%H:%M:%S')
+        with self._condicion:
+            self._asegurar_proceso()
+            for cambio in cambios:
+                if cambio.operacion == 'masivo':
+                    # Cambios fuera del ORM: los clientes deben recargar y el total recontarse
+                    self.total_actividades = None
+                    tipo, datos = 'recargar', {'hora': hora}
+                else:
+                    if self.total_actividades is not None:
+                        if cambio.operacion == 'insertar':
+                            self.total_actividades += 1
+                        elif cambio.operacion == 'eliminar':
+                            self.total_actividades -= 1
+                    tipo, datos = 'actividad', {
+                        'operacion': cambio.operacion,
+                        'actividad': cambio.datos,
+                        'total_actividades': self.total_actividades,
+                        'hora': hora,
+                    }
+                self._agregar(tipo, datos)
+            self._condicion.notify_all()
+
+    def _evento(self, secuencia, tipo, texto):
+        return f"id: {self._epoca}-{secuencia}\nevent: {tipo}\ndata: {texto}\n\n"
+
+    def _agregar(self, tipo, datos):
+        self._secuencia += 1
+        texto = json.dumps(datos, default=_serializar, ensure_ascii=False)
+        self._eventos.append((self._secuencia, self._evento(self._secuencia, tipo, texto)))
+
+    def _revisar_otros_procesos(self):
+        """Si otro worker confirmó cambios, pide a los clientes recargar (con la condición tomada)"""
+        # Solo los commits ajenos: los propios ya llegaron (o están llegando) por publicar
+        actual = version_datos.version_ajena(TABLA_ACTIVIDADES)
+        if actual != self._ajena_vista:
+            self._ajena_vista = actual
+            self.total_actividades = None
+            self._agregar('recargar', {'hora': datetime.now().strftime('%H:%M:%S')})
+            self._condicion.notify_all()
+
+    def posicion(self, ultimo_id):
+        """
+        (secuencia desde la que reanudar, recargar) para el Last-Event-ID de
+        una reconexión. Un id de otra época (otro proceso) obliga a recargar
+        """
+        with self._condicion:
+            self._asegurar_proceso()
+            if not ultimo_id:
+                return self._secuencia, False
+            epoca, _, secuencia = ultimo_id.rpartition('-')
+            if epoca != self._epoca or not secuencia.isdigit():
+                return self._secuencia, True
+            return min(int(secuencia), self._secuencia), False
+
+    def esperar(self, desde, timeout=INTERVALO_PING):
+        """
+        Devuelve los eventos con secuencia > desde, esperando hasta `timeout`.
+        Si el cliente se atrasó más que el búfer, devuelve un evento de recarga.
+        """
+        with self._condicion:
+            if self._secuencia <= desde:
+                self._condicion.wait(timeout)
+                self._revisar_otros_procesos()
+            if self._eventos and desde < self._eventos[0][0] - 1:
+                return [(self._secuencia, self._evento(self._secuencia, 'recargar', '{}'))]
+            return [evento for evento in self._eventos if evento[0] > desde]
+
+    def flujo(self, ultimo_id=None, duracion_max=None):
+        """
+        Generador de texto SSE para un cliente que reanuda desde `ultimo_id`
+        (Last-Event-ID). Termina tras `duracion_max` segundos (por defecto
+        Config.SSE_DURACION_MAX) para liberar el hilo
+        """
+        duracion_max = Config.SSE_DURACION_MAX if duracion_max is None else duracion_max
+        limite = monotonic() + duracion_max
+        desde, recargar = self.posicion(ultimo_id)
+        with self._condicion:
+            self.clientes += 1
+            if recargar:
+                # Lo que el cliente tiene puede no coincidir con este proceso
+                inicial = self._evento(desde, 'recargar', json.dumps({'hora': datetime.now().strftime('%H:%M:%S')}))
+            else:
+                # Un id sin datos fija el Last-Event-ID con el que reconectará el navegador
+                inicial = f"id: {self._epoca}-{desde}\n\n"
+        try:
+            yield "retry: 2000\n\n" + inicial
+            while True:
+                restante = limite - monotonic()
+                if restante <= 0:
+                    return
+                eventos = self.esperar(desde, min(INTERVALO_PING, restante))
+                if not eventos:
+                    yield ": ping\n\n"
+                    continue
+                for secuencia, texto in eventos:
+                    desde = secuencia
+                    yield texto
+        finally:
+            with self._condicion:
+                self.clientes -= 1
+
+
+feed_actividades = FeedCambios()
+
+
+def iniciar_feed():
+    """Conecta el feed a los cambios confirmados"""
+    version_datos.instalar()
+    version_datos.suscribir(feed_actividades.publicar)
@@ -0,0 +1,167 @@
+"""
+Importación masiva de usuarios desde CSV.
+
+Columnas: nombre_completo (o nombre), documento, contraseña (o contrasena) y
+rol. La unicidad de los documentos se verifica con una sola consulta por
+conjunto, las contraseñas se cifran con bcrypt en paralelo en un pool de
+procesos y todos los usuarios válidos se insertan en una transacción. Las
+filas con errores se informan (número de fila y motivo) y no se insertan.
+"""
+import csv
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt as bcrypt_lib
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from app.models import Usuario
+from app.servicios import auditoria, version_datos
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('Admin', 'Analista', 'Operario')
+ALIAS_COLUMNAS = {
+    'nombre': 'nombre_completo',
+    'contrasena': 'contraseña',
+    'password': 'contraseña',
+}
+# Por debajo de esta cantidad no compensa arrancar procesos
+MINIMO_PARALELO = 16
+TAMANO_CONSULTA = 1000
+
+
+def leer_csv(contenido):
+    """Filas del CSV (texto o bytes) como diccionarios con columnas normalizadas"""
+    if isinstance(contenido, bytes):
+        contenido = contenido.decode('utf-8-sig')
+    try:
+        dialecto = csv.Sniffer().sniff(contenido[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    lector = csv.DictReader(io.StringIO(contenido), dialect=dialecto)
+    filas = []
+    for fila in lector:
+        normalizada = {}
+        for columna, valor in fila.items():
+            if columna is None:
+                continue
+            columna = columna.strip().lower()
+            normalizada[ALIAS_COLUMNAS.get(columna, columna)] = (valor or '').strip()
+        filas.append(normalizada)
+    return filas
+
+
+def _hashear(argumentos):
+    """Se ejecuta en un proceso del pool: cifra una contraseña con bcrypt"""
+    contraseña, rondas = argumentos
+    return bcrypt_lib.hashpw(contraseña.encode('utf-8'), bcrypt_lib.gensalt(rondas)).decode('utf-8')
+
+
+def hashear_contraseñas(contraseñas, rondas, procesos=None):
+    """Cifra las contraseñas en paralelo (en orden)"""
+    argumentos = [(contraseña, rondas) for contraseña in contraseñas]
+    if len(argumentos) < MINIMO_PARALELO:
+        return [_hashear(a) for a in argumentos]
+    procesos = procesos or os.cpu_count() or 1
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as ejecutor:
+        return list(ejecutor.map(_hashear, argumentos, chunksize=max(1, len(argumentos) // (procesos * 4))))
+
+
+def _documentos_existentes(documentos):
+    existentes = set()
+    documentos = list(documentos)
+    for inicio in range(0, len(documentos), TAMANO_CONSULTA):
+        existentes.update(db.session.execute(
+            select(Usuario.documento).where(Usuario.documento.in_(documentos[inicio:inicio + TAMANO_CONSULTA]))
+        ).scalars())
+    return existentes
+
+
+def _ids_por_documento(documentos):
+    ids = {}
+    for inicio in range(0, len(documentos), TAMANO_CONSULTA):
+        ids.update((documento, id_) for documento, id_ in db.session.execute(
+            select(Usuario.documento, Usuario.id).where(Usuario.documento.in_(documentos[inicio:inicio + TAMANO_CONSULTA]))
+        ))
+    return ids
+
+
+def validar_filas(filas):
+    """Devuelve (filas válidas con su número, errores [{'fila', 'documento', 'error'}])"""
+    errores = []
+    candidatas = []
+    vistos = set()
+    # La fila 1 es el encabezado
+    for numero, fila in enumerate(filas, start=2):
+        documento = fila.get('documento', '')
+        faltantes = [c for c in ('nombre_completo', 'documento', 'contraseña', 'rol') if not fila.get(c)]
+        if faltantes:
+            error = f"Faltan campos: {', '.join(faltantes)}"
+        elif fila['rol'] not in ROLES:
+            error = f"Rol no válido: {fila['rol']}"
+        elif len(documento) > Usuario.documento.type.length:
+            error = "Documento demasiado largo"
+        elif documento in vistos:
+            error = "Documento repetido en el archivo"
+        else:
+            vistos.add(documento)
+            candidatas.append((numero, fila))
+            continue
+        errores.append({'fila': numero, 'documento': documento, 'error': error})
+
+    existentes = _documentos_existentes(vistos)
+    validas = []
+    for numero, fila in candidatas:
+        if fila['documento'] in existentes:
+            errores.append({'fila': numero, 'documento': fila['documento'], 'error': "El documento ya está registrado"})
+        else:
+            validas.append((numero, fila))
+    errores.sort(key=lambda e: e['fila'])
+    return validas, errores
+
+
+def importar_usuarios(filas, estricto=False, procesos=None, rondas=None):
+    """
+    Valida e inserta las filas. Con `estricto`, cualquier error cancela toda
+    la importación. Devuelve {'total', 'creados', 'errores'}
+    """
+    validas, errores = validar_filas(filas)
+    resultado = {'total': len(filas), 'creados': 0, 'errores': errores}
+    if not validas or (estricto and errores):
+        return resultado
+
+    rondas = rondas or current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+    hashes = hashear_contraseñas([fila['contraseña'] for _, fila in validas], rondas, procesos)
+    registros = [
+        {'nombre_completo': fila['nombre_completo'], 'documento': fila['documento'],
+         'contraseña': hash_, 'rol': fila['rol']}
+        for (_, fila), hash_ in zip(validas, hashes)
+    ]
+    try:
+        db.session.execute(Usuario.__table__.insert(), registros)
+        ids = _ids_por_documento([r['documento'] for r in registros])
+        auditoria.auditar_sentencias(db.session, Usuario.__tablename__, 'insertar', [
+            (ids.get(registro['documento']), {c: [None, v] for c, v in registro.items()})
+            for registro in registros
+        ])
+        db.session.commit()
+    except IntegrityError as e:
+        # Otro proceso registró alguno de los documentos entretanto
+        db.session.rollback()
+        logger.error(f"Error insertando usuarios importados: {str(e)}")
+        resultado['errores'] = errores + [
+            {'fila': numero, 'documento': fila['documento'], 'error': "Conflicto al insertar; vuelva a importar"}
+            for numero, fila in validas
+        ]
+        return resultado
+
+    version_datos.notificar_cambio(Usuario.__tablename__)
+    resultado['creados'] = len(registros)
+    return resultado
@@ -0,0 +1,295 @@
+"""
+Ingesta idempotente de actividades.
+
+Cada actividad tiene una huella (SHA-1 de su clave natural: operario, fecha,
+turno, hora de inicio y final, código de actividad y equipo) guardada en la
+columna `huella`, única junto con la fecha. guardar_actividades resuelve un
+lote completo con una consulta indexada de las huellas existentes y un único
+INSERT ... ON DUPLICATE KEY UPDATE (MySQL) / ON CONFLICT DO UPDATE (SQLite,
+PostgreSQL): volver a subir la misma hoja no duplica filas.
+"""
+import hashlib
+import logging
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import bindparam, event, inspect, select, text, tuple_
+
+from extensions import db
+from app.models import Actividad
+from app.servicios import auditoria, version_datos
+from app.servicios.perfilador import etiquetar
+
+logger = logging.getLogger(__name__)
+
+TABLA = Actividad.__table__
+CAMPOS_HUELLA = ('usuario_id', 'fecha', 'turno', 'hora_inicio', 'hora_final', 'codigo_actividad', 'codigo_equipo')
+# Columnas que una nueva carga de la misma actividad puede corregir (o completar)
+CAMPOS_ACTUALIZABLES = ('descripcion_actividad', 'orden_produccion', 'referencia_producto',
+                        'cantidad_trabajada', 'observaciones')
+# Enlace a la hoja archivada (archivo_imagenes)
+CAMPOS_ENLACE = ('imagen_hash', 'imagen_bbox')
+INDICE_UNICO = 'uq_actividades_huella'
+
+PATRON_HORA = re.compile(r'^(\d{1,2}):(\d{2})')
+
+ResultadoIngesta = namedtuple('ResultadoIngesta', ['insertadas', 'actualizadas', 'omitidas'])
+
+_instalado = False
+
+
+# ---------------------
+# HUELLA
+# ---------------------
+def _normalizar(campo, valor):
+    if valor is None:
+        return ''
+    if campo == 'fecha':
+        return str(valor)[:10]
+    if campo in ('hora_inicio', 'hora_final'):
+        coincidencia = PATRON_HORA.match(str(valor).strip())
+        if coincidencia:
+            return f"{int(coincidencia.group(1)):02d}:{coincidencia.group(2)}"
+    return str(valor).strip().upper()
+
+
+def calcular_huella(datos):
+    """Huella de la clave natural de una actividad (diccionario o Actividad)"""
+    if not isinstance(datos, dict):
+        datos = {campo: getattr(datos, campo) for campo in CAMPOS_HUELLA}
+    clave = '|'.join(_normalizar(campo, datos.get(campo)) for campo in CAMPOS_HUELLA)
+    return hashlib.sha1(clave.encode('utf-8')).hexdigest()
+
+
+def _fecha_por_defecto():
+    """Valor del default de la columna `fecha` (como fecha, igual que se guardaría)"""
+    default = TABLA.c.fecha.default
+    if default is None:
+        return None
+    fecha = default.arg(None) if default.is_callable else default.arg
+    return fecha.date() if isinstance(fecha, datetime) else fecha
+
+
+def _asignar_huella(mapper, conexion, actividad):
+    if actividad.fecha is None:
+        # El default de la columna se aplicaría después de este evento y la
+        # huella quedaría calculada con una fecha vacía
+        actividad.fecha = _fecha_por_defecto()
+    actividad.huella = calcular_huella(actividad)
+
+
+def instalar_huellas():
+    """Calcula la huella de las actividades creadas o editadas con el ORM"""
+    global _instalado
+    if _instalado:
+        return
+    event.listen(Actividad, 'before_insert', _asignar_huella)
+    event.listen(Actividad, 'before_update', _asignar_huella)
+    _instalado = True
+
+
+# ---------------------
+# INGESTA
+# ---------------------
+def _valores_actualizados(nuevos):
+    # Un valor que no llega (None) nunca borra el guardado: las filas de un lote
+    # se completan con None en las columnas que no traen
+    return {c: db.func.coalesce(nuevos[c], TABLA.c[c]) for c in CAMPOS_ACTUALIZABLES + CAMPOS_ENLACE}
+
+
+def _sentencia_upsert(filas):
+    dialecto = db.engine.dialect.name
+    if dialecto == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        sentencia = insert(TABLA).values(filas)
+        return sentencia.on_duplicate_key_update(_valores_actualizados(sentencia.inserted))
+    if dialecto in ('sqlite', 'postgresql'):
+        if dialecto == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        sentencia = insert(TABLA).values(filas)
+        return sentencia.on_conflict_do_update(
+            index_elements=['huella', 'fecha'],
+            set_=_valores_actualizados(sentencia.excluded),
+        )
+    return None
+
+
+def _guardar_lote(lote, autor=None):
+    """Inserta o actualiza un lote de filas con huellas distintas entre sí"""
+    claves = [(fila['huella'], fila['fecha']) for fila in lote]
+    existentes = {
+        (fila.huella, fila.fecha): fila
+        for fila in db.session.execute(
+            select(TABLA.c.huella, TABLA.c.fecha, *[TABLA.c[c] for c in CAMPOS_ACTUALIZABLES + CAMPOS_ENLACE])
+            .where(tuple_(TABLA.c.huella, TABLA.c.fecha).in_(claves))
+        )
+    }
+
+    nuevas, cambiadas = [], []
+    for fila in lote:
+        anterior = existentes.get((fila['huella'], fila['fecha']))
+        if anterior is None:
+            nuevas.append(fila)
+        elif any(fila.get(c) is not None and fila.get(c) != getattr(anterior, c)
+                 for c in CAMPOS_ACTUALIZABLES + CAMPOS_ENLACE):
+            cambiadas.append(fila)
+    omitidas = len(lote) - len(nuevas) - len(cambiadas)
+
+    escribir = nuevas + cambiadas
+    if escribir:
+        # Las filas ya existentes también pasan por el upsert: si otra carga
+        # insertó la misma huella entretanto, se actualiza en lugar de fallar
+        columnas = set().union(*(fila.keys() for fila in escribir))
+        escribir = [{c: fila.get(c) for c in columnas} for fila in escribir]
+        sentencia = _sentencia_upsert(escribir)
+        if sentencia is not None:
+            db.session.execute(sentencia)
+        else:
+            if nuevas:
+                db.session.execute(TABLA.insert(), [{c: f.get(c) for c in columnas} for f in nuevas])
+            if cambiadas:
+                db.session.execute(
+                    TABLA.update()
+                    .where(TABLA.c.huella == bindparam('_huella'), TABLA.c.fecha == bindparam('_fecha'))
+                    .values(_valores_actualizados({c: bindparam(c) for c in CAMPOS_ACTUALIZABLES + CAMPOS_ENLACE})),
+                    [dict({c: f.get(c) for c in CAMPOS_ACTUALIZABLES + CAMPOS_ENLACE},
+                          _huella=f['huella'], _fecha=f['fecha'])
+                     for f in cambiadas],
+                )
+
+    for fila in nuevas:
+        version_datos.registrar_cambio(db.session, TABLA.name, 'insertar', fila)
+    for fila in cambiadas:
+        version_datos.registrar_cambio(db.session, TABLA.name, 'actualizar', fila)
+    _auditar_lote(nuevas, cambiadas, existentes, autor)
+    return ResultadoIngesta(len(nuevas), len(cambiadas), omitidas)
+
+
+def _auditar_lote(nuevas, cambiadas, existentes, autor):
+    """Audita las filas escritas por el upsert, con sus ids"""
+    if not nuevas and not cambiadas:
+        return
+    ids = {
+        (fila.huella, fila.fecha): fila.id
+        for fila in db.session.execute(
+            select(TABLA.c.id, TABLA.c.huella, TABLA.c.fecha)
+            .where(tuple_(TABLA.c.huella, TABLA.c.fecha).in_(
+                [(fila['huella'], fila['fecha']) for fila in nuevas + cambiadas]))
+        )
+    }
+    auditoria.auditar_sentencias(db.session, TABLA.name, 'insertar', [
+        (ids.get((fila['huella'], fila['fecha'])),
+         {c: [None, v] for c, v in fila.items() if v is not None})
+        for fila in nuevas
+    ], autor)
+    registros = []
+    for fila in cambiadas:
+        anterior = existentes[(fila['huella'], fila['fecha'])]
+        registros.append((ids.get((fila['huella'], fila['fecha'])), {
+            c: [getattr(anterior, c), fila[c]]
+            for c in CAMPOS_ACTUALIZABLES + CAMPOS_ENLACE
+            if fila.get(c) is not None and fila[c] != getattr(anterior, c)
+        }))
+    auditoria.auditar_sentencias(db.session, TABLA.name, 'actualizar', registros, autor)
+
+
+@etiquetar('ingesta.guardar_actividades')
+def guardar_actividades(filas, tamano_lote=500, autor=None):
+    """
+    Guarda filas (diccionarios con columnas de Actividad) sin duplicar las que
+    ya existen. No confirma la transacción: el llamador hace el commit.
+    `autor` (usuario_id, origen) firma la auditoría cuando no hay petición
+    (trabajos en segundo plano). Devuelve ResultadoIngesta(insertadas,
+    actualizadas, omitidas).
+    """
+    unicas = {}
+    repetidas = 0
+    for fila in filas:
+        fila = dict(fila)
+        if fila.get('fecha') is None:
+            fila['fecha'] = _fecha_por_defecto()
+        fila['huella'] = calcular_huella(fila)
+        clave = (fila['huella'], fila['fecha'])
+        if clave in unicas:
+            repetidas += 1
+        unicas[clave] = fila
+
+    filas = list(unicas.values())
+    insertadas = actualizadas = 0
+    omitidas = repetidas
+    for inicio in range(0, len(filas), tamano_lote):
+        resultado = _guardar_lote(filas[inicio:inicio + tamano_lote], autor)
+        insertadas += resultado.insertadas
+        actualizadas += resultado.actualizadas
+        omitidas += resultado.omitidas
+    return ResultadoIngesta(insertadas, actualizadas, omitidas)
+
+
+# ---------------------
+# MIGRACIÓN
+# ---------------------
+def agregar_huellas(tamano_lote=5000):
+    """
+    Prepara una base existente: agrega la columna `huella`, la calcula para las
+    filas que no la tienen, elimina los duplicados (conserva el id menor) y
+    crea el índice único. Devuelve (huellas calculadas, duplicados eliminados).
+    """
+    inspector = inspect(db.engine)
+    if 'huella' not in {columna['name'] for columna in inspector.get_columns(TABLA.name)}:
+        db.session.execute(text(f"ALTER TABLE {TABLA.name} ADD COLUMN huella VARCHAR(40)"))
+        db.session.commit()
+
+    calculadas = 0
+    ultimo_id = 0
+    while True:
+        filas = db.session.execute(
+            select(TABLA.c.id, *[TABLA.c[c] for c in CAMPOS_HUELLA])
+            .where(TABLA.c.id > ultimo_id, TABLA.c.huella.is_(None))
+            .order_by(TABLA.c.id).limit(tamano_lote)
+        ).mappings().all()
+        if not filas:
+            break
+        db.session.execute(
+            TABLA.update().where(TABLA.c.id == bindparam('_id')).values(huella=bindparam('huella')),
+            [{'_id': fila['id'], 'huella': calcular_huella(dict(fila))} for fila in filas],
+        )
+        db.session.commit()
+        calculadas += len(filas)
+        ultimo_id = filas[-1]['id']
+
+    # Duplicados: misma huella y fecha, se conserva la primera fila cargada
+    originales = select(db.func.min(TABLA.c.id)).group_by(TABLA.c.huella, TABLA.c.fecha).scalar_subquery()
+    duplicados = db.session.execute(
+        select(TABLA.c.id).where(TABLA.c.huella.is_not(None), TABLA.c.id.not_in(originales))
+    ).scalars().all()
+    for inicio in range(0, len(duplicados), tamano_lote):
+        db.session.execute(TABLA.delete().where(TABLA.c.id.in_(duplicados[inicio:inicio + tamano_lote])))
+    db.session.commit()
+
+    indices = {indice['name'] for indice in inspector.get_indexes(TABLA.name)}
+    indices |= {restriccion['name'] for restriccion in inspector.get_unique_constraints(TABLA.name)}
+    if INDICE_UNICO not in indices:
+        db.session.execute(text(f"CREATE UNIQUE INDEX {INDICE_UNICO} ON {TABLA.name} (huella, fecha)"))
+        db.session.commit()
+
+    if calculadas or duplicados:
+        version_datos.notificar_cambio(TABLA.name)
+    return calculadas, len(duplicados)
+
+
+def agregar_columnas_imagen():
+    """Agrega a una base existente las columnas de enlace a la hoja archivada. Devuelve las agregadas"""
+    existentes = {columna['name'] for columna in inspect(db.engine).get_columns(TABLA.name)}
+    agregadas = []
+    for columna in CAMPOS_ENLACE:
+        if columna not in existentes:
+            tipo = TABLA.c[columna].type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f"ALTER TABLE {TABLA.name} ADD COLUMN {columna} {tipo}"))
+            agregadas.append(columna)
+    if 'imagen_hash' in agregadas:
+        db.session.execute(text(f"CREATE INDEX ix_{TABLA.name}_imagen_hash ON {TABLA.name} (imagen_hash)"))
+    db.session.commit()
+    return agregadas
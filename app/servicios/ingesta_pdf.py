@@ -0,0 +1,309 @@
+"""
+Ingesta de PDFs escaneados (libros de turno de varias páginas).
+
+Las páginas se rasterizan de a una, a la resolución configurada (PDF_DPI),
+y se envían a un pool de hilos que ejecuta extraer_registros. Como
+máximo hay 2 páginas en vuelo por trabajador, así que la memoria no crece con
+el tamaño del PDF. Las filas de cada página se confirman en un solo commit
+(sin duplicar las que ya estaban cargadas).
+El trabajo corre en segundo plano: la petición que sube el archivo responde de
+inmediato y el progreso se consulta o se recibe por SSE.
+
+El trabajo se ejecuta en el proceso que recibió el PDF, pero su estado se
+escribe como JSON en PDF_TRABAJOS_DIR en cada cambio: con varios workers de
+gunicorn, cualquiera responde el estado (el flujo SSE de otro proceso se
+alimenta leyendo ese archivo). El directorio debe ser compartido por todos los
+workers (mismo equipo o volumen común). Si el proceso que ejecuta un trabajo
+termina, el trabajo queda en el último estado escrito y no se reanuda.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from config import Config
+from extensions import db
+from app.servicios.ocr_servicio import extraer_registros
+from app.servicios import archivo_imagenes
+from app.servicios.registros_ocr import registro_a_fila
+from app.servicios.auditoria import autor_actual
+from app.servicios.ingesta_actividades import guardar_actividades
+from app.servicios.datos_referencia import referencias
+
+logger = logging.getLogger(__name__)
+
+MAX_TRABAJOS_GUARDADOS = 50
+INTERVALO_PROGRESO = 15  # segundos entre pings del flujo de progreso
+INTERVALO_LECTURA = 1    # segundos entre lecturas del estado de un trabajo de otro proceso
+PATRON_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Un PDF a la vez; sus páginas se reparten entre tantos hilos como motores OCR
+_ejecutor_trabajos = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf')
+_ejecutor_paginas = ThreadPoolExecutor(max_workers=Config.OCR_MAX_MOTORES, thread_name_prefix='pdf-pagina')
+_trabajos = OrderedDict()
+_lock_trabajos = threading.Lock()
+
+
+class TrabajoPdf:
+    """Estado y progreso de la ingesta de un PDF"""
+
+    def __init__(self, nombre, usuario_id, fecha, turno):
+        self.id = uuid.uuid4().hex
+        self.nombre = nombre
+        self.usuario_id = usuario_id
+        self.fecha = fecha
+        self.turno = turno
+        self.estado = 'en_cola'
+        self.paginas_total = 0
+        self.paginas_procesadas = 0
+        self.filas_guardadas = 0
+        self.filas_omitidas = 0
+        self.errores = []
+        self.inicio = None
+        self.fin = None
+        self.condicion = threading.Condition()
+        # Se crea dentro de la petición: la auditoría de las filas la firma quien subió el PDF
+        self.autor = autor_actual()
+
+    @property
+    def terminado(self):
+        return self.estado in ('completado', 'error')
+
+    def actualizar(self, **cambios):
+        with self.condicion:
+            for campo, valor in cambios.items():
+                setattr(self, campo, valor)
+            self.condicion.notify_all()
+            self.guardar_estado()
+
+    def guardar_estado(self):
+        """Escribe el estado en PDF_TRABAJOS_DIR para los demás procesos"""
+        try:
+            os.makedirs(Config.PDF_TRABAJOS_DIR, exist_ok=True)
+            descriptor, temporal = tempfile.mkstemp(dir=Config.PDF_TRABAJOS_DIR, suffix='.tmp')
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as archivo:
+                json.dump(self.como_dict(), archivo, ensure_ascii=False)
+            os.replace(temporal, _ruta_estado(self.id))
+        except OSError as e:
+            logger.error(f"Error guardando el estado del trabajo {self.id}: {str(e)}")
+
+    def como_dict(self):
+        with self.condicion:
+            duracion = (self.fin or time.time()) - self.inicio if self.inicio else 0
+            return {
+                'id': self.id,
+                'nombre': self.nombre,
+                'estado': self.estado,
+                'paginas_total': self.paginas_total,
+                'paginas_procesadas': self.paginas_procesadas,
+                'filas_guardadas': self.filas_guardadas,
+                'filas_omitidas': self.filas_omitidas,
+                'errores': self.errores[-20:],
+                'paginas_por_minuto': round(self.paginas_procesadas / duracion * 60, 2) if duracion else 0,
+            }
+
+    def flujo_progreso(self):
+        """Generador SSE que envía el progreso cada vez que cambia"""
+        ultimo = None
+        while True:
+            with self.condicion:
+                if self.como_dict() == ultimo and not self.terminado:
+                    self.condicion.wait(INTERVALO_PROGRESO)
+            datos = self.como_dict()
+            if datos != ultimo:
+                ultimo = datos
+                yield f"event: progreso\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+            else:
+                yield ": ping\n\n"
+            if self.terminado:
+                return
+
+
+def _ruta_estado(trabajo_id):
+    return os.path.join(Config.PDF_TRABAJOS_DIR, f"{trabajo_id}.json")
+
+
+def _leer_estado(trabajo_id):
+    try:
+        with open(_ruta_estado(trabajo_id), encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return None
+
+
+def obtener_trabajo(trabajo_id):
+    """TrabajoPdf si se ejecuta en este proceso, si no None"""
+    with _lock_trabajos:
+        return _trabajos.get(trabajo_id)
+
+
+def estado_trabajo(trabajo_id):
+    """Diccionario de progreso del trabajo (de este u otro proceso), o None si no existe"""
+    if not PATRON_ID.match(trabajo_id or ''):
+        return None
+    trabajo = obtener_trabajo(trabajo_id)
+    return trabajo.como_dict() if trabajo is not None else _leer_estado(trabajo_id)
+
+
+def flujo_trabajo(trabajo_id):
+    """Generador SSE del progreso del trabajo, o None si no existe"""
+    if not PATRON_ID.match(trabajo_id or ''):
+        return None
+    trabajo = obtener_trabajo(trabajo_id)
+    if trabajo is not None:
+        return trabajo.flujo_progreso()
+    if _leer_estado(trabajo_id) is None:
+        return None
+    return _flujo_archivo(trabajo_id)
+
+
+def _flujo_archivo(trabajo_id):
+    """Progreso de un trabajo de otro proceso, leyendo su archivo de estado"""
+    ultimo = None
+    ultimo_envio = time.monotonic()
+    while True:
+        datos = _leer_estado(trabajo_id) or ultimo
+        if datos != ultimo:
+            ultimo = datos
+            ultimo_envio = time.monotonic()
+            yield f"event: progreso\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+        elif time.monotonic() - ultimo_envio >= INTERVALO_PROGRESO:
+            ultimo_envio = time.monotonic()
+            yield ": ping\n\n"
+        if datos is None or datos['estado'] in ('completado', 'error'):
+            return
+        time.sleep(INTERVALO_LECTURA)
+
+
+def encolar_pdf(app, ruta, nombre, usuario_id, fecha, turno='Mañana'):
+    """Registra el trabajo y lo lanza en segundo plano. Devuelve el TrabajoPdf"""
+    trabajo = TrabajoPdf(nombre, usuario_id, fecha, turno)
+    trabajo.guardar_estado()
+    with _lock_trabajos:
+        _trabajos[trabajo.id] = trabajo
+        while len(_trabajos) > MAX_TRABAJOS_GUARDADOS:
+            _, antiguo = _trabajos.popitem(last=False)
+            if os.path.exists(_ruta_estado(antiguo.id)):
+                os.remove(_ruta_estado(antiguo.id))
+    _ejecutor_trabajos.submit(_ejecutar, app, trabajo, ruta)
+    return trabajo
+
+
+def _rasterizar(documento, indice, dpi):
+    """Renderiza una sola página como arreglo BGR de OpenCV"""
+    pagina = documento[indice]
+    try:
+        imagen = pagina.render(scale=dpi / 72).to_numpy()
+    finally:
+        pagina.close()
+    if imagen.ndim == 3 and imagen.shape[2] == 4:
+        imagen = cv2.cvtColor(imagen, cv2.COLOR_BGRA2BGR)
+    return imagen
+
+
+def _guardar_pagina(trabajo, indice, registros, imagen_hash=None):
+    """
+    Confirma en un solo commit las filas de una página. Devuelve (guardadas,
+    omitidas): las filas ya cargadas antes no se duplican
+    """
+    filas = []
+    for registro in registros:
+        try:
+            referencias.corregir_registro(registro)
+            filas.append(registro_a_fila(registro, trabajo.usuario_id, trabajo.fecha, trabajo.turno,
+                                         imagen_hash=imagen_hash))
+        except (TypeError, ValueError) as e:
+            trabajo.errores.append(f"Página {indice + 1}: {str(e)}")
+    if not filas:
+        return 0, 0
+    resultado = guardar_actividades(filas, autor=trabajo.autor)
+    db.session.commit()
+    return resultado.insertadas + resultado.actualizadas, resultado.omitidas
+
+
+def _ejecutar(app, trabajo, ruta):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        trabajo.actualizar(estado='error', errores=['pypdfium2 no está instalado'], fin=time.time())
+        return
+
+    trabajo.actualizar(estado='procesando', inicio=time.time())
+    en_vuelo = threading.BoundedSemaphore(Config.OCR_MAX_MOTORES * 2)
+    pendientes = []
+
+    def liberar(_futuro):
+        en_vuelo.release()
+
+    with app.app_context():
+        documento = None
+        try:
+            documento = pdfium.PdfDocument(ruta)
+            trabajo.actualizar(paginas_total=len(documento))
+
+            for indice in range(len(documento)):
+                # Esperar a que haya lugar antes de rasterizar la siguiente página
+                en_vuelo.acquire()
+                try:
+                    imagen = _rasterizar(documento, indice, Config.PDF_DPI)
+                except Exception as e:
+                    en_vuelo.release()
+                    trabajo.errores.append(f"Página {indice + 1}: {str(e)}")
+                    trabajo.actualizar(paginas_procesadas=trabajo.paginas_procesadas + 1)
+                    continue
+                futuro = _ejecutor_paginas.submit(_procesar_pagina, imagen)
+                futuro.add_done_callback(liberar)
+                pendientes.append((indice, futuro))
+                del imagen
+
+                # Guardar las páginas ya terminadas, en orden
+                while pendientes and pendientes[0][1].done():
+                    _completar(trabajo, *pendientes.pop(0))
+
+            for indice, futuro in pendientes:
+                _completar(trabajo, indice, futuro)
+
+            trabajo.actualizar(estado='completado', fin=time.time())
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error en la ingesta de PDF {trabajo.nombre}: {str(e)}")
+            trabajo.errores.append(str(e))
+            trabajo.actualizar(estado='error', fin=time.time())
+        finally:
+            if documento is not None:
+                documento.close()
+            db.session.remove()
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+
+def _procesar_pagina(imagen):
+    """
+    OCR de una página; si tiene filas, se archiva (en segundo plano) para
+    revisarlas. Un error del OCR se propaga: _completar lo anota en `errores`
+    en lugar de contar la página como vacía
+    """
+    registros = extraer_registros(imagen)
+    imagen_hash = archivo_imagenes.archivar(imagen, [r.get('bbox') for r in registros]) if registros else None
+    return registros, imagen_hash
+
+
+def _completar(trabajo, indice, futuro):
+    try:
+        guardadas, omitidas = _guardar_pagina(trabajo, indice, *futuro.result())
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error guardando la página {indice + 1} de {trabajo.nombre}: {str(e)}")
+        trabajo.errores.append(f"Página {indice + 1}: {str(e)}")
+        guardadas = omitidas = 0
+    trabajo.actualizar(paginas_procesadas=trabajo.paginas_procesadas + 1,
+                       filas_guardadas=trabajo.filas_guardadas + guardadas,
+                       filas_omitidas=trabajo.filas_omitidas + omitidas)
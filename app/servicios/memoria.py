@@ -0,0 +1,85 @@
+"""
+Memoria única y compartida por proceso (Linux, /proc/<pid>/smaps_rollup).
+
+Con el modelo de workers precargados (wsgi.py + gunicorn.conf.py) los
+modelos OCR y las bibliotecas se cargan una vez en el maestro y los workers
+comparten esas páginas copy-on-write: en el informe, la memoria `compartida`
+de cada worker debería ser grande y la `unica` pequeña.
+
+Uso:
+    python -m app.servicios.memoria <pid del maestro>
+"""
+import json
+import os
+import sys
+
+CAMPOS_UNICA = ('Private_Clean', 'Private_Dirty')
+CAMPOS_COMPARTIDA = ('Shared_Clean', 'Shared_Dirty')
+
+
+def memoria_proceso(pid):
+    """Diccionario con rss, pss, unica, compartida y swap en MB (None si no se puede leer)"""
+    valores = {}
+    ruta = f"/proc/{pid}/smaps_rollup"
+    if not os.path.exists(ruta):
+        ruta = f"/proc/{pid}/smaps"
+    try:
+        with open(ruta, encoding='ascii') as archivo:
+            for linea in archivo:
+                partes = linea.split()
+                if len(partes) == 3 and partes[2] == 'kB':
+                    clave = partes[0].rstrip(':')
+                    valores[clave] = valores.get(clave, 0) + int(partes[1])
+    except OSError:
+        return None
+
+    def mb(*claves):
+        return round(sum(valores.get(clave, 0) for clave in claves) / 1024, 1)
+
+    return {
+        'pid': pid,
+        'rss_mb': mb('Rss'),
+        'pss_mb': mb('Pss'),
+        'unica_mb': mb(*CAMPOS_UNICA),
+        'compartida_mb': mb(*CAMPOS_COMPARTIDA),
+        'swap_mb': mb('Swap'),
+    }
+
+
+def procesos_hijos(pid):
+    """PIDs de los hijos directos de `pid`"""
+    hijos = []
+    for entrada in os.listdir('/proc'):
+        if not entrada.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entrada}/stat", encoding='ascii', errors='replace') as archivo:
+                # El nombre del comando va entre paréntesis y puede contener espacios
+                campos = archivo.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(campos[1]) == pid:
+            hijos.append(int(entrada))
+    return sorted(hijos)
+
+
+def informe_memoria(pid_maestro):
+    """Memoria del maestro y de cada worker, con los totales únicos y compartidos"""
+    maestro = memoria_proceso(pid_maestro)
+    workers = [m for m in (memoria_proceso(pid) for pid in procesos_hijos(pid_maestro)) if m]
+    return {
+        'maestro': maestro,
+        'workers': workers,
+        'totales': {
+            'workers': len(workers),
+            'unica_workers_mb': round(sum(w['unica_mb'] for w in workers), 1),
+            'compartida_media_mb': round(sum(w['compartida_mb'] for w in workers) / len(workers), 1) if workers else 0.0,
+            # Suma de PSS: memoria real ocupada por el grupo, repartiendo las páginas compartidas
+            'pss_total_mb': round((maestro['pss_mb'] if maestro else 0) + sum(w['pss_mb'] for w in workers), 1),
+        },
+    }
+
+
+if __name__ == '__main__':
+    pid = int(sys.argv[1]) if len(sys.argv) > 1 else os.getpid()
+    print(json.dumps(informe_memoria(pid), indent=2))
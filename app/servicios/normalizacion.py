@@ -0,0 +1,192 @@
+"""
+Normalización de las celdas leídas por OCR.
+
+Cada columna tiene una cadena de normalizadores con patrones precompilados.
+Cada celda se procesa en una sola pasada y devuelve su valor limpio junto con
+una marca de validez y una confianza.
+"""
+import re
+from collections import namedtuple
+
+# ---------------------
+# PATRONES PRECOMPILADOS
+# ---------------------
+PATRON_DIGITOS = re.compile(r'\d+')
+PATRON_TOKEN = re.compile(r'[\w|!]+')
+PATRON_CARACTERES_INVALIDOS = re.compile(r'[^\w\s\-.]')
+PATRON_ESPACIOS = re.compile(r'\s+')
+PATRON_CODIGO_EQUIPO = re.compile(r'^[A-Z]{1,4}-?\d{1,5}[A-Z]?$')
+PATRON_CODIGO_ACTIVIDAD = re.compile(r'^[A-Z]{0,3}\d{1,4}$')
+
+# Confusiones típicas del OCR cuando la celda debería ser numérica
+CONFUSIONES_NUMERICAS = str.maketrans({
+    'O': '0', 'o': '0', 'Q': '0', 'D': '0',
+    'l': '1', 'I': '1', 'i': '1', '|': '1', '!': '1',
+    'S': '5', 's': '5', 'B': '8', 'Z': '2', 'z': '2', 'G': '6', 'g': '9',
+})
+
+# Token que parece un número mal leído: dígitos mezclados con letras confundibles
+PATRON_TOKEN_NUMERICO = re.compile(r'^(?=.*\d)[\d%s]+$' % re.escape(''.join(map(chr, CONFUSIONES_NUMERICAS))))
+
+# Horas candidatas: cada posición de dígito admite una letra confundible ('1O:3O'),
+# que solo se corrige dentro de la hora encontrada
+_DIGITO = r'[\d%s]' % re.escape(''.join(map(chr, CONFUSIONES_NUMERICAS)))
+_HORA = r'%s{1,2}\s*[:.hH]\s*%s{2}' % (_DIGITO, _DIGITO)
+PATRON_HORA = re.compile(r'(%s{1,2})\s*[:.hH]\s*(%s{2})' % (_DIGITO, _DIGITO))
+PATRON_RANGO_HORAS = re.compile(r'(%s)\s*(?:-|–|a)\s*(%s)' % (_HORA, _HORA))
+
+Celda = namedtuple('Celda', ['valor', 'valido', 'confianza'])
+
+# Códigos de actividad conocidos (los registra la caché de datos de referencia)
+_codigos_actividad = frozenset()
+
+
+def registrar_codigos_actividad(codigos):
+    """Reemplaza el conjunto de códigos de actividad conocidos"""
+    global _codigos_actividad
+    _codigos_actividad = frozenset(str(c).strip().upper() for c in codigos if c)
+
+
+# ---------------------
+# NORMALIZADORES
+# ---------------------
+def _formatear_hora(horas, minutos):
+    if 0 <= horas <= 23 and 0 <= minutos <= 59:
+        return f"{horas:02d}:{minutos:02d}"
+    return None
+
+
+def normalizar_hora(texto, extremo=0):
+    """
+    Devuelve (HH:MM, valido). Si la celda contiene un rango toma el extremo
+    indicado (0 = inicio, 1 = final). Las confusiones letra/dígito solo se
+    corrigen dentro de la hora candidata ('Inicio 8:3O' -> 08:30), que debe
+    tener al menos un dígito real
+    """
+    texto = texto or ''
+
+    rango = PATRON_RANGO_HORAS.search(texto)
+    if rango:
+        texto = rango.group(extremo + 1)
+
+    for candidata in PATRON_HORA.finditer(texto):
+        if not PATRON_DIGITOS.search(candidata.group(0)):
+            continue
+        hora = _formatear_hora(int(candidata.group(1).translate(CONFUSIONES_NUMERICAS)),
+                               int(candidata.group(2).translate(CONFUSIONES_NUMERICAS)))
+        if hora:
+            return hora, True
+
+    # Buscar solo números (primer token numérico) y asumir formato HMM o HHMM
+    numerico = next((token for token in PATRON_TOKEN.findall(texto)
+                     if token.isdecimal() or PATRON_TOKEN_NUMERICO.match(token)), None)
+    if numerico:
+        num_str = numerico.translate(CONFUSIONES_NUMERICAS)
+        if len(num_str) == 3:
+            hora = _formatear_hora(int(num_str[0]), int(num_str[1:3]))
+        elif len(num_str) == 4:
+            hora = _formatear_hora(int(num_str[0:2]), int(num_str[2:4]))
+        else:
+            hora = None
+        if hora:
+            return hora, True
+
+    return "00:00", False
+
+
+def normalizar_texto(texto):
+    """Devuelve (texto limpio, valido)"""
+    if not texto:
+        return "", False
+    limpio = PATRON_ESPACIOS.sub(' ', PATRON_CARACTERES_INVALIDOS.sub('', texto)).strip()
+    return limpio, bool(limpio)
+
+
+def normalizar_numero(texto):
+    """
+    Devuelve (entero, valido). Las confusiones letra/dígito solo se corrigen
+    dentro de tokens que ya tienen dígitos ('1O' -> 10), nunca en las palabras
+    de alrededor ('Bolsas: 12' -> 12); se prefiere el primer token numérico puro
+    """
+    tokens = PATRON_TOKEN.findall(str(texto or ''))
+    for token in tokens:
+        if token.isdecimal():
+            return int(token), True
+    for token in tokens:
+        if PATRON_TOKEN_NUMERICO.match(token):
+            return int(token.translate(CONFUSIONES_NUMERICAS)), True
+    numeros = PATRON_DIGITOS.search(str(texto or ''))
+    if numeros:
+        return int(numeros.group(0)), True
+    return 0, False
+
+
+def _candidatos_codigo(codigo):
+    """Variantes del código corrigiendo confusiones a partir de cada posición"""
+    yield codigo.upper()
+    for k in range(1, len(codigo)):
+        corregido = codigo[:k] + codigo[k:].translate(CONFUSIONES_NUMERICAS)
+        if corregido != codigo:
+            yield corregido.upper()
+
+
+def _normalizar_codigo(texto, patron, conocidos=frozenset()):
+    limpio, valido = normalizar_texto(texto)
+    if not valido:
+        return limpio, False
+    codigo = limpio.replace(' ', '')
+    if conocidos:
+        for candidato in _candidatos_codigo(codigo):
+            if candidato in conocidos:
+                return candidato, True
+        return codigo.upper(), False
+    for candidato in _candidatos_codigo(codigo):
+        if patron.match(candidato):
+            return candidato, True
+    return codigo.upper(), False
+
+
+def normalizar_codigo_equipo(texto):
+    """Devuelve (código de equipo, valido) con formato tipo EQ-104"""
+    return _normalizar_codigo(texto, PATRON_CODIGO_EQUIPO)
+
+
+def normalizar_codigo_actividad(texto):
+    """Devuelve (código de actividad, valido); si hay códigos conocidos debe ser uno de ellos"""
+    return _normalizar_codigo(texto, PATRON_CODIGO_ACTIVIDAD, _codigos_actividad)
+
+
+# Cadena de normalización por columna, en el orden de la hoja de turno
+NORMALIZADORES_COLUMNA = (
+    ('hora_inicio', lambda texto: normalizar_hora(texto, 0), "00:00"),
+    ('hora_final', lambda texto: normalizar_hora(texto, 1), "00:00"),
+    ('codigo_actividad', normalizar_codigo_actividad, ""),
+    ('unidad_produccion', normalizar_texto, ""),
+    ('codigo_equipo', normalizar_codigo_equipo, ""),
+    ('referencia_producto', normalizar_texto, ""),
+    ('cantidad_trabajada', normalizar_numero, 0),
+    ('observaciones', normalizar_texto, ""),
+)
+
+COLUMNAS = tuple(columna for columna, _, _ in NORMALIZADORES_COLUMNA)
+
+
+def normalizar_fila(textos, confianzas=None):
+    """
+    Normaliza una fila de textos (en orden de columnas) en una sola pasada.
+
+    Devuelve un diccionario columna -> Celda. La confianza de una celda es la
+    del OCR si la celda es válida y 0 si no pasó la validación.
+    """
+    celdas = {}
+    for i, (columna, normalizador, vacio) in enumerate(NORMALIZADORES_COLUMNA):
+        if i < len(textos):
+            try:
+                valor, valido = normalizador(textos[i])
+            except (TypeError, ValueError):
+                valor, valido = vacio, False
+            confianza = confianzas[i] if confianzas and i < len(confianzas) else 1.0
+        else:
+            valor, valido, confianza = vacio, False, 0.0
+        celdas[columna] = Celda(valor, valido, confianza if valido else 0.0)
+    return celdas
@@ -0,0 +1,418 @@
+"""
+Banco de pruebas de rendimiento y precisión del OCR.
+
+Genera hojas de turno sintéticas con el mismo orden de columnas que espera
+procesar_imagen_tabular, las degrada (ruido, inclinación, desenfoque) y las
+procesa con el mismo punto de entrada que producción (extraer_registros, en
+una o dos pasadas). Mide la latencia total y la de cada etapa de ese camino, y
+la precisión por campo emparejando las filas leídas con las esperadas por
+contenido.
+
+Uso:
+    python -m app.servicios.ocr_benchmark --paginas 20 --salida resultados.json
+    python -m app.servicios.ocr_benchmark --paginas 20 --pasadas 1
+    python -m app.servicios.ocr_benchmark --paginas 20 --comparar anterior.json
+    python -m app.servicios.ocr_benchmark --normalizacion 50000
+    python -m app.servicios.ocr_benchmark --paginas 20 --modos
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+import cv2
+import numpy as np
+
+from app.servicios import ocr_servicio
+from app.servicios.ocr_servicio import (
+    obtener_motor_ocr, agrupar_filas, construir_registros, primera_pasada, extraer_registros
+)
+from config import Config
+from app.servicios.normalizacion import COLUMNAS, normalizar_fila
+
+ENCABEZADOS = ['Inicio', 'Final', 'Actividad', 'Unidad', 'Equipo', 'Referencia', 'Cantidad', 'Observaciones']
+ANCHOS_COLUMNA = [120, 120, 140, 130, 140, 170, 120, 230]
+ALTO_FILA = 48
+MARGEN = 40
+
+# Etapa -> función de ocr_servicio que la ejecuta. Los tiempos son inclusivos:
+# 'ocr' (una pasada) contiene a 'cargar'. El motor detecta y reconoce en una
+# sola llamada, así que 'deteccion' se mide aparte (ver medir_deteccion) y
+# 'reconocimiento' es el resto de esa llamada
+ETAPAS = {
+    'cargar': 'cargar_imagen',
+    'ocr': 'detectar_elementos',
+    'pasada_rapida': 'primera_pasada',
+    'relectura': 'releer_celda',
+    'estructurar': 'agrupar_filas',
+    'limpiar': 'construir_registros',
+}
+
+OBSERVACIONES = ['OK', 'Normal', 'Ajuste', 'Limpieza', 'Revision', 'Cambio', 'Espera']
+
+
+def generar_fila(rng, minuto_inicio):
+    """Genera los valores esperados de una fila de la hoja"""
+    duracion = rng.choice([15, 30, 45, 60, 90])
+    minuto_final = min(minuto_inicio + duracion, 23 * 60 + 59)
+    return {
+        'hora_inicio': f"{minuto_inicio // 60:02d}:{minuto_inicio % 60:02d}",
+        'hora_final': f"{minuto_final // 60:02d}:{minuto_final % 60:02d}",
+        'codigo_actividad': f"A{rng.randint(1, 40):02d}",
+        'unidad_produccion': f"UP{rng.randint(1, 9)}",
+        'codigo_equipo': f"EQ-{rng.randint(100, 999)}",
+        'referencia_producto': f"REF{rng.randint(1000, 9999)}",
+        'cantidad_trabajada': rng.randint(1, 500),
+        'observaciones': rng.choice(OBSERVACIONES),
+    }, minuto_final
+
+
+def dibujar_hoja(filas):
+    """Dibuja la tabla (encabezado + filas) sobre un lienzo blanco"""
+    ancho = MARGEN * 2 + sum(ANCHOS_COLUMNA)
+    alto = MARGEN * 2 + ALTO_FILA * (len(filas) + 1)
+    imagen = np.full((alto, ancho), 255, dtype=np.uint8)
+
+    contenido = [ENCABEZADOS] + [[str(fila[c]) for c in COLUMNAS] for fila in filas]
+    for i, valores in enumerate(contenido):
+        y = MARGEN + i * ALTO_FILA
+        cv2.line(imagen, (MARGEN, y), (ancho - MARGEN, y), 0, 1)
+        x = MARGEN
+        for valor, ancho_columna in zip(valores, ANCHOS_COLUMNA):
+            cv2.putText(imagen, valor, (x + 10, y + 32), cv2.FONT_HERSHEY_SIMPLEX, 0.7, 0, 2, cv2.LINE_AA)
+            x += ancho_columna
+    cv2.line(imagen, (MARGEN, alto - MARGEN), (ancho - MARGEN, alto - MARGEN), 0, 1)
+
+    x = MARGEN
+    for ancho_columna in [0] + ANCHOS_COLUMNA:
+        x += ancho_columna
+        cv2.line(imagen, (x, MARGEN), (x, alto - MARGEN), 0, 1)
+    return imagen
+
+
+def degradar(imagen, rng, ruido=0.0, inclinacion=0.0, desenfoque=0):
+    """Aplica ruido gaussiano, rotación y desenfoque para imitar una foto real"""
+    if inclinacion:
+        angulo = rng.uniform(-inclinacion, inclinacion)
+        alto, ancho = imagen.shape[:2]
+        matriz = cv2.getRotationMatrix2D((ancho / 2, alto / 2), angulo, 1.0)
+        imagen = cv2.warpAffine(imagen, matriz, (ancho, alto), borderValue=255)
+    if desenfoque:
+        k = desenfoque * 2 + 1
+        imagen = cv2.GaussianBlur(imagen, (k, k), 0)
+    if ruido:
+        generador = np.random.default_rng(rng.randint(0, 2 ** 32 - 1))
+        imagen = np.clip(imagen + generador.normal(0, ruido, imagen.shape), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(imagen, cv2.COLOR_GRAY2BGR)
+
+
+def generar_hoja(num_filas=10, ruido=0.0, inclinacion=0.0, desenfoque=0, semilla=None):
+    """
+    Genera una hoja sintética y devuelve (imagen, filas_esperadas)
+    """
+    rng = random.Random(semilla)
+    filas = []
+    minuto = 6 * 60
+    for _ in range(num_filas):
+        fila, minuto = generar_fila(rng, minuto)
+        filas.append(fila)
+    imagen = degradar(dibujar_hoja(filas), rng, ruido, inclinacion, desenfoque)
+    return imagen, filas
+
+
+@contextmanager
+def medir_etapas():
+    """
+    Mientras está activo, las funciones de ETAPAS en ocr_servicio acumulan su
+    tiempo (ms) en el diccionario devuelto; el camino medido es el de producción
+    """
+    tiempos = {etapa: 0.0 for etapa in ETAPAS}
+    originales = {etapa: getattr(ocr_servicio, funcion) for etapa, funcion in ETAPAS.items()}
+
+    def cronometrar(etapa, funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                tiempos[etapa] += (time.perf_counter() - inicio) * 1000
+        return envoltura
+
+    for etapa, funcion in originales.items():
+        setattr(ocr_servicio, ETAPAS[etapa], cronometrar(etapa, funcion))
+    try:
+        yield tiempos
+    finally:
+        for etapa, funcion in originales.items():
+            setattr(ocr_servicio, ETAPAS[etapa], funcion)
+
+
+def procesar_medido(ruta, dos_pasadas):
+    """Ejecuta extraer_registros y devuelve (registros, tiempos_ms por etapa y total)"""
+    with medir_etapas() as tiempos:
+        inicio = time.perf_counter()
+        registros = extraer_registros(ruta, dos_pasadas)
+        tiempos['total'] = (time.perf_counter() - inicio) * 1000
+    return registros, tiempos
+
+
+def medir_deteccion(ruta, dos_pasadas):
+    """
+    ms de solo la detección sobre la misma imagen que recibe el motor en el
+    camino medido (reducida en la pasada rápida). Se ejecuta fuera de ese camino
+    """
+    imagen = cv2.imread(ruta)
+    if dos_pasadas and Config.OCR_ESCALA_RAPIDA < 1:
+        imagen = cv2.resize(imagen, None, fx=Config.OCR_ESCALA_RAPIDA, fy=Config.OCR_ESCALA_RAPIDA,
+                            interpolation=cv2.INTER_AREA)
+    with ocr_servicio.motor_ocr() as motor:
+        inicio = time.perf_counter()
+        ocr_servicio.detectar_cajas(imagen, motor)
+        return (time.perf_counter() - inicio) * 1000
+
+
+def separar_deteccion(tiempos, deteccion, dos_pasadas):
+    """Agrega 'deteccion' y 'reconocimiento' (resto de la llamada al motor) a los tiempos de una página"""
+    llamada = tiempos['pasada_rapida'] if dos_pasadas else tiempos['ocr'] - tiempos['cargar']
+    tiempos['deteccion'] = deteccion
+    tiempos['reconocimiento'] = max(llamada - deteccion, 0.0)
+    return tiempos
+
+
+def _coincidencias(esperada, obtenida):
+    return sum(1 for columna in COLUMNAS if str(obtenida.get(columna, '')).strip() == str(esperada[columna]))
+
+
+def emparejar_filas(esperadas, registros):
+    """
+    Empareja cada fila esperada con la fila leída más parecida (más campos
+    iguales; a igualdad, la más cercana en posición). Una fila perdida o
+    partida en dos no desplaza la comparación de las siguientes
+    """
+    candidatos = sorted(
+        ((_coincidencias(esperada, registro), -abs(i - j), i, j)
+         for i, esperada in enumerate(esperadas) for j, registro in enumerate(registros)),
+        reverse=True,
+    )
+    parejas = {}
+    usadas = set()
+    for coincidencias, _, i, j in candidatos:
+        if coincidencias == 0:
+            break
+        if i not in parejas and j not in usadas:
+            parejas[i] = j
+            usadas.add(j)
+    return parejas
+
+
+def evaluar_precision(esperadas, registros):
+    """Cuenta aciertos por campo entre cada fila esperada y su pareja leída"""
+    aciertos = {columna: 0 for columna in COLUMNAS}
+    for i, j in emparejar_filas(esperadas, registros).items():
+        for columna in COLUMNAS:
+            if str(registros[j].get(columna, '')).strip() == str(esperadas[i][columna]):
+                aciertos[columna] += 1
+    return aciertos
+
+
+def resumir_tiempos(valores):
+    """Media y percentiles de una lista de tiempos en ms"""
+    ordenados = sorted(valores)
+    return {
+        'media_ms': round(statistics.fmean(ordenados), 3),
+        'p50_ms': round(ordenados[len(ordenados) // 2], 3),
+        'p95_ms': round(ordenados[min(int(len(ordenados) * 0.95), len(ordenados) - 1)], 3),
+    }
+
+
+def ejecutar_benchmark(paginas=10, filas_por_pagina=10, ruido=8.0, inclinacion=1.5, desenfoque=1, semilla=0,
+                       dos_pasadas=None):
+    """
+    Genera las hojas, las procesa y devuelve el informe como diccionario
+    """
+    if dos_pasadas is None:
+        dos_pasadas = Config.OCR_DOS_PASADAS
+    obtener_motor_ocr()
+    tiempos = {etapa: [] for etapa in [*ETAPAS, 'deteccion', 'reconocimiento', 'total']}
+    aciertos = {columna: 0 for columna in COLUMNAS}
+    total_filas = filas_leidas = 0
+    duracion_total = 0.0
+
+    with tempfile.TemporaryDirectory() as directorio:
+        for pagina in range(paginas):
+            imagen, esperadas = generar_hoja(filas_por_pagina, ruido, inclinacion, desenfoque, semilla + pagina)
+            ruta = os.path.join(directorio, f"hoja_{pagina}.png")
+            cv2.imwrite(ruta, imagen)
+
+            registros, tiempos_pagina = procesar_medido(ruta, dos_pasadas)
+            separar_deteccion(tiempos_pagina, medir_deteccion(ruta, dos_pasadas), dos_pasadas)
+            for etapa, ms in tiempos_pagina.items():
+                tiempos[etapa].append(ms)
+            duracion_total += tiempos_pagina['total'] / 1000
+            for columna, valor in evaluar_precision(esperadas, registros).items():
+                aciertos[columna] += valor
+            total_filas += len(esperadas)
+            filas_leidas += len(registros)
+
+    precision = {columna: round(valor / total_filas, 4) for columna, valor in aciertos.items()}
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'configuracion': {
+            'paginas': paginas,
+            'filas_por_pagina': filas_por_pagina,
+            'ruido': ruido,
+            'inclinacion': inclinacion,
+            'desenfoque': desenfoque,
+            'semilla': semilla,
+            'dos_pasadas': dos_pasadas,
+        },
+        # Solo las etapas que recorre el modo elegido
+        'etapas': {etapa: resumir_tiempos(valores) for etapa, valores in tiempos.items() if any(valores)},
+        'paginas_por_segundo': round(paginas / duracion_total, 4),
+        'filas_leidas': filas_leidas,
+        'precision_campos': precision,
+        'precision_global': round(sum(aciertos.values()) / (total_filas * len(COLUMNAS)), 4),
+    }
+
+
+def comparar_modos(paginas=10, filas_por_pagina=10, ruido=8.0, inclinacion=1.5, desenfoque=1, semilla=0):
+    """
+    Compara velocidad y precisión de la pasada rápida sola, las dos pasadas y
+    una pasada completa en alta resolución sobre las mismas hojas
+    """
+    motor = obtener_motor_ocr()
+
+    def solo_rapida(imagen):
+        return construir_registros(agrupar_filas(primera_pasada(imagen, Config.OCR_ESCALA_RAPIDA, motor)))
+
+    modos = {
+        'rapida': solo_rapida,
+        'dos_pasadas': lambda imagen: extraer_registros(imagen, dos_pasadas=True),
+        'completa': lambda imagen: extraer_registros(imagen, dos_pasadas=False),
+    }
+    hojas = [generar_hoja(filas_por_pagina, ruido, inclinacion, desenfoque, semilla + pagina)
+             for pagina in range(paginas)]
+    total_filas = paginas * filas_por_pagina
+
+    informe = {}
+    for modo, procesar in modos.items():
+        aciertos = 0
+        releidas = celdas = 0
+        duracion = 0.0
+        for imagen, esperadas in hojas:
+            inicio = time.perf_counter()
+            registros = procesar(imagen)
+            duracion += time.perf_counter() - inicio
+            aciertos += sum(evaluar_precision(esperadas, registros).values())
+            for registro in registros:
+                for celda in registro.get('validacion', {}).values():
+                    celdas += 1
+                    releidas += celda.get('pasada') not in ('rapida', 'completa', None)
+        informe[modo] = {
+            'paginas_por_segundo': round(paginas / duracion, 4) if duracion else 0.0,
+            'precision_global': round(aciertos / (total_filas * len(COLUMNAS)), 4),
+            'celdas_releidas': round(releidas / celdas, 4) if celdas else 0.0,
+        }
+    return informe
+
+
+def medir_normalizacion(num_filas=50000, semilla=0):
+    """
+    Microbenchmark del costo por fila de normalizar_fila (sin motor OCR)
+    """
+    rng = random.Random(semilla)
+    confusiones = {'0': 'O', '1': 'l', '5': 'S'}
+    filas = []
+    minuto = 6 * 60
+    for _ in range(num_filas):
+        fila, minuto = generar_fila(rng, minuto)
+        if minuto >= 23 * 60:
+            minuto = 6 * 60
+        textos = [str(fila[c]) for c in COLUMNAS]
+        # Introducir una confusión OCR en una celda al azar
+        i = rng.randrange(len(textos))
+        textos[i] = ''.join(confusiones.get(ch, ch) if rng.random() < 0.3 else ch for ch in textos[i])
+        filas.append(textos)
+
+    inicio = time.perf_counter()
+    validas = 0
+    for textos in filas:
+        celdas = normalizar_fila(textos)
+        validas += sum(1 for celda in celdas.values() if celda.valido)
+    duracion = time.perf_counter() - inicio
+
+    return {
+        'filas': num_filas,
+        'us_por_fila': round(duracion / num_filas * 1e6, 3),
+        'filas_por_segundo': round(num_filas / duracion, 1),
+        'celdas_validas': round(validas / (num_filas * len(COLUMNAS)), 4),
+    }
+
+
+def comparar_informes(anterior, actual):
+    """Devuelve las diferencias (actual - anterior) de las métricas principales"""
+    diferencias = {
+        'paginas_por_segundo': round(actual['paginas_por_segundo'] - anterior['paginas_por_segundo'], 4),
+        'precision_global': round(actual['precision_global'] - anterior['precision_global'], 4),
+        'etapas_media_ms': {},
+        'precision_campos': {},
+    }
+    for etapa, datos in actual['etapas'].items():
+        if etapa in anterior.get('etapas', {}):
+            diferencias['etapas_media_ms'][etapa] = round(datos['media_ms'] - anterior['etapas'][etapa]['media_ms'], 3)
+    for columna, valor in actual['precision_campos'].items():
+        if columna in anterior.get('precision_campos', {}):
+            diferencias['precision_campos'][columna] = round(valor - anterior['precision_campos'][columna], 4)
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de rendimiento y precisión del OCR')
+    parser.add_argument('--paginas', type=int, default=10)
+    parser.add_argument('--filas', type=int, default=10)
+    parser.add_argument('--ruido', type=float, default=8.0, help='Desviación del ruido gaussiano (0-255)')
+    parser.add_argument('--inclinacion', type=float, default=1.5, help='Ángulo máximo de rotación en grados')
+    parser.add_argument('--desenfoque', type=int, default=1, help='Radio del desenfoque gaussiano')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', help='Archivo JSON donde guardar el informe')
+    parser.add_argument('--comparar', help='Informe JSON anterior contra el que comparar')
+    parser.add_argument('--normalizacion', type=int, metavar='FILAS',
+                        help='Solo medir el costo por fila de la normalización')
+    parser.add_argument('--modos', action='store_true',
+                        help='Comparar pasada rápida, dos pasadas y pasada completa')
+    parser.add_argument('--pasadas', type=int, choices=(1, 2),
+                        help='Camino de producción a medir (por defecto, el de OCR_DOS_PASADAS)')
+    args = parser.parse_args()
+
+    if args.modos:
+        print(json.dumps(comparar_modos(args.paginas, args.filas, args.ruido, args.inclinacion,
+                                        args.desenfoque, args.semilla), indent=2))
+        return
+
+    if args.normalizacion:
+        print(json.dumps(medir_normalizacion(args.normalizacion, args.semilla), indent=2))
+        return
+
+    informe = ejecutar_benchmark(args.paginas, args.filas, args.ruido, args.inclinacion,
+                                 args.desenfoque, args.semilla,
+                                 dos_pasadas=None if args.pasadas is None else args.pasadas == 2)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            informe['comparacion'] = comparar_informes(json.load(archivo), informe)
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto)
+    print(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,104 +1,334 @@
 import cv2
 import numpy as np
 from paddleocr import PaddleOCR
-import re
 import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from config import Config
+from app.servicios.perfilador import etiquetar
+
+from app.servicios.normalizacion import (
+    NORMALIZADORES_COLUMNA, normalizar_fila, normalizar_hora, normalizar_texto, normalizar_numero
+)
 
 logger = logging.getLogger(__name__)
 
-def extraer_filas_columnas(imagen_path):
+# Por debajo de esta confianza una caja no se asigna a ninguna columna
+CONFIANZA_MINIMA = 0.5
+
+# Pool de motores OCR del proceso: cargar los modelos es la parte más costosa y
+# un motor no debe usarse desde dos hilos a la vez
+_motores_libres = queue.LifoQueue()
+_motores_creados = 0
+_lock_motores = threading.Lock()
+
+def crear_motor_ocr():
     """
-    Extrae filas y columnas de una imagen tabular
+    Crea una instancia nueva de PaddleOCR
     """
+    return PaddleOCR(use_angle_cls=True, lang='es', cpu_threads=Config.OCR_HILOS_CPU)
+
+@contextmanager
+def motor_ocr():
+    """
+    Presta un motor OCR del pool (se crean hasta Config.OCR_MAX_MOTORES)
+    """
+    global _motores_creados
     try:
-        # Inicializar OCR
-        ocr = PaddleOCR(use_angle_cls=True, lang='es')
-        
-        # Leer imagen
-        imagen = cv2.imread(imagen_path)
-        if imagen is None:
-            raise ValueError("No se pudo cargar la imagen")
-        
-        # Ejecutar OCR
+        motor = _motores_libres.get_nowait()
+    except queue.Empty:
+        with _lock_motores:
+            crear = _motores_creados < Config.OCR_MAX_MOTORES
+            if crear:
+                _motores_creados += 1
+        if crear:
+            try:
+                motor = crear_motor_ocr()
+            except Exception:
+                with _lock_motores:
+                    _motores_creados -= 1
+                raise
+        else:
+            motor = _motores_libres.get()
+    try:
+        yield motor
+    finally:
+        _motores_libres.put(motor)
+
+def obtener_motor_ocr():
+    """
+    Precarga un motor en el pool y lo devuelve (para uso de un solo hilo,
+    como los benchmarks o el precalentamiento)
+    """
+    with motor_ocr() as motor:
+        return motor
+
+@etiquetar('ocr.cargar')
+def cargar_imagen(imagen):
+    """
+    Carga una imagen desde una ruta (o la devuelve si ya es un arreglo)
+    """
+    if isinstance(imagen, np.ndarray):
+        return imagen
+    imagen_cargada = cv2.imread(imagen)
+    if imagen_cargada is None:
+        raise ValueError("No se pudo cargar la imagen")
+    return imagen_cargada
+
+def recortar_caja(imagen, bbox, margen=2):
+    """
+    Recorta de la imagen el rectángulo que contiene la caja detectada
+    """
+    xs = [punto[0] for punto in bbox]
+    ys = [punto[1] for punto in bbox]
+    alto, ancho = imagen.shape[:2]
+    x0 = max(int(min(xs)) - margen, 0)
+    y0 = max(int(min(ys)) - margen, 0)
+    x1 = min(int(max(xs)) + margen, ancho)
+    y1 = min(int(max(ys)) + margen, alto)
+    return imagen[y0:y1, x0:x1]
+
+def crear_elemento(bbox, texto, confianza):
+    """
+    Construye el diccionario de un texto detectado con su posición
+    """
+    xs = [punto[0] for punto in bbox]
+    ys = [punto[1] for punto in bbox]
+    return {
+        'texto': texto.strip(),
+        'x': sum(xs) / 4,
+        'y': sum(ys) / 4,
+        'bbox': [int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys))],
+        'confianza': confianza
+    }
+
+@etiquetar('ocr.detectar')
+def detectar_cajas(imagen, motor=None):
+    """
+    Ejecuta solo la detección de texto y devuelve las cajas encontradas.
+    Producción detecta y reconoce en una sola llamada (detectar_elementos,
+    primera_pasada); esta función sirve para medir la detección por separado
+    """
+    if motor is None:
+        with motor_ocr() as motor:
+            return detectar_cajas(imagen, motor)
+    resultado = motor.ocr(imagen, det=True, rec=False, cls=False)
+    if not resultado or not resultado[0]:
+        return []
+    return resultado[0]
+
+@etiquetar('ocr.extraer')
+def detectar_elementos(imagen_path):
+    """
+    Texto y coordenadas de una imagen tabular (ruta o arreglo de OpenCV).
+    Los errores se propagan
+    """
+    imagen = cargar_imagen(imagen_path)
+
+    with motor_ocr() as ocr:
         resultado = ocr.ocr(imagen, cls=True)
-        
-        if not resultado or not resultado[0]:
-            return []
-        
-        # Extraer texto y coordenadas
-        elementos = []
-        for linea in resultado[0]:
-            bbox, (texto, confianza) = linea
-            if confianza > 0.5:  # Filtrar por confianza
-                # Calcular posición promedio
-                x = sum([punto[0] for punto in bbox]) / 4
-                y = sum([punto[1] for punto in bbox]) / 4
-                elementos.append({
-                    'texto': texto.strip(),
-                    'x': x,
-                    'y': y,
-                    'confianza': confianza
-                })
-        
-        return elementos
+
+    if not resultado or not resultado[0]:
+        return []
+
+    elementos = []
+    for linea in resultado[0]:
+        bbox, (texto, confianza) = linea
+        if confianza > CONFIANZA_MINIMA:  # Filtrar por confianza
+            elementos.append(crear_elemento(bbox, texto, confianza))
+
+    return elementos
+
+def extraer_filas_columnas(imagen_path):
+    """
+    Extrae filas y columnas de una imagen tabular (ruta o arreglo de OpenCV)
+    """
+    try:
+        return detectar_elementos(imagen_path)
     
     except Exception as e:
         logger.error(f"Error en extraer_filas_columnas: {str(e)}")
         return []
 
-def procesar_imagen_tabular(imagen_path):
+@etiquetar('ocr.estructurar')
+def agrupar_filas(elementos, tolerancia_y=20):
+    """
+    Agrupa los elementos detectados en filas ordenadas de izquierda a derecha
+    """
+    # Ordenar elementos por posición Y (filas) y luego por X (columnas)
+    elementos = sorted(elementos, key=lambda x: (x['y'], x['x']))
+    
+    # Agrupar por filas (elementos con Y similares)
+    filas = []
+    fila_actual = []
+    y_anterior = None
+    
+    for elemento in elementos:
+        if y_anterior is None or abs(elemento['y'] - y_anterior) < tolerancia_y:
+            fila_actual.append(elemento)
+        else:
+            if fila_actual:
+                filas.append(sorted(fila_actual, key=lambda x: x['x']))
+            fila_actual = [elemento]
+        y_anterior = elemento['y']
+    
+    # Agregar la última fila
+    if fila_actual:
+        filas.append(sorted(fila_actual, key=lambda x: x['x']))
+    
+    return filas
+
+@etiquetar('ocr.limpiar')
+def construir_registros(filas):
     """
-    Procesa una imagen tabular y extrae registros estructurados
+    Convierte las filas agrupadas en registros estructurados
     """
+    registros = []
+    
+    for fila in filas[1:]:  # Saltar la primera fila (encabezados)
+        # Las cajas ilegibles no ocupan columna: correrían las de su derecha
+        descartadas = [e for e in fila if e.get('descartada')]
+        fila = [e for e in fila if not e.get('descartada')]
+        if len(fila) >= 3:  # Mínimo 3 columnas para considerar válida
+            celdas = normalizar_fila([e['texto'] for e in fila], [e['confianza'] for e in fila])
+            registro = {columna: celda.valor for columna, celda in celdas.items()}
+            
+            # Solo agregar si tiene datos válidos
+            if any(celda.valido for celda in celdas.values()):
+                pasadas = [e.get('pasada', 'completa') for e in fila]
+                # Caja de la fila completa en la imagen original (para el archivo de imágenes)
+                cajas = [e['bbox'] for e in fila]
+                registro['bbox'] = [min(c[0] for c in cajas), min(c[1] for c in cajas),
+                                    max(c[2] for c in cajas), max(c[3] for c in cajas)]
+                registro['validacion'] = {
+                    columna: {
+                        'valido': celda.valido,
+                        'confianza': round(celda.confianza, 3),
+                        'pasada': pasadas[i] if i < len(pasadas) else None,
+                    }
+                    for i, (columna, celda) in enumerate(celdas.items())
+                }
+                if descartadas:
+                    registro['advertencias'] = [
+                        f"Celda ilegible descartada: '{e['texto']}' (confianza {e['confianza']:.2f})"
+                        for e in descartadas
+                    ]
+                registros.append(registro)
+    
+    return registros
+
+@etiquetar('ocr.pasada_rapida')
+def primera_pasada(imagen, escala, motor):
+    """
+    OCR rápido sobre la imagen reducida; las cajas se devuelven en coordenadas
+    de la imagen original y se conservan también las de baja confianza
+    """
+    reducida = imagen
+    if escala < 1:
+        reducida = cv2.resize(imagen, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+    resultado = motor.ocr(reducida, cls=False)
+    if not resultado or not resultado[0]:
+        return []
+    elementos = []
+    for bbox, (texto, confianza) in resultado[0]:
+        elemento = crear_elemento([[x / escala, y / escala] for x, y in bbox], texto, float(confianza))
+        elemento['pasada'] = 'rapida'
+        elementos.append(elemento)
+    return elementos
+
+def _variantes_recorte(recorte):
+    """Recorte a resolución completa y, si no alcanza, binarizado y ampliado"""
+    yield 'relectura', recorte
+    gris = cv2.cvtColor(recorte, cv2.COLOR_BGR2GRAY) if recorte.ndim == 3 else recorte
+    _, binaria = cv2.threshold(gris, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    binaria = cv2.cvtColor(binaria, cv2.COLOR_GRAY2BGR)
+    yield 'binarizada', binaria
+    yield 'ampliada', cv2.resize(binaria, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+def _es_valido(indice_columna, texto):
+    if indice_columna >= len(NORMALIZADORES_COLUMNA):
+        return True
     try:
-        elementos = extraer_filas_columnas(imagen_path)
-        
+        return NORMALIZADORES_COLUMNA[indice_columna][1](texto)[1]
+    except (TypeError, ValueError):
+        return False
+
+@etiquetar('ocr.relectura')
+def releer_celda(imagen, elemento, indice_columna, motor, umbral):
+    """
+    Vuelve a reconocer una celda débil sobre la imagen original probando las
+    variantes de preprocesado; conserva el mejor resultado (válido primero,
+    luego mayor confianza) y anota en 'pasada' cuál lo produjo
+    """
+    x0, y0, x1, y1 = elemento['bbox']
+    recorte = recortar_caja(imagen, [(x0, y0), (x1, y1)], margen=4)
+    if recorte.size == 0:
+        return elemento
+    mejor = (_es_valido(indice_columna, elemento['texto']), elemento['confianza'], elemento['texto'], elemento['pasada'])
+    for pasada, variante in _variantes_recorte(recorte):
+        resultado = motor.ocr(variante, det=False, rec=True, cls=True)
+        if not resultado or not resultado[0]:
+            continue
+        texto, confianza = resultado[0][0]
+        candidato = (_es_valido(indice_columna, texto), float(confianza), texto.strip(), pasada)
+        if candidato[:2] > mejor[:2]:
+            mejor = candidato
+        if mejor[0] and mejor[1] >= umbral:
+            break
+    elemento.update(texto=mejor[2], confianza=mejor[1], pasada=mejor[3])
+    return elemento
+
+def procesar_imagen_dos_pasadas(imagen_path, escala=None, umbral=None):
+    """
+    Primera pasada rápida sobre la imagen reducida y segunda pasada solo sobre
+    las celdas con confianza menor al umbral o que no pasan la validación
+    """
+    escala = escala or Config.OCR_ESCALA_RAPIDA
+    umbral = Config.OCR_UMBRAL_CONFIANZA if umbral is None else umbral
+    imagen = cargar_imagen(imagen_path)
+    with motor_ocr() as motor:
+        elementos = primera_pasada(imagen, escala, motor)
         if not elementos:
             return []
-        
-        # Ordenar elementos por posición Y (filas) y luego por X (columnas)
-        elementos.sort(key=lambda x: (x['y'], x['x']))
-        
-        # Agrupar por filas (elementos con Y similares)
-        filas = []
-        fila_actual = []
-        y_anterior = None
-        tolerancia_y = 20  # Tolerancia para considerar elementos en la misma fila
-        
-        for elemento in elementos:
-            if y_anterior is None or abs(elemento['y'] - y_anterior) < tolerancia_y:
-                fila_actual.append(elemento)
-            else:
-                if fila_actual:
-                    filas.append(sorted(fila_actual, key=lambda x: x['x']))
-                fila_actual = [elemento]
-            y_anterior = elemento['y']
-        
-        # Agregar la última fila
-        if fila_actual:
-            filas.append(sorted(fila_actual, key=lambda x: x['x']))
-        
-        # Convertir filas a registros estructurados
-        registros = []
-        
-        for fila in filas[1:]:  # Saltar la primera fila (encabezados)
-            if len(fila) >= 3:  # Mínimo 3 columnas para considerar válida
-                registro = {
-                    'hora_inicio': limpiar_hora(fila[0]['texto'] if len(fila) > 0 else ''),
-                    'hora_final': limpiar_hora(fila[1]['texto'] if len(fila) > 1 else ''),
-                    'codigo_actividad': limpiar_texto(fila[2]['texto'] if len(fila) > 2 else ''),
-                    'unidad_produccion': limpiar_texto(fila[3]['texto'] if len(fila) > 3 else ''),
-                    'codigo_equipo': limpiar_texto(fila[4]['texto'] if len(fila) > 4 else ''),
-                    'referencia_producto': limpiar_texto(fila[5]['texto'] if len(fila) > 5 else ''),
-                    'cantidad_trabajada': extraer_numero(fila[6]['texto'] if len(fila) > 6 else '0'),
-                    'observaciones': limpiar_texto(fila[7]['texto'] if len(fila) > 7 else ''),
-                }
-                
-                # Solo agregar si tiene datos válidos
-                if any(v for v in registro.values() if str(v).strip()):
-                    registros.append(registro)
-        
-        return registros
+        filas = agrupar_filas(elementos)
+        for fila in filas[1:]:
+            i = 0  # columna: las cajas descartadas no cuentan
+            for elemento in fila:
+                if elemento['confianza'] < umbral or not _es_valido(i, elemento['texto']):
+                    releer_celda(imagen, elemento, i, motor, umbral)
+                    # Ni la relectura la hizo legible: se informa, pero no se asigna a una columna
+                    if elemento['confianza'] <= CONFIANZA_MINIMA or not elemento['texto']:
+                        elemento['descartada'] = True
+                        continue
+                i += 1
+    return construir_registros(filas)
+
+def extraer_registros(imagen_path, dos_pasadas=None):
+    """
+    Registros estructurados de una imagen tabular (ruta o arreglo de OpenCV).
+    Con dos_pasadas (por defecto Config.OCR_DOS_PASADAS) solo se relee en alta
+    resolución lo que la pasada rápida no resolvió. Los errores se propagan:
+    quien procesa lotes puede distinguir una hoja ilegible de una hoja vacía
+    """
+    if dos_pasadas is None:
+        dos_pasadas = Config.OCR_DOS_PASADAS
+    if dos_pasadas:
+        return procesar_imagen_dos_pasadas(imagen_path)
+
+    elementos = detectar_elementos(imagen_path)
+    if not elementos:
+        return []
+    return construir_registros(agrupar_filas(elementos))
+
+def procesar_imagen_tabular(imagen_path, dos_pasadas=None):
+    """
+    Procesa una imagen tabular (ruta o arreglo de OpenCV) y extrae registros estructurados.
+    Ante cualquier error devuelve una lista vacía (ver extraer_registros).
+    """
+    try:
+        return extraer_registros(imagen_path, dos_pasadas)
     
     except Exception as e:
         logger.error(f"Error en procesar_imagen_tabular: {str(e)}")
@@ -108,56 +338,16 @@ def limpiar_hora(texto):
     """
     Limpia y valida formato de hora
     """
-    try:
-        # Buscar patrón HH:MM
-        patron = re.search(r'(\d{1,2}):(\d{2})', texto)
-        if patron:
-            horas = int(patron.group(1))
-            minutos = int(patron.group(2))
-            if 0 <= horas <= 23 and 0 <= minutos <= 59:
-                return f"{horas:02d}:{minutos:02d}"
-        
-        # Buscar solo números y asumir formato HHMM
-        numeros = re.findall(r'\d+', texto)
-        if numeros:
-            num_str = numeros[0]
-            if len(num_str) >= 3:
-                if len(num_str) == 3:  # Formato HMM
-                    horas = int(num_str[0])
-                    minutos = int(num_str[1:3])
-                elif len(num_str) == 4:  # Formato HHMM
-                    horas = int(num_str[0:2])
-                    minutos = int(num_str[2:4])
-                else:
-                    return "00:00"
-                
-                if 0 <= horas <= 23 and 0 <= minutos <= 59:
-                    return f"{horas:02d}:{minutos:02d}"
-        
-        return "00:00"
-    except:
-        return "00:00"
+    return normalizar_hora(texto)[0]
 
 def limpiar_texto(texto):
     """
     Limpia texto eliminando caracteres extraños
     """
-    if not texto:
-        return ""
-    
-    # Remover caracteres especiales pero mantener espacios, números y letras
-    texto_limpio = re.sub(r'[^\w\s\-.]', '', texto)
-    return texto_limpio.strip()
+    return normalizar_texto(texto)[0]
 
 def extraer_numero(texto):
     """
     Extrae número entero del texto
     """
-    try:
-        # Buscar números en el texto
-        numeros = re.findall(r'\d+', str(texto))
-        if numeros:
-            return int(numeros[0])
-        return 0
-    except:
-        return 0
\ No newline at end of file
+    return normalizar_numero(texto)[0]
@@ -0,0 +1,438 @@
+"""
+Perfilado bajo demanda en producción (solo administradores).
+
+Dos modos:
+- peticiones: perfila con cProfile las próximas N peticiones a un endpoint y
+  acumula las estadísticas (texto de pstats o archivo .prof).
+- muestreo: durante T segundos toma muestras periódicas de las pilas de todos
+  los hilos del proceso y las devuelve en formato plegado ("a;b;c 12"), listo
+  para flamegraph.pl o speedscope.
+
+Las funciones marcadas con @etiquetar('ocr.detectar') aparecen con ese nombre
+en ambos modos, y las consultas SQL se anotan en las muestras y se resumen
+por sentencia. Desactivado, el costo es leer una variable global por consulta
+y por llamada etiquetada, y por petición además mirar el reloj (y como máximo
+una vez por INTERVALO_REVISION segundos, si existe el archivo del objetivo).
+
+Con varios workers el estado vive en PERFIL_DIR: el objetivo armado en un
+worker lo ven todos, las N peticiones se reparten entre ellos (se reclaman con
+un bloqueo de archivo) y el último en terminar une los perfiles parciales en
+la captura. Las capturas también son archivos, así que cualquier worker las
+devuelve. El muestreo solo ve los hilos del worker que atiende la petición.
+"""
+import cProfile
+import fcntl
+import glob
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MAX_CAPTURAS = 10
+MAX_PROFUNDIDAD = 80
+INTERVALO_REVISION = 1.0  # segundos entre lecturas del objetivo compartido
+
+PATRON_OPERACION = re.compile(r'\s*(\w+)')
+PATRON_TABLA = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+[`"]?(\w+)', re.IGNORECASE)
+
+_activo = False
+_lock = threading.Lock()
+_lock_muestreo = threading.Lock()
+_objetivo = None          # perfilado de peticiones en curso (con el parcial de este proceso)
+_proxima_revision = 0.0
+_hilos_perfilados = set()
+_sql_muestreo = None      # tiempos SQL del muestreo en curso
+_sql_en_curso = {}        # id de hilo -> etiqueta de la sentencia en ejecución
+_marcos = {}
+_codigos_etiqueta = set()
+
+
+def _actualizar_activo():
+    global _activo
+    _activo = _objetivo is not None or _sql_muestreo is not None
+
+
+# ---------------------
+# ETIQUETAS
+# ---------------------
+def _crear_marco(nombre):
+    """Función intermedia cuyo código lleva el nombre de la etiqueta"""
+    def marco(funcion, args, kwargs):
+        return funcion(*args, **kwargs)
+    codigo = marco.__code__.replace(co_name=nombre)
+    if hasattr(codigo, 'co_qualname'):
+        codigo = codigo.replace(co_qualname=nombre)
+    marco.__code__ = codigo
+    _codigos_etiqueta.add(codigo)
+    return marco
+
+
+def etiquetar(nombre):
+    """
+    Decorador: mientras el perfilador está activo, la función se ejecuta
+    dentro de un marco llamado `nombre`, visible en cProfile y en las muestras
+    """
+    def decorador(funcion):
+        if nombre not in _marcos:
+            _marcos[nombre] = _crear_marco(nombre)
+        marco = _marcos[nombre]
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not _activo:
+                return funcion(*args, **kwargs)
+            return marco(funcion, args, kwargs)
+        return envoltura
+    return decorador
+
+
+def _etiqueta_sql(sentencia):
+    """'sql:SELECT actividades' a partir del texto de la sentencia"""
+    operacion = PATRON_OPERACION.match(sentencia)
+    tabla = PATRON_TABLA.search(sentencia)
+    partes = [operacion.group(1).upper() if operacion else '?']
+    if tabla:
+        partes.append(tabla.group(1))
+    return 'sql:' + ' '.join(partes)
+
+
+def _sumar(tiempos, etiqueta, ms):
+    llamadas, total = tiempos.get(etiqueta, (0, 0.0))
+    tiempos[etiqueta] = (llamadas + 1, total + ms)
+
+
+def _antes_de_sql(conexion, cursor, sentencia, parametros, contexto, multiples):
+    if not _activo:
+        return
+    contexto._perfil_inicio = time.perf_counter()
+    contexto._perfil_etiqueta = _etiqueta_sql(sentencia)
+    _sql_en_curso[threading.get_ident()] = contexto._perfil_etiqueta
+
+
+def _despues_de_sql(conexion, cursor, sentencia, parametros, contexto, multiples):
+    inicio = getattr(contexto, '_perfil_inicio', None)
+    if inicio is None:
+        return
+    ident = threading.get_ident()
+    _sql_en_curso.pop(ident, None)
+    ms = (time.perf_counter() - inicio) * 1000
+    with _lock:
+        if _sql_muestreo is not None:
+            _sumar(_sql_muestreo, contexto._perfil_etiqueta, ms)
+        if _objetivo is not None and ident in _hilos_perfilados:
+            _sumar(_objetivo['sql'], contexto._perfil_etiqueta, ms)
+
+
+# ---------------------
+# ESTADO COMPARTIDO
+# ---------------------
+def _ruta(*partes):
+    return os.path.join(Config.PERFIL_DIR, *partes)
+
+
+def _escribir_json(ruta, datos):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as archivo:
+        json.dump(datos, archivo, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _leer_json(ruta):
+    try:
+        with open(ruta, encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _bloqueo():
+    """Exclusión entre procesos para leer y actualizar el objetivo"""
+    os.makedirs(Config.PERFIL_DIR, exist_ok=True)
+    with open(_ruta('objetivo.lock'), 'a') as archivo:
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def _eliminar_parciales(objetivo_id):
+    for ruta in glob.glob(_ruta('parciales', f"{objetivo_id}-*")):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _revisar_objetivo(forzar=False):
+    """Relee el objetivo compartido (como máximo cada INTERVALO_REVISION segundos)"""
+    global _objetivo, _proxima_revision
+    ahora = time.monotonic()
+    if not forzar and ahora < _proxima_revision:
+        return
+    _proxima_revision = ahora + INTERVALO_REVISION
+    compartido = _leer_json(_ruta('objetivo.json'))
+    with _lock:
+        if compartido is None:
+            _objetivo = None
+        elif _objetivo is None or _objetivo['id'] != compartido['id']:
+            _objetivo = {'id': compartido['id'], 'endpoint': compartido['endpoint'], 'stats': None, 'sql': {}}
+        _actualizar_activo()
+
+
+# ---------------------
+# PERFILADO DE PETICIONES
+# ---------------------
+def perfilar_peticiones(endpoint, cantidad):
+    """Perfila las próximas `cantidad` peticiones a `endpoint` (en cualquier worker)"""
+    with _bloqueo():
+        anterior = _leer_json(_ruta('objetivo.json'))
+        if anterior:
+            _eliminar_parciales(anterior['id'])
+        _escribir_json(_ruta('objetivo.json'), {
+            'id': uuid.uuid4().hex, 'endpoint': endpoint, 'cantidad': cantidad,
+            'inicio': datetime.now().isoformat(timespec='seconds'), 'reclamadas': 0, 'terminadas': 0,
+        })
+    _revisar_objetivo(forzar=True)
+
+
+def cancelar():
+    """Cancela el perfilado de peticiones en curso (sin guardar captura)"""
+    with _bloqueo():
+        objetivo = _leer_json(_ruta('objetivo.json'))
+        if objetivo:
+            os.remove(_ruta('objetivo.json'))
+            _eliminar_parciales(objetivo['id'])
+    _revisar_objetivo(forzar=True)
+
+
+def _reclamar(objetivo_id):
+    """Reserva una de las peticiones del objetivo para este proceso"""
+    with _bloqueo():
+        objetivo = _leer_json(_ruta('objetivo.json'))
+        if objetivo is None or objetivo['id'] != objetivo_id or objetivo['reclamadas'] >= objetivo['cantidad']:
+            return False
+        objetivo['reclamadas'] += 1
+        _escribir_json(_ruta('objetivo.json'), objetivo)
+        return True
+
+
+def _guardar_captura(tipo, stats=None, **datos):
+    """Guarda la captura en PERFIL_DIR (las MAX_CAPTURAS más recientes)"""
+    nombre = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(_ruta('capturas'), exist_ok=True)
+    if stats is not None:
+        stats.dump_stats(_ruta('capturas', f"{nombre}.prof"))
+    _escribir_json(_ruta('capturas', f"{nombre}.json"),
+                   dict(datos, tipo=tipo, nombre=nombre, pid=os.getpid(),
+                        fecha=datetime.now().isoformat(timespec='seconds')))
+    for antigua in sorted(glob.glob(_ruta('capturas', '*.json')))[:-MAX_CAPTURAS]:
+        for ruta in (antigua, antigua[:-len('.json')] + '.prof'):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+
+def _terminar_objetivo(objetivo_id, stats, sql):
+    """
+    Deja el parcial de este proceso y cuenta la petición terminada; el proceso
+    que termina la última une los parciales en la captura
+    """
+    base = _ruta('parciales', f"{objetivo_id}-{os.getpid()}")
+    os.makedirs(_ruta('parciales'), exist_ok=True)
+    stats.dump_stats(base + '.prof')
+    _escribir_json(base + '.json', sql)
+    with _bloqueo():
+        objetivo = _leer_json(_ruta('objetivo.json'))
+        if objetivo is None or objetivo['id'] != objetivo_id:
+            return
+        objetivo['terminadas'] += 1
+        if objetivo['terminadas'] < objetivo['cantidad']:
+            _escribir_json(_ruta('objetivo.json'), objetivo)
+            return
+        parciales = sorted(glob.glob(_ruta('parciales', f"{objetivo_id}-*.prof")))
+        total_sql = {}
+        for ruta in parciales:
+            for etiqueta, (llamadas, ms) in (_leer_json(ruta[:-len('.prof')] + '.json') or {}).items():
+                anteriores = total_sql.get(etiqueta, (0, 0.0))
+                total_sql[etiqueta] = (anteriores[0] + llamadas, anteriores[1] + ms)
+        _guardar_captura('peticiones', stats=pstats.Stats(*parciales), endpoint=objetivo['endpoint'],
+                         peticiones=objetivo['cantidad'], inicio=objetivo['inicio'], sql=total_sql)
+        os.remove(_ruta('objetivo.json'))
+        _eliminar_parciales(objetivo_id)
+
+
+def _iniciar_peticion():
+    _revisar_objetivo()
+    if not _activo or _objetivo is None or request.endpoint != _objetivo['endpoint']:
+        return
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:  # otro perfilador ya activo en el proceso
+        return
+    if not _reclamar(_objetivo['id']):
+        perfil.disable()
+        return
+    request.environ['perfilador.perfil'] = perfil
+    request.environ['perfilador.objetivo'] = _objetivo['id']
+    with _lock:
+        _hilos_perfilados.add(threading.get_ident())
+
+
+def _terminar_peticion(_error=None):
+    perfil = request.environ.pop('perfilador.perfil', None)
+    if perfil is None:
+        return
+    perfil.disable()
+    with _lock:
+        _hilos_perfilados.discard(threading.get_ident())
+        objetivo = _objetivo
+        # Un objetivo cancelado o reemplazado mientras tanto no recibe la petición
+        if objetivo is None or objetivo['id'] != request.environ.get('perfilador.objetivo'):
+            return
+        if objetivo['stats'] is None:
+            objetivo['stats'] = pstats.Stats(perfil)
+        else:
+            objetivo['stats'].add(perfil)
+        # Los parciales se escriben enteros: otro hilo no debe cambiarlos mientras tanto
+        try:
+            _terminar_objetivo(objetivo['id'], objetivo['stats'], objetivo['sql'])
+        except OSError as e:
+            logger.error(f"Error guardando el perfil parcial: {str(e)}")
+    _revisar_objetivo(forzar=True)
+
+
+# ---------------------
+# MUESTREO
+# ---------------------
+def _nombre_marco(marco):
+    codigo = marco.f_code
+    if codigo in _codigos_etiqueta:
+        return codigo.co_name
+    return f"{marco.f_globals.get('__name__', '?')}.{getattr(codigo, 'co_qualname', codigo.co_name)}"
+
+
+def muestrear(segundos, intervalo=0.005):
+    """
+    Toma muestras de las pilas de todos los hilos durante `segundos` y
+    devuelve el texto en formato plegado. Solo un muestreo a la vez.
+    """
+    global _sql_muestreo
+    if not _lock_muestreo.acquire(blocking=False):
+        raise RuntimeError("Ya hay un muestreo en curso")
+    try:
+        with _lock:
+            _sql_muestreo = {}
+            _actualizar_activo()
+
+        propio = threading.get_ident()
+        nombres = {}
+        pilas = Counter()
+        muestras = 0
+        fin = time.perf_counter() + segundos
+        while time.perf_counter() < fin:
+            for ident, marco in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                partes = []
+                while marco is not None and len(partes) < MAX_PROFUNDIDAD:
+                    partes.append(_nombre_marco(marco))
+                    marco = marco.f_back
+                partes.reverse()
+                sql = _sql_en_curso.get(ident)
+                if sql:
+                    partes.append(sql)
+                if ident not in nombres:
+                    nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+                pilas[';'.join([nombres.get(ident, str(ident))] + partes)] += 1
+            muestras += 1
+            time.sleep(intervalo)
+    finally:
+        with _lock:
+            sql, _sql_muestreo = _sql_muestreo or {}, None
+            _actualizar_activo()
+        _lock_muestreo.release()
+
+    plegado = '\n'.join(f"{pila} {cantidad}" for pila, cantidad in pilas.most_common())
+    try:
+        _guardar_captura('muestreo', segundos=segundos, muestras=muestras, plegado=plegado, sql=sql)
+    except OSError as e:
+        logger.error(f"Error guardando la captura del muestreo: {str(e)}")
+    return plegado
+
+
+# ---------------------
+# RESULTADOS
+# ---------------------
+def estado():
+    """Perfilado en curso y capturas disponibles (sin su contenido), de todos los workers"""
+    _revisar_objetivo(forzar=True)
+    objetivo = _leer_json(_ruta('objetivo.json'))
+    if objetivo is not None:
+        objetivo = dict({clave: objetivo[clave] for clave in ('endpoint', 'cantidad', 'inicio')},
+                        restantes=objetivo['cantidad'] - objetivo['terminadas'])
+    capturas = []
+    for ruta in sorted(glob.glob(_ruta('capturas', '*.json'))):
+        captura = _leer_json(ruta)
+        if captura is not None:
+            capturas.append({clave: valor for clave, valor in captura.items() if clave not in ('plegado', 'sql')})
+    return {'activo': _activo, 'objetivo': objetivo, 'capturas': capturas}
+
+
+def ultima_captura():
+    rutas = sorted(glob.glob(_ruta('capturas', '*.json')))
+    captura = _leer_json(rutas[-1]) if rutas else None
+    if captura is not None and captura['tipo'] == 'peticiones':
+        captura['stats'] = _ruta('capturas', f"{captura['nombre']}.prof")
+    return captura
+
+
+def como_texto(captura, orden='cumulative', limite=60):
+    """Texto de una captura (pstats o pilas plegadas) seguido del resumen SQL"""
+    if captura['tipo'] == 'muestreo':
+        cuerpo = captura['plegado']
+    else:
+        salida = io.StringIO()
+        pstats.Stats(captura['stats'], stream=salida).sort_stats(orden).print_stats(limite)
+        cuerpo = salida.getvalue()
+    if captura['sql']:
+        filas = sorted(captura['sql'].items(), key=lambda item: item[1][1], reverse=True)
+        cuerpo += "\n\n# SQL: tiempo total, llamadas, sentencia\n" + '\n'.join(
+            f"# {ms:10.1f} ms {llamadas:7d}x  {etiqueta}" for etiqueta, (llamadas, ms) in filas)
+    return cuerpo
+
+
+def como_prof(captura):
+    """Estadísticas de cProfile en el formato de pstats.dump_stats (.prof)"""
+    with open(captura['stats'], 'rb') as archivo:
+        return archivo.read()
+
+
+def instalar_perfilador(app):
+    """Registra los ganchos de petición y de SQL (inactivos hasta que se pide un perfil)"""
+    app.before_request(_iniciar_peticion)
+    app.teardown_request(_terminar_peticion)
+    if not event.contains(Engine, 'before_cursor_execute', _antes_de_sql):
+        event.listen(Engine, 'before_cursor_execute', _antes_de_sql)
+        event.listen(Engine, 'after_cursor_execute', _despues_de_sql)
@@ -0,0 +1,438 @@
+"""
+Prueba de carga de la aplicación completa, sin servicios externos.
+
+Crea la aplicación con main.crear_aplicacion sobre una base SQLite temporal,
+la puebla con usuarios y actividades, la sirve en un hilo local y lanza
+varios usuarios virtuales que recorren login, dashboards, filtros, la API,
+creación de actividades y carga de imágenes OCR según pesos configurables.
+El informe (JSON) incluye peticiones por segundo, latencias p50/p95/p99 y
+tasa de errores por endpoint, y puede compararse con uno anterior.
+
+Uso:
+    python -m app.servicios.prueba_carga --usuarios 20 --duracion 60 --salida base.json
+    python -m app.servicios.prueba_carga --usuarios 20 --duracion 60 --comparar base.json
+    python -m app.servicios.prueba_carga --url http://localhost:5000 --sin-poblar
+
+Con --url nunca se escribe en ninguna base: el servidor de destino debe tener
+ya los usuarios carga-admin y carga-analista, y los operarios se leen de él.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import date, datetime, timedelta
+
+CONTRASENA = 'carga123'
+TURNOS = ['Mañana', 'Tarde', 'Noche']
+
+# (nombre, peso, rol que lo ejecuta)
+ESCENARIOS = [
+    ('login', 2, None),
+    ('admin_dashboard', 10, 'Admin'),
+    ('admin_actividades', 12, 'Admin'),
+    ('admin_actividades_filtro', 12, 'Admin'),
+    ('api_filtrar', 15, None),
+    ('api_referencias', 5, None),
+    ('analista_dashboard', 12, 'Analista'),
+    ('analista_dashboard_semana', 5, 'Analista'),
+    ('analista_crear', 6, 'Analista'),
+    ('ocr_imagen', 1, None),
+]
+
+
+# ---------------------
+# DATOS DE PRUEBA
+# ---------------------
+def poblar_base(app, operarios=200, actividades=50000, dias=365, semilla=0, tamano_lote=5000):
+    """
+    Inserta un admin, un analista y los operarios, más actividades repartidas
+    en los últimos `dias`. Devuelve los documentos de acceso por rol.
+    """
+    from extensions import db, bcrypt
+    from app.models import Usuario, Actividad
+    from app.servicios import version_datos
+    from app.servicios.ingesta_actividades import calcular_huella
+
+    rng = random.Random(semilla)
+    # Un solo hash para todos: bcrypt es deliberadamente lento
+    hash_contrasena = bcrypt.generate_password_hash(CONTRASENA).decode('utf-8')
+
+    with app.app_context():
+        usuarios = [
+            {'nombre_completo': 'Admin Carga', 'documento': 'carga-admin', 'contraseña': hash_contrasena, 'rol': 'Admin'},
+            {'nombre_completo': 'Analista Carga', 'documento': 'carga-analista', 'contraseña': hash_contrasena, 'rol': 'Analista'},
+        ]
+        usuarios += [
+            {'nombre_completo': f"Operario {i:04d}", 'documento': f"carga-op-{i:04d}",
+             'contraseña': hash_contrasena, 'rol': 'Operario'}
+            for i in range(operarios)
+        ]
+        db.session.execute(Usuario.__table__.insert(), usuarios)
+        ids_operarios = db.session.query(Usuario.id).filter(Usuario.rol == 'Operario').all()
+        ids_operarios = [fila[0] for fila in ids_operarios]
+
+        hoy = date.today()
+        lote = []
+        for _ in range(actividades):
+            minuto = rng.randrange(0, 22 * 60)
+            lote.append({
+                'fecha': hoy - timedelta(days=rng.randrange(dias)),
+                'turno': rng.choice(TURNOS),
+                'hora_inicio': f"{minuto // 60:02d}:{minuto % 60:02d}",
+                'hora_final': f"{(minuto + 60) // 60:02d}:{minuto % 60:02d}",
+                'codigo_actividad': f"A{rng.randint(1, 40):02d}",
+                'descripcion_actividad': f"UP{rng.randint(1, 9)}",
+                'codigo_equipo': f"EQ-{rng.randint(100, 999)}",
+                'orden_produccion': f"OP{rng.randint(1, 5000)}",
+                'referencia_producto': f"REF{rng.randint(1000, 9999)}",
+                'cantidad_trabajada': rng.randint(1, 500),
+                'observaciones': rng.choice(['OK', 'Normal', 'Ajuste', '']),
+                'usuario_id': rng.choice(ids_operarios),
+            })
+            lote[-1]['huella'] = calcular_huella(lote[-1])
+            if len(lote) >= tamano_lote:
+                db.session.execute(Actividad.__table__.insert(), lote)
+                lote = []
+        if lote:
+            db.session.execute(Actividad.__table__.insert(), lote)
+        db.session.commit()
+
+    # Las inserciones masivas no pasan por el ORM: avisar a las cachés
+    version_datos.notificar_cambio(Usuario.__tablename__)
+    version_datos.notificar_cambio(Actividad.__tablename__)
+    return {'Admin': 'carga-admin', 'Analista': 'carga-analista'}, ids_operarios
+
+
+def imagen_muestra(filas=8, semilla=0):
+    """Hoja de turno sintética en PNG (la misma que usa ocr_benchmark)"""
+    import cv2
+    from app.servicios.ocr_benchmark import generar_hoja
+
+    imagen, _ = generar_hoja(filas, 6.0, 1.0, 1, semilla)
+    return cv2.imencode('.png', imagen)[1].tobytes()
+
+
+def operarios_remotos(url_base, documento_admin):
+    """Ids de los operarios del servidor de destino, leídos de /api/referencias"""
+    admin = UsuarioVirtual(url_base, 'Admin', documento_admin, {}, random.Random())
+    admin.iniciar_sesion()
+    try:
+        # El login siempre redirige: el fallo se ve al pedir un recurso protegido
+        referencias = admin.leer_json('/api/referencias')
+    except urllib.error.HTTPError as e:
+        raise SystemExit(f"No se pudo iniciar sesión como {documento_admin} en {url_base} ({e.code})")
+    ids = [operario['id'] for operario in referencias['operarios']]
+    if not ids:
+        raise SystemExit(f"{url_base} no tiene operarios registrados")
+    return ids
+
+
+# ---------------------
+# SERVIDOR
+# ---------------------
+def iniciar_servidor(app, puerto=0):
+    """Sirve la aplicación en un hilo. Devuelve (servidor, url base)"""
+    from werkzeug.serving import make_server
+
+    servidor = make_server('127.0.0.1', puerto, app, threaded=True)
+    hilo = threading.Thread(target=servidor.serve_forever, name='servidor-carga', daemon=True)
+    hilo.start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}"
+
+
+# ---------------------
+# CLIENTE
+# ---------------------
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    """Las redirecciones se miden como respuesta, no se siguen"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _multipart(campos, archivos):
+    limite = uuid.uuid4().hex
+    partes = []
+    for nombre, valor in campos.items():
+        partes.append(f'--{limite}\r\nContent-Disposition: form-data; name="{nombre}"\r\n\r\n{valor}\r\n'.encode())
+    for nombre, (nombre_archivo, contenido, tipo) in archivos.items():
+        partes.append(
+            f'--{limite}\r\nContent-Disposition: form-data; name="{nombre}"; filename="{nombre_archivo}"\r\n'
+            f'Content-Type: {tipo}\r\n\r\n'.encode() + contenido + b'\r\n'
+        )
+    partes.append(f'--{limite}--\r\n'.encode())
+    return b''.join(partes), f'multipart/form-data; boundary={limite}'
+
+
+class UsuarioVirtual:
+    """Sesión HTTP con cookies propias que ejecuta escenarios"""
+
+    def __init__(self, url_base, rol, documento, contexto, rng, timeout=30):
+        self.url_base = url_base
+        self.rol = rol
+        self.documento = documento
+        self.contexto = contexto
+        self.rng = rng
+        self.timeout = timeout
+        self.cliente = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SinRedirecciones)
+
+    def peticion(self, metodo, ruta, campos=None, archivos=None):
+        """Devuelve (código de estado, bytes leídos)"""
+        datos, cabeceras = None, {'Accept-Encoding': 'gzip'}
+        if archivos:
+            datos, cabeceras['Content-Type'] = _multipart(campos or {}, archivos)
+        elif campos is not None:
+            datos = urllib.parse.urlencode(campos).encode()
+            cabeceras['Content-Type'] = 'application/x-www-form-urlencoded'
+        solicitud = urllib.request.Request(self.url_base + ruta, data=datos, headers=cabeceras, method=metodo)
+        try:
+            with self.cliente.open(solicitud, timeout=self.timeout) as respuesta:
+                return respuesta.status, len(respuesta.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read() or b'')
+
+    def leer_json(self, ruta):
+        """GET de un recurso JSON (sin compresión)"""
+        solicitud = urllib.request.Request(self.url_base + ruta, headers={'Accept': 'application/json'})
+        with self.cliente.open(solicitud, timeout=self.timeout) as respuesta:
+            return json.loads(respuesta.read().decode('utf-8'))
+
+    def iniciar_sesion(self):
+        return self.peticion('POST', '/login', {'documento': self.documento, 'contraseña': CONTRASENA})
+
+    def _rango(self, dias_max=90):
+        fin = date.today() - timedelta(days=self.rng.randrange(0, 30))
+        inicio = fin - timedelta(days=self.rng.randint(1, dias_max))
+        return inicio.isoformat(), fin.isoformat()
+
+    def ejecutar(self, escenario):
+        rng = self.rng
+        if escenario == 'login':
+            return self.iniciar_sesion()
+        if escenario == 'admin_dashboard':
+            inicio, fin = self._rango(30)
+            return self.peticion('GET', f"/admin/dashboard?fecha_inicio={inicio}&fecha_fin={fin}")
+        if escenario == 'admin_actividades':
+            return self.peticion('GET', f"/admin/actividades?page={rng.randint(1, 20)}")
+        if escenario == 'admin_actividades_filtro':
+            inicio, fin = self._rango(60)
+            filtros = {
+                'texto': rng.choice(['', 'A1', 'EQ-2', 'REF5']),
+                'turno': rng.choice([''] + TURNOS),
+                'usuario_id': rng.choice(['', '', str(rng.choice(self.contexto['operarios']))]),
+                'fecha_inicio': inicio,
+                'fecha_fin': fin,
+            }
+            return self.peticion('GET', '/admin/actividades?' + urllib.parse.urlencode(filtros))
+        if escenario == 'api_filtrar':
+            inicio, fin = self._rango(180)
+            return self.peticion('GET', f"/api/actividades/filtrar?inicio={inicio}&fin={fin}")
+        if escenario == 'api_referencias':
+            return self.peticion('GET', '/api/referencias')
+        if escenario == 'analista_dashboard':
+            inicio, fin = self._rango(60)
+            return self.peticion('GET', f"/analista/dashboard?fecha_inicio_grafica={inicio}&fecha_fin_grafica={fin}")
+        if escenario == 'analista_dashboard_semana':
+            inicio, fin = self._rango(365)
+            return self.peticion('GET', f"/analista/dashboard?fecha_inicio_grafica={inicio}"
+                                        f"&fecha_fin_grafica={fin}&agrupacion=semana&busqueda=EQ")
+        if escenario == 'analista_crear':
+            minuto = rng.randrange(0, 22 * 60)
+            return self.peticion('POST', '/analista/crear', {
+                'usuario_id': rng.choice(self.contexto['operarios']),
+                'fecha': date.today().isoformat(),
+                'turno': rng.choice(TURNOS),
+                'hora_inicio': f"{minuto // 60:02d}:{minuto % 60:02d}",
+                'hora_final': f"{(minuto + 30) // 60:02d}:{(minuto + 30) % 60:02d}",
+                'codigo_equipo': f"EQ-{rng.randint(100, 999)}",
+                'codigo_actividad': f"A{rng.randint(1, 40):02d}",
+                'orden_produccion': f"OP{rng.randint(1, 5000)}",
+                'referencia_producto': f"REF{rng.randint(1000, 9999)}",
+                'descripcion_actividad': 'Carga',
+                'cantidad_trabajada': rng.randint(1, 500),
+                'observaciones': 'prueba de carga',
+            })
+        if escenario == 'ocr_imagen':
+            return self.peticion('POST', '/operario/procesar_imagen',
+                                 archivos={'imagen': ('hoja.png', self.contexto['imagen'], 'image/png')})
+        raise ValueError(f"Escenario desconocido: {escenario}")
+
+
+# ---------------------
+# EJECUCIÓN
+# ---------------------
+def _percentil(ordenados, p):
+    return ordenados[min(int(len(ordenados) * p), len(ordenados) - 1)]
+
+
+def resumir_endpoint(latencias, errores, duracion):
+    """Métricas de un endpoint a partir de sus latencias (ms) y cantidad de errores"""
+    ordenadas = sorted(latencias)
+    total = len(ordenadas)
+    if not total:
+        return {'peticiones': 0, 'errores': 0}
+    return {
+        'peticiones': total,
+        'errores': errores,
+        'tasa_errores': round(errores / total, 4),
+        'peticiones_por_segundo': round(total / duracion, 3),
+        'media_ms': round(statistics.fmean(ordenadas), 3),
+        'p50_ms': round(_percentil(ordenadas, 0.50), 3),
+        'p95_ms': round(_percentil(ordenadas, 0.95), 3),
+        'p99_ms': round(_percentil(ordenadas, 0.99), 3),
+        'max_ms': round(ordenadas[-1], 3),
+    }
+
+
+def ejecutar_carga(url_base, documentos, contexto, usuarios=10, duracion=30, calentamiento=5,
+                   escenarios=None, semilla=0):
+    """
+    Lanza `usuarios` hilos que eligen escenarios por peso durante `duracion`
+    segundos (tras `calentamiento` segundos sin medir). Devuelve el informe.
+    """
+    escenarios = escenarios or ESCENARIOS
+    latencias = {}
+    errores = {}
+    lock = threading.Lock()
+    inicio_medicion = time.perf_counter() + calentamiento
+    fin_medicion = inicio_medicion + duracion
+
+    def trabajar(indice):
+        rng = random.Random(semilla * 1000 + indice)
+        rol = 'Admin' if indice % 2 == 0 else 'Analista'
+        usuario = UsuarioVirtual(url_base, rol, documentos[rol], contexto, rng)
+        usuario.iniciar_sesion()
+        disponibles = [(nombre, peso) for nombre, peso, r in escenarios if r in (None, rol)]
+        if contexto.get('imagen') is None:
+            disponibles = [(nombre, peso) for nombre, peso in disponibles if nombre != 'ocr_imagen']
+        nombres = [nombre for nombre, _ in disponibles]
+        pesos = [peso for _, peso in disponibles]
+
+        while True:
+            escenario = rng.choices(nombres, pesos)[0]
+            comienzo = time.perf_counter()
+            if comienzo >= fin_medicion:
+                return
+            try:
+                estado, _ = usuario.ejecutar(escenario)
+                fallo = estado >= 400
+            except Exception:
+                fallo = True
+            final = time.perf_counter()
+            if comienzo < inicio_medicion:
+                continue
+            with lock:
+                latencias.setdefault(escenario, []).append((final - comienzo) * 1000)
+                errores[escenario] = errores.get(escenario, 0) + int(fallo)
+
+    hilos = [threading.Thread(target=trabajar, args=(i,), name=f"carga-{i}") for i in range(usuarios)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    endpoints = {nombre: resumir_endpoint(valores, errores[nombre], duracion)
+                 for nombre, valores in sorted(latencias.items())}
+    todas = [valor for valores in latencias.values() for valor in valores]
+    global_ = resumir_endpoint(todas, sum(errores.values()), duracion)
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'usuarios': usuarios,
+        'duracion_s': duracion,
+        'global': global_,
+        'endpoints': endpoints,
+    }
+
+
+def comparar_informes(anterior, actual):
+    """Diferencias (actual - anterior) de rendimiento, latencias y errores"""
+    metricas = ('peticiones_por_segundo', 'p50_ms', 'p95_ms', 'p99_ms', 'tasa_errores')
+
+    def diferencia(antes, ahora):
+        return {m: round(ahora[m] - antes[m], 4) for m in metricas if m in antes and m in ahora}
+
+    return {
+        'global': diferencia(anterior.get('global', {}), actual['global']),
+        'endpoints': {nombre: diferencia(anterior['endpoints'][nombre], datos)
+                      for nombre, datos in actual['endpoints'].items()
+                      if nombre in anterior.get('endpoints', {})},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de la aplicación')
+    parser.add_argument('--usuarios', type=int, default=10, help='Usuarios virtuales concurrentes')
+    parser.add_argument('--duracion', type=float, default=30, help='Segundos de medición')
+    parser.add_argument('--calentamiento', type=float, default=5, help='Segundos iniciales sin medir')
+    parser.add_argument('--operarios', type=int, default=200)
+    parser.add_argument('--actividades', type=int, default=50000)
+    parser.add_argument('--dias', type=int, default=365, help='Días de historia de las actividades')
+    parser.add_argument('--sin-ocr', action='store_true', help='Excluir la carga de imágenes OCR')
+    parser.add_argument('--url', help='Probar un servidor ya en marcha en lugar de crear uno')
+    parser.add_argument('--sin-poblar', action='store_true',
+                        help='Obligatorio con --url: usar usuarios carga-admin/carga-analista ya existentes')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', help='Archivo JSON donde guardar el informe')
+    parser.add_argument('--comparar', help='Informe JSON anterior contra el que comparar')
+    args = parser.parse_args()
+
+    if args.url and not args.sin_poblar:
+        parser.error('con --url no se puebla ninguna base: use --sin-poblar con usuarios carga-* ya existentes')
+    if args.sin_poblar and not args.url:
+        parser.error('--sin-poblar requiere --url')
+
+    servidor = None
+    with tempfile.TemporaryDirectory() as directorio:
+        if not args.url:
+            # La configuración se lee al importar cualquier módulo de la aplicación
+            # (también ocr_benchmark): la base temporal debe fijarse antes de todo
+            os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directorio, 'carga.db')}"
+            os.environ['ARCHIVO_DIR'] = os.path.join(directorio, 'archivo')
+            os.environ['IMAGENES_DIR'] = os.path.join(directorio, 'imagenes')
+
+        contexto = {'imagen': None if args.sin_ocr else imagen_muestra(semilla=args.semilla)}
+        if args.url:
+            url_base = args.url.rstrip('/')
+            documentos = {'Admin': 'carga-admin', 'Analista': 'carga-analista'}
+            contexto['operarios'] = operarios_remotos(url_base, documentos['Admin'])
+        else:
+            from main import crear_aplicacion
+
+            app = crear_aplicacion()
+            inicio = time.perf_counter()
+            documentos, contexto['operarios'] = poblar_base(app, args.operarios, args.actividades,
+                                                           args.dias, args.semilla)
+            print(f"Base poblada en {time.perf_counter() - inicio:.1f} s")
+            servidor, url_base = iniciar_servidor(app)
+
+        try:
+            informe = ejecutar_carga(url_base, documentos, contexto, args.usuarios, args.duracion,
+                                     args.calentamiento, semilla=args.semilla)
+        finally:
+            if servidor is not None:
+                servidor.shutdown()
+
+    informe['datos'] = {'operarios': args.operarios, 'actividades': args.actividades, 'dias': args.dias}
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            informe['comparacion'] = comparar_informes(json.load(archivo), informe)
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto)
+    print(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Conversión de los registros extraídos por OCR en filas de Actividad.
+"""
+
+
+def registro_a_fila(registro, usuario_id, fecha, turno='Mañana', imagen_hash=None):
+    """
+    Convierte un registro de procesar_imagen_tabular en un diccionario con las
+    columnas de Actividad (para guardar_actividades). Con `imagen_hash`, la fila
+    queda enlazada a la hoja archivada y a la caja de su fila
+    """
+    fila = {
+        'fecha': fecha,
+        'turno': turno,
+        'hora_inicio': registro.get('hora_inicio', '00:00'),
+        'hora_final': registro.get('hora_final', '00:00'),
+        'codigo_actividad': registro.get('codigo_actividad', ''),
+        'descripcion_actividad': registro.get('unidad_produccion', ''),
+        'codigo_equipo': registro.get('codigo_equipo', ''),
+        # La hoja no tiene columna de orden: como siempre, se toma la referencia
+        'orden_produccion': registro.get('referencia_producto', ''),
+        'referencia_producto': registro.get('referencia_producto', ''),
+        'cantidad_trabajada': int(registro.get('cantidad_trabajada', 0)),
+        'observaciones': registro.get('observaciones', ''),
+        'usuario_id': usuario_id,
+    }
+    if imagen_hash:
+        fila['imagen_hash'] = imagen_hash
+        fila['imagen_bbox'] = ','.join(str(int(v)) for v in registro['bbox']) if registro.get('bbox') else None
+    return fila
+
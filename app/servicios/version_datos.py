@@ -0,0 +1,160 @@
+"""
+Seguimiento de cambios en los datos.
+
+Escucha los eventos de sesión de SQLAlchemy, lleva un contador de versión por
+tabla y avisa a los suscriptores con los cambios confirmados (después del
+commit). Las cachés usan la versión como clave y los suscriptores reciben las
+filas insertadas, actualizadas o eliminadas.
+
+Con varios procesos (wsgi.py + gunicorn) el maestro llama a
+compartir_versiones() antes de crear los workers: los contadores pasan a
+memoria compartida y un commit en un worker cambia la versión que ven todos.
+"""
+import multiprocessing
+import os
+import threading
+import logging
+from collections import namedtuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+Cambio = namedtuple('Cambio', ['tabla', 'operacion', 'datos'])
+
+# Columnas que nunca se copian en los cambios publicados
+COLUMNAS_EXCLUIDAS = {'contraseña'}
+
+TABLAS_COMPARTIDAS = ('usuarios', 'actividades', 'codigos_referencia')
+
+_lock = threading.Lock()
+_versiones = {}
+_propios = {}             # incrementos hechos por este proceso (para restarlos de los compartidos)
+_pid_propios = None
+_compartidas = None       # (posiciones por tabla, multiprocessing.Array) entre procesos
+_suscriptores = []
+_instalado = False
+
+
+def compartir_versiones(tablas=TABLAS_COMPARTIDAS):
+    """
+    Mueve los contadores de `tablas` a memoria compartida. Debe llamarse en el
+    proceso maestro antes de crear los workers (fork)
+    """
+    global _compartidas
+    if _compartidas is None:
+        _compartidas = ({tabla: i for i, tabla in enumerate(tablas)}, multiprocessing.Array('Q', len(tablas)))
+
+
+def _leer(tabla):
+    if _compartidas is not None and tabla in _compartidas[0]:
+        return _compartidas[1][_compartidas[0][tabla]]
+    return _versiones.get(tabla, 0)
+
+
+def version(*tablas):
+    """Devuelve la versión actual de las tablas indicadas (tupla)"""
+    with _lock:
+        return tuple(_leer(tabla) for tabla in tablas)
+
+
+def _propios_del_proceso():
+    # Tras el fork, los incrementos del maestro no son de este worker
+    global _propios, _pid_propios
+    if _pid_propios != os.getpid():
+        _propios = {}
+        _pid_propios = os.getpid()
+    return _propios
+
+
+def version_ajena(*tablas):
+    """
+    Cambios confirmados por otros procesos: la versión menos los commits de
+    este proceso. No cambia con un commit propio, ni siquiera antes de que sus
+    suscriptores terminen de recibirlo
+    """
+    with _lock:
+        propios = _propios_del_proceso()
+        return tuple(_leer(tabla) - propios.get(tabla, 0) for tabla in tablas)
+
+
+def suscribir(funcion):
+    """Registra una función que recibe la lista de cambios de cada commit"""
+    _suscriptores.append(funcion)
+    return funcion
+
+
+def notificar_cambio(tabla, operacion='masivo', datos=None):
+    """
+    Publica un cambio hecho fuera del ORM (p. ej. inserciones masivas con
+    db.session.execute), una vez confirmado
+    """
+    _publicar([Cambio(tabla, operacion, datos or {})])
+
+
+def registrar_cambio(session, tabla, operacion, datos):
+    """
+    Encola un cambio hecho con sentencias core dentro de la transacción de
+    `session`: se publica con el commit y se descarta con el rollback
+    """
+    session.info.setdefault('cambios_pendientes', []).append(Cambio(tabla, operacion, datos))
+
+
+def _publicar(cambios):
+    with _lock:
+        propios = _propios_del_proceso()
+        for tabla in {cambio.tabla for cambio in cambios}:
+            propios[tabla] = propios.get(tabla, 0) + 1
+            if _compartidas is not None and tabla in _compartidas[0]:
+                contadores = _compartidas[1]
+                with contadores.get_lock():
+                    contadores[_compartidas[0][tabla]] += 1
+            else:
+                _versiones[tabla] = _versiones.get(tabla, 0) + 1
+    for funcion in list(_suscriptores):
+        try:
+            funcion(cambios)
+        except Exception as e:
+            logger.error(f"Error notificando cambios a {funcion.__name__}: {str(e)}")
+
+
+def _capturar(objeto):
+    mapper = inspect(objeto).mapper
+    return {
+        atributo.key: getattr(objeto, atributo.key)
+        for atributo in mapper.column_attrs
+        if atributo.key not in COLUMNAS_EXCLUIDAS
+    }
+
+
+def _despues_de_flush(session, contexto):
+    pendientes = session.info.setdefault('cambios_pendientes', [])
+    for objeto in session.new:
+        pendientes.append(Cambio(objeto.__tablename__, 'insertar', _capturar(objeto)))
+    for objeto in session.dirty:
+        if session.is_modified(objeto, include_collections=False):
+            pendientes.append(Cambio(objeto.__tablename__, 'actualizar', _capturar(objeto)))
+    for objeto in session.deleted:
+        pendientes.append(Cambio(objeto.__tablename__, 'eliminar', _capturar(objeto)))
+
+
+def _despues_de_commit(session):
+    cambios = session.info.pop('cambios_pendientes', None)
+    if cambios:
+        _publicar(cambios)
+
+
+def _despues_de_rollback(session):
+    session.info.pop('cambios_pendientes', None)
+
+
+def instalar():
+    """Registra los eventos de sesión (una sola vez por proceso)"""
+    global _instalado
+    if _instalado:
+        return
+    event.listen(Session, 'after_flush', _despues_de_flush)
+    event.listen(Session, 'after_commit', _despues_de_commit)
+    event.listen(Session, 'after_soft_rollback', lambda session, transaccion: _despues_de_rollback(session))
+    _instalado = True
@@ -0,0 +1,23 @@
+// Cliente del flujo en vivo de actividades (Server-Sent Events)
+function iniciarFeedActividades(url, manejadores) {
+    if (!window.EventSource) {
+        return null;
+    }
+
+    const fuente = new EventSource(url);
+
+    fuente.addEventListener('actividad', function (evento) {
+        const datos = JSON.parse(evento.data);
+        if (manejadores.actividad) {
+            manejadores.actividad(datos);
+        }
+    });
+
+    fuente.addEventListener('recargar', function (evento) {
+        if (manejadores.recargar) {
+            manejadores.recargar(JSON.parse(evento.data || '{}'));
+        }
+    });
+
+    return fuente;
+}
@@ -13,4 +13,55 @@ class Config:
     UPLOAD_FOLDER = os.path.join(basedir, 'app', 'static', 'uploads')
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+    # OCR: motores PaddleOCR por proceso, hilos por motor y resolución de rasterizado de PDF
+    OCR_MAX_MOTORES = int(os.getenv('OCR_MAX_MOTORES', 2))
+    OCR_HILOS_CPU = int(os.getenv('OCR_HILOS_CPU', 10))
+    # Con wsgi.py: cargar los modelos en el maestro para compartirlos con los workers
+    OCR_PRECARGAR = os.getenv('OCR_PRECARGAR', '1') == '1'
+    PDF_DPI = int(os.getenv('PDF_DPI', 200))
+    # Estado de los trabajos de PDF, legible desde cualquier worker (directorio compartido)
+    PDF_TRABAJOS_DIR = os.getenv('PDF_TRABAJOS_DIR', os.path.join(basedir, 'trabajos_pdf'))
+
+    # OCR en dos pasadas: rápida sobre la imagen reducida y relectura de las celdas débiles
+    OCR_DOS_PASADAS = os.getenv('OCR_DOS_PASADAS', '1') == '1'
+    OCR_ESCALA_RAPIDA = float(os.getenv('OCR_ESCALA_RAPIDA', 0.5))
+    OCR_UMBRAL_CONFIANZA = float(os.getenv('OCR_UMBRAL_CONFIANZA', 0.85))
+
+    # Archivo histórico: actividades más antiguas que el horizonte van a Parquet
+    ARCHIVO_DIR = os.getenv('ARCHIVO_DIR', os.path.join(basedir, 'archivo'))
+    ARCHIVO_HORIZONTE_DIAS = int(os.getenv('ARCHIVO_HORIZONTE_DIAS', 365))
+
+    # Perfilado bajo demanda (/admin/perfil): límites por captura
+    PERFIL_MAX_PETICIONES = int(os.getenv('PERFIL_MAX_PETICIONES', 100))
+    PERFIL_MAX_SEGUNDOS = float(os.getenv('PERFIL_MAX_SEGUNDOS', 60))
+    # Objetivo, perfiles parciales y capturas compartidos entre los workers
+    PERFIL_DIR = os.getenv('PERFIL_DIR', os.path.join(basedir, 'perfiles'))
+
+    # Duración máxima de cada conexión SSE (el navegador reconecta con Last-Event-ID)
+    SSE_DURACION_MAX = float(os.getenv('SSE_DURACION_MAX', 300))
+
+    # Recarga completa de los códigos de referencia como máximo cada tantos segundos
+    # (los cambios de otros workers se aplican antes por incrementos)
+    REFERENCIAS_RECARGA_MAX = float(os.getenv('REFERENCIAS_RECARGA_MAX', 600))
+
+    # Caché de las consultas filtradas de actividades y tamaño de página (0 = sin paginar)
+    CACHE_CONSULTAS_MB = float(os.getenv('CACHE_CONSULTAS_MB', 64))
+    ACTIVIDADES_POR_PAGINA = int(os.getenv('ACTIVIDADES_POR_PAGINA', 0))
+
+    # Auditoría con escritura diferida: 'tabla' (auditoria) o 'archivo' (JSON rotado)
+    AUDITORIA_DESTINO = os.getenv('AUDITORIA_DESTINO', 'tabla')
+    AUDITORIA_ARCHIVO = os.getenv('AUDITORIA_ARCHIVO', os.path.join(basedir, 'logs', 'auditoria.log'))
+    AUDITORIA_ARCHIVO_MB = int(os.getenv('AUDITORIA_ARCHIVO_MB', 50))
+    AUDITORIA_ARCHIVOS = int(os.getenv('AUDITORIA_ARCHIVOS', 10))
+    AUDITORIA_MAX_COLA = int(os.getenv('AUDITORIA_MAX_COLA', 10000))
+    AUDITORIA_LOTE = int(os.getenv('AUDITORIA_LOTE', 200))
+    AUDITORIA_INTERVALO = float(os.getenv('AUDITORIA_INTERVALO', 1.0))
+
+    # Archivo de imágenes de hojas (fuera de static): calidad JPEG, miniaturas y recortes en memoria
+    IMAGENES_DIR = os.getenv('IMAGENES_DIR', os.path.join(basedir, 'imagenes'))
+    IMAGENES_CALIDAD = int(os.getenv('IMAGENES_CALIDAD', 85))
+    IMAGENES_LADO_MINIATURA = int(os.getenv('IMAGENES_LADO_MINIATURA', 320))
+    IMAGENES_CACHE_RECORTES = int(os.getenv('IMAGENES_CACHE_RECORTES', 512))
+    IMAGENES_PENDIENTES_MAX = int(os.getenv('IMAGENES_PENDIENTES_MAX', 8))
+
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
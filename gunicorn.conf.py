@@ -0,0 +1,59 @@
+"""
+Configuración de gunicorn para producción:
+
+    gunicorn -c gunicorn.conf.py
+
+La aplicación y los modelos OCR se cargan una vez en el maestro (preload_app)
+y los workers se crean con fork. Cada worker atiende WEB_HILOS peticiones
+simultáneas (gthread) y se recicla tras WEB_MAX_PETICIONES peticiones para
+contener fugas de memoria.
+
+Cada dashboard abierto mantiene un flujo SSE que ocupa un hilo hasta
+SSE_DURACION_MAX segundos (luego el navegador reconecta). WEB_HILOS debe
+cubrir los dashboards abiertos por worker más las peticiones normales: con
+menos hilos, los flujos dejan al worker sin hilos para el resto.
+"""
+import gc
+import logging
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:app'
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.getenv('WEB_HILOS', 16))
+worker_class = 'gthread'
+preload_app = True
+
+# Reciclado: la variación evita que todos los workers se reinicien a la vez
+max_requests = int(os.getenv('WEB_MAX_PETICIONES', 1000))
+max_requests_jitter = int(os.getenv('WEB_MAX_PETICIONES_VARIACION', 100))
+# Un worker reciclado termina sus peticiones en curso antes de salir
+graceful_timeout = int(os.getenv('WEB_TIEMPO_CIERRE', 30))
+timeout = int(os.getenv('WEB_TIMEOUT', 120))
+keepalive = 5
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def when_ready(server):
+    # Todo lo precargado pasa a la generación permanente: el recolector no
+    # vuelve a recorrer esos objetos en los workers y sus páginas no se copian
+    gc.freeze()
+    from app.servicios.memoria import memoria_proceso
+    logger.info("Maestro listo: %s", memoria_proceso(os.getpid()))
+
+
+def post_fork(server, worker):
+    # Las conexiones abiertas en el maestro no deben compartirse entre procesos
+    from extensions import db
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    # Escribir la auditoría que quede en la cola antes de que el worker salga
+    from app.servicios.auditoria import escritor
+    escritor.vaciar()
+    from app.servicios.memoria import memoria_proceso
+    logger.info("Worker %s termina: %s", worker.pid, memoria_proceso(worker.pid))
@@ -3,9 +3,19 @@ from extensions import db, login_manager, bcrypt
 from config import Config
 import os
 from app.controladores import auth_bp, admin_bp, analista_bp, operario_bp, api_bp, controller_bp
+from app.servicios.datos_referencia import iniciar_referencias
+from app.servicios.cache_plantillas import instalar_cache_plantillas
+from app.servicios.compresion import instalar_compresion, instalar_recursos_estaticos
+from app.servicios.feed_cambios import iniciar_feed
+from app.servicios.ingesta_actividades import instalar_huellas
+from app.servicios.perfilador import instalar_perfilador
+from app.servicios.auditoria import instalar_auditoria
+from app.comandos import registrar_comandos
 
 def crear_aplicacion():
-    app = Flask(__name__, template_folder=os.path.join('app', 'templates'))
+    app = Flask(__name__,
+                template_folder=os.path.join('app', 'templates'),
+                static_folder=os.path.join('app', 'static'))
     app.config.from_object(Config)
 
     # Inicializar extensiones
@@ -30,12 +40,37 @@ def crear_aplicacion():
         app.register_blueprint(operario_bp, url_prefix='/operario')
         app.register_blueprint(api_bp, url_prefix='/api')
         app.register_blueprint(controller_bp, url_prefix='/controller')
+
+    # Huella de clave natural en cada actividad guardada con el ORM
+    instalar_huellas()
+
+    # Auditoría de usuarios y actividades (escritura diferida en segundo plano)
+    instalar_auditoria(app)
+
+    # Caché de datos de referencia (operarios, equipos, actividades)
+    iniciar_referencias(app)
+
+    # Flujo en vivo de cambios de actividades para los dashboards
+    iniciar_feed()
+
+    # Comandos de mantenimiento (flask archivar-actividades, ...)
+    registrar_comandos(app)
+
+    # Caché de fragmentos, compresión y estáticos con huella
+    instalar_cache_plantillas(app)
+    instalar_compresion(app)
+    instalar_recursos_estaticos(app)
+
+    # Perfilado bajo demanda (inactivo hasta que un admin lo pide en /admin/perfil)
+    instalar_perfilador(app)
+
     @app.route('/')
     def inicio():
         return redirect('/login')
 
     return app
 
+# Desarrollo. En producción: gunicorn -c gunicorn.conf.py (ver wsgi.py)
 if __name__ == '__main__':
     app = crear_aplicacion()
     app.run(debug=True)
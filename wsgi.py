@@ -0,0 +1,26 @@
+"""
+Punto de entrada de producción (gunicorn -c gunicorn.conf.py).
+
+Con preload_app, este módulo se importa una sola vez en el proceso maestro:
+crea la aplicación, importa las bibliotecas pesadas y carga los modelos OCR
+antes de crear los workers, que comparten esas páginas copy-on-write.
+"""
+import os
+
+from app.servicios import version_datos
+
+# Antes de crear la aplicación: las versiones de datos deben vivir en memoria
+# compartida para que un commit en un worker invalide las cachés de todos
+version_datos.compartir_versiones()
+
+from config import Config
+from main import crear_aplicacion
+
+app = crear_aplicacion()
+app.config['PID_MAESTRO'] = os.getpid()
+
+if Config.OCR_PRECARGAR:
+    # Solo se cargan los pesos: no se ejecuta inferencia en el maestro para
+    # no heredar hilos de cómputo ya iniciados en los workers
+    from app.servicios.ocr_servicio import obtener_motor_ocr
+    obtener_motor_ocr()